@@ -8,6 +8,31 @@ calculate_checksum() {
     md5 "$file" | awk -F " = " '{print $2}'
 }
 
+# Below function prints "<md5> <path>" for every file passed as argument.
+md5_files() {
+    [ $# -gt 0 ] || return 0
+    case "$(uname)" in
+        "Darwin")
+            md5 -r "$@"
+            ;;
+        *)
+            md5sum "$@" | sed 's/  / /'
+            ;;
+    esac
+}
+
+# Below function prints "<size> <path>" for every file of a directory.
+file_sizes() {
+    case "$(uname)" in
+        "Darwin")
+            find "$1" -type f -exec stat -f '%z %N' {} +
+            ;;
+        *)
+            find "$1" -type f -exec stat -c '%s %n' {} +
+            ;;
+    esac
+}
+
 # Below function is used to log script execution steps in a separate file for reference.
 generate_log() {
     local log_file="$1"
@@ -37,11 +62,10 @@ copy_files_and_validate() {
     local source_manifest="$3"
     local dest_manifest="$4"
     local log_file="$5"
-    local failed_files=()
-    local total_files=0
-    local failed_count=0
 
-    find "$source_dir" -type f | while read -r src_file; do
+    # Read from a process substitution rather than a pipe, so the totals below are
+    # updated in this shell and not lost with a subshell.
+    while read -r src_file; do
         total_files=$((total_files + 1))
 
         # Calculate source file checksum (just the checksum value)
@@ -84,22 +108,144 @@ copy_files_and_validate() {
             echo "Checksum matched for $src_file"
             generate_log "$log_file" "Checksum matched for $src_file"
         fi
+    done < <(find "$source_dir" -type f)
+}
+
+# Below function copies and verifies one batch of files, given by their path relative to
+# the source parent directory. All sources of the batch are hashed by a single md5 process,
+# copied, then all copies are hashed by another one. Prints "OK|FAIL <md5> <path>" per file,
+# a file that could not be copied or read back is a failure.
+transfer_batch() {
+    local source_parent_dir="$1"
+    local dest_dir="$2"
+    shift 2
+    local sums
+    sums=$(mktemp -d)
+
+    (cd "$source_parent_dir" && md5_files "$@") > "$sums/source" 2>/dev/null || true
+    local relative_path
+    for relative_path in "$@"; do
+        mkdir -p "$(dirname "$dest_dir/$relative_path")"
+        cp -p "$source_parent_dir/$relative_path" "$dest_dir/$relative_path" 2>/dev/null || true
     done
+    (cd "$dest_dir" && md5_files "$@") > "$sums/dest" 2>/dev/null || true
+
+    awk '
+        FILENAME == ARGV[1] {
+            source[substr($0, index($0, " ") + 1)] = $1
+            next
+        }
+        FILENAME == ARGV[2] {
+            dest[substr($0, index($0, " ") + 1)] = $1
+            next
+        }
+        {
+            if (($0 in source) && ($0 in dest) && source[$0] == dest[$0]) {
+                print "OK", source[$0], $0
+            } else {
+                print "FAIL", (($0 in source) ? source[$0] : "-"), $0
+            }
+        }
+    ' "$sums/source" "$sums/dest" <(printf '%s\n' "$@")
+    rm -rf "$sums"
+}
+
+# Below function is the batched transfer mode. Files already recorded in the destination
+# manifest by a previous run, and whose copy is still there with the size of the source, are
+# skipped. The other files are copied and verified in batches of "batch" files by a pool of
+# "jobs" workers, so a rerun after a partial failure only copies the failed or missing files.
+# The destination manifest only ever holds verified files.
+transfer_files_and_validate() {
+    local source_dir="$1"
+    local dest_dir="$2"
+    local source_manifest="$3"
+    local dest_manifest="$4"
+    local log_file="$5"
+    local jobs="$6"
+    local batch="$7"
+    local source_parent_dir
+    source_parent_dir=$(dirname "$source_dir")
+    local work
+    work=$(mktemp -d)
+
+    # Verified files of previous runs, "<md5> <path>".
+    touch "$work/verified"
+    if [ -f "$dest_manifest" ]; then
+        cp "$dest_manifest" "$work/verified"
+    fi
+
+    # Split the source files into those to skip and those to transfer.
+    local name
+    name=$(basename "$source_dir")
+    (cd "$source_parent_dir" && file_sizes "$name") > "$work/source_sizes"
+    touch "$work/dest_sizes"
+    if [ -d "$dest_dir/$name" ]; then
+        (cd "$dest_dir" && file_sizes "$name") > "$work/dest_sizes"
+    fi
+    awk -v kept="$work/kept" -v todo="$work/todo" '
+        FILENAME == ARGV[1] {
+            verified[substr($0, index($0, " ") + 1)] = $1
+            next
+        }
+        FILENAME == ARGV[2] {
+            dest_size[substr($0, index($0, " ") + 1)] = $1
+            next
+        }
+        {
+            path = substr($0, index($0, " ") + 1)
+            if ((path in verified) && (path in dest_size) && dest_size[path] == $1) {
+                print verified[path], path > kept
+            } else {
+                print path > todo
+            }
+        }
+    ' "$work/verified" "$work/dest_sizes" "$work/source_sizes"
+    touch "$work/kept" "$work/todo"
+    total_files=$(( $(wc -l < "$work/source_sizes") ))
+    skipped_count=$(( $(wc -l < "$work/kept") ))
+
+    echo "$skipped_count of $total_files files already verified at the destination, transferring the others with $jobs worker(s)"
+    generate_log "$log_file" "$skipped_count of $total_files files already verified at the destination, transferring the others with $jobs worker(s)"
+
+    export -f md5_files transfer_batch
+    mkdir -p "$work/parts"
+    xargs -0 -n "$batch" -P "$jobs" bash -c 'transfer_batch "$@" > "$(mktemp "$0/part.XXXXXX")"' \
+        "$work/parts" "$source_parent_dir" "$dest_dir" < <(tr '\n' '\0' < "$work/todo")
+
+    cp "$work/kept" "$work/manifest"
+    cp "$work/kept" "$work/source_manifest"
+    while read -r status checksum relative_path; do
+        if [[ "$checksum" != "-" ]]; then
+            echo "$checksum $relative_path" >> "$work/source_manifest"
+        fi
+        if [[ "$status" == "OK" ]]; then
+            echo "$checksum $relative_path" >> "$work/manifest"
+            copied_count=$((copied_count + 1))
+            echo "Checksum matched for $source_parent_dir/$relative_path"
+            generate_log "$log_file" "Checksum matched for $source_parent_dir/$relative_path"
+        else
+            echo "Checksum mismatch for $source_parent_dir/$relative_path and $dest_dir/$relative_path"
+            generate_log "$log_file" "Checksum mismatch for $source_parent_dir/$relative_path and $dest_dir/$relative_path"
+            failed_files+=("$relative_path")
+            failed_count=$((failed_count + 1))
+        fi
+    done < <(find "$work/parts" -type f -name 'part.*' -exec cat {} +)
 
-    # Return failed files and count
-    echo "${failed_files[@]}"
-    return $failed_count
+    LC_ALL=C sort -t ' ' -k2 "$work/manifest" > "$dest_manifest"
+    LC_ALL=C sort -t ' ' -k2 "$work/source_manifest" > "$source_manifest"
+    rm -rf "$work"
 }
 
 # Below function summarises the script execution indicating success if all files were copied properly to the destination
 # and indicates fail if not. Failed files are printed for user's reference.
 report_summary() {
     local total_files="$1"
-    local failed_files=("$@")
-    local failed_count="${failed_files[0]}"
-    shift 1
+    local failed_count="$2"
+    shift 2
     local failed_list=("$@")
 
+    echo "$total_files files processed, $skipped_count already verified, $((total_files - skipped_count - failed_count)) copied with matching checksums, $failed_count failed."
+
     if [[ "$failed_count" -eq 0 ]]; then
         echo "SUCCESS. All checksums match. All of your files have copied successfully to your destination directory with integrity."
         echo "The checksum file manifest is stored next to your destination directory and a copy has been kept in the 'ucc_moveit_manifests' folder on your desktop for your future reference."
@@ -117,6 +263,28 @@ report_summary() {
 
 # Below code controls the flow of execution of the entire script.
 main() {
+    transfer=false
+    jobs=$(getconf _NPROCESSORS_ONLN 2>/dev/null || echo 4)
+    batch=64
+
+    while getopts ":tj:b:" opt; do
+        case $opt in
+            t)
+                transfer=true
+                ;;
+            j)
+                jobs="$OPTARG"
+                ;;
+            b)
+                batch="$OPTARG"
+                ;;
+            \?)
+                echo "Invalid option- $OPTARG" >&2
+                exit 1
+                ;;
+        esac
+    done
+    shift $((OPTIND-1))
 
     local source="$1"
     local dest="$2"
@@ -170,14 +338,30 @@ main() {
     generate_log "$log_file" "Source: $source"
     generate_log "$log_file" "Destination: $dest"
 
+    # Totals updated by the copy functions
+    total_files=0
+    skipped_count=0
+    copied_count=0
+    failed_count=0
+    failed_files=()
+
     # Copy files and validate checksums
-    failed_files=$(copy_files_and_validate "$source" "$dest" "$source_manifest" "$dest_manifest" "$log_file")
-    failed_count=$?
+    if [ "$transfer" == true ]; then
+        transfer_files_and_validate "$source" "$dest" "$source_manifest" "$dest_manifest" "$log_file" "$jobs" "$batch"
+    else
+        copy_files_and_validate "$source" "$dest" "$source_manifest" "$dest_manifest" "$log_file"
+    fi
 
     # Report summary
-    report_summary "$failed_count" "${failed_files[@]}"
+    report_summary "$total_files" "$failed_count" "${failed_files[@]}"
 
-    generate_log "$log_file" "File copy and checksum validation completed successfully"
+    generate_log "$log_file" "$total_files files processed, $skipped_count already verified, $failed_count failed"
+    if [[ "$failed_count" -eq 0 ]]; then
+        generate_log "$log_file" "File copy and checksum validation completed successfully"
+    else
+        generate_log "$log_file" "File copy and checksum validation completed with $failed_count failure(s)"
+        exit 1
+    fi
 }
 
 main "$@"
@@ -51,15 +51,142 @@ manifest_file_count() {
     echo $count_in_manifest
 }
 
+# Below function prints "<md5> <path>" for every file passed as argument.
+md5_files() {
+    [ $# -gt 0 ] || return 0
+    case "$(uname)" in
+        "Darwin")
+            md5 -r "$@"
+            ;;
+        *)
+            md5sum "$@" | sed 's/  / /'
+            ;;
+    esac
+}
+
+# Below function hashes the files listed (one per line) on its input with a pool of
+# "jobs" md5 workers taking "batch" files each, and prints "<md5> <path>" lines.
+# Every worker writes to its own part file so lines of different workers never mix.
+hash_file_list() {
+    local jobs="$1"
+    local batch="$2"
+    local parts
+    parts=$(mktemp -d)
+    export -f md5_files
+    tr '\n' '\0' | xargs -0 -n "$batch" -P "$jobs" bash -c 'md5_files "$@" > "$(mktemp "$0/part.XXXXXX")"' "$parts"
+    find "$parts" -type f -name 'part.*' -exec cat {} +
+    rm -rf "$parts"
+}
+
+# Below function prints the paths of the "todo" list missing from the "<md5> <path>" lines
+# of "hashed", the files md5 could not read or that disappeared before being hashed.
+unhashed_paths() {
+    local todo="$1"
+    local hashed="$2"
+
+    awk '
+        FILENAME == ARGV[1] {
+            match($0, /^[^ ]+ /)
+            done[substr($0, RLENGTH + 1)] = 1
+            next
+        }
+        !($0 in done) { print }
+    ' "$hashed" "$todo"
+}
+
+# Below function prints "<size> <mtime> <path>" for every file of a directory.
+file_stats() {
+    case "$(uname)" in
+        "Darwin")
+            find "$1" -type f -exec stat -f '%z %m %N' {} +
+            ;;
+        *)
+            find "$1" -type f -exec stat -c '%s %Y %n' {} +
+            ;;
+    esac
+}
+
+# Below function prints "<md5> <path>" for the files whose path, size and mtime are unchanged
+# since the previous state file, and writes the paths of all other files to "todo".
+reuse_digests() {
+    local stats="$1"
+    local previous_state="$2"
+    local prefix="$3"
+    local todo="$4"
+
+    awk -v prefix="$prefix" -v todo="$todo" '
+        FILENAME == ARGV[1] {
+            match($0, /^[^ ]+ [^ ]+ [^ ]+ /)
+            split(substr($0, 1, RLENGTH - 1), f, " ")
+            path = substr($0, RLENGTH + 1)
+            digest[path] = f[1]
+            known[path] = f[2] " " f[3]
+            next
+        }
+        {
+            match($0, /^[^ ]+ [^ ]+ /)
+            path = substr($0, RLENGTH + 1)
+            rel = path
+            if (index(rel, prefix) == 1) rel = substr(rel, length(prefix) + 1)
+            if ((rel in known) && known[rel] == substr($0, 1, RLENGTH - 1)) {
+                print digest[rel], path
+            } else {
+                print path > todo
+            }
+        }
+    ' "$previous_state" "$stats"
+    touch "$todo"
+}
+
+# Below function records the size and mtime of every file of the manifest along with its digest,
+# for the next incremental run to reuse.
+write_state() {
+    local manifest="$1"
+    local stats="$2"
+    local prefix="$3"
+    local state="$4"
+
+    awk -v prefix="$prefix" '
+        FILENAME == ARGV[1] {
+            match($0, /^[^ ]+ [^ ]+ /)
+            path = substr($0, RLENGTH + 1)
+            if (index(path, prefix) == 1) path = substr(path, length(prefix) + 1)
+            stat[path] = substr($0, 1, RLENGTH - 1)
+            next
+        }
+        {
+            match($0, /^[^ ]+ /)
+            path = substr($0, RLENGTH + 1)
+            if (path in stat) print substr($0, 1, RLENGTH - 1), stat[path], path
+        }
+    ' "$stats" "$manifest" > "$state"
+}
+
 # Below code controls the flow of execution of the entire script.
 main() {
     sidecar=false
+    parallel=false
+    incremental=false
+    jobs=$(getconf _NPROCESSORS_ONLN 2>/dev/null || echo 4)
+    batch=64
 
-    while getopts ":s" opt; do
+    while getopts ":spj:b:r" opt; do
         case $opt in 
             s) 
                 sidecar=true
                 ;;
+            p)
+                parallel=true
+                ;;
+            j)
+                jobs="$OPTARG"
+                ;;
+            b)
+                batch="$OPTARG"
+                ;;
+            r)
+                incremental=true
+                ;;
             \?)
                 echo "Invalid option- $OPTARG" >&2
                 exit 1
@@ -89,6 +216,8 @@ main() {
     local log_name_source_="${relative_path}_$(date +"%Y_%m_%dT%H_%M_%S")"
     local manifest
     local log_name_source
+    local stats=""
+    local failed=""
 
     if [ "$sidecar" == true ]; then
         manifest="$source_parent_dir/${relative_path}_manifest.md5"
@@ -137,6 +266,25 @@ main() {
     local source_count
     source_count=$(find "$source" -type f | wc -l)
 
+    local dirbase
+    dirbase=$(dirname "$source")
+    local state="${manifest%.md5}.stat"
+    local previous_state=""
+
+    if [ -f "$manifest" ] && [ "$incremental" == true ]; then
+        # Keep the previous manifest, its file sizes and mtimes are used to reuse digests.
+        local old_manifests_dir
+        old_manifests_dir="$(make_desktop_manifest_dir)/old_manifests"
+        local old_manifest="${old_manifests_dir}/$(basename "${manifest%.md5}")_$(date +"%Y_%m_%dT%H_%M_%S")"
+        mv "$manifest" "${old_manifest}.md5"
+        if [ -f "$state" ]; then
+            mv "$state" "${old_manifest}.stat"
+            previous_state="${old_manifest}.stat"
+        fi
+        echo " - Previous manifest moved to ${old_manifest}.md5"
+        generate_log "$log_name_source" "EVENT = Previous manifest moved to ${old_manifest}.md5"
+    fi
+
     if [ -f "$manifest" ]; then
         echo ' - A manifest already exists'
         local count_in_manifest
@@ -149,22 +297,68 @@ main() {
     else
         echo "Generating source manifest"
         generate_log "$log_name_source" "EVENT = Generating source manifest"
-        #find "$source" -type f -exec md5 {} \; > "$manifest"
+        stats=$(mktemp)
+        file_stats "$source" > "$stats"
 
-        find "$source" -type f -exec sh -c '
-        for file do
-        md5 "$file" | awk -F " = " '\''{print $2, substr($1, index($1, "(")+1, length($1)-index($1, "(")-1)}'\'' 
-        done
-        ' sh {} + > "$manifest"
+        if [ "$parallel" == true ] || [ "$incremental" == true ]; then
+            [ "$parallel" == true ] || jobs=1
+            local todo
+            todo=$(mktemp)
+            reuse_digests "$stats" "${previous_state:-/dev/null}" "${dirbase}/" "$todo" > "${manifest}.tmp"
+            local reused
+            reused=$(manifest_file_count "${manifest}.tmp")
+            echo "Reusing $reused digest(s) from the previous manifest, hashing $(manifest_file_count "$todo") file(s) with $jobs worker(s)"
+            generate_log "$log_name_source" "EVENT = Reusing $reused digest(s) from the previous manifest, hashing $(manifest_file_count "$todo") file(s) with $jobs worker(s)"
+            local hashed
+            hashed=$(mktemp)
+            hash_file_list "$jobs" "$batch" < "$todo" > "$hashed"
+            failed=$(mktemp)
+            unhashed_paths "$todo" "$hashed" > "$failed"
+            while read -r file; do
+                echo "Failure - $file could not be hashed"
+                generate_log "$log_name_source" "EVENT = Manifest generation - Failure - $file could not be hashed"
+            done < "$failed"
+            cat "$hashed" >> "${manifest}.tmp"
+            LC_ALL=C sort -t ' ' -k2 "${manifest}.tmp" > "$manifest"
+            rm -f "${manifest}.tmp" "$todo" "$hashed"
+        else
+            #find "$source" -type f -exec md5 {} \; > "$manifest"
+
+            find "$source" -type f -exec sh -c '
+            for file do
+            md5 "$file" | awk -F " = " '\''{print $2, substr($1, index($1, "(")+1, length($1)-index($1, "(")-1)}'\'' 
+            done
+            ' sh {} + > "$manifest"
+        fi
     fi
 
-    local dirbase
-    dirbase=$(dirname "$source")
     escaped_base_dir=$(echo "$dirbase" | sed 's/[\/&]/\\&/g; s/ /\\ /g')
     sed -i '' "s|${escaped_base_dir}/||" "$manifest"
 
+    if [ -n "$stats" ]; then
+        write_state "$manifest" "$stats" "${dirbase}/" "$state"
+        rm -f "$stats"
+        if [[ $source_count -ne $(manifest_file_count "$manifest") ]]; then
+            echo "Warning - $(manifest_file_count "$manifest") of $source_count files could be hashed, check the permissions of the missing files"
+            generate_log "$log_name_source" "EVENT = Manifest generation - Failure - $(manifest_file_count "$manifest") of $source_count files could be hashed"
+        fi
+    fi
+
     echo "Manifest created in $manifest"
     generate_log "$log_name_source" "Manifest created in $manifest"
+
+    # Files that could not be hashed are left out of the manifest (and of the state, so the
+    # next incremental run hashes them again), the run fails like the serial one would.
+    if [ -n "$failed" ]; then
+        local failed_count
+        failed_count=$(manifest_file_count "$failed")
+        rm -f "$failed"
+        if [[ $failed_count -ne 0 ]]; then
+            echo "$failed_count file(s) could not be hashed - exiting with an error"
+            generate_log "$log_name_source" "manifest.sh exit - $failed_count file(s) could not be hashed"
+            exit 1
+        fi
+    fi
 }
 
 main "$@"
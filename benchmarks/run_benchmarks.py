@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+import os
+import io
+import sys
+import json
+import random
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import struct
+import statistics
+import subprocess
+from contextlib import redirect_stdout
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+FAKE_TOOLS_DIR = os.path.join(BENCH_DIR, "fake_tools")
+RAW_EXTENSIONS = [".cr2", ".nef", ".iiq", ".mov", ".mxf"]
+QUICKTIME_HEADER = struct.pack('>I4s4sI4s', 20, b'ftyp', b'qt  ', 0, b'qt  ')
+sys.path.insert(0, REPO_DIR)
+
+from synthetic import SCALES, make_collection, add_noise, make_csv_files, make_pdf, write_file
+
+# Below function parses input arguments from the command line provided by the user.
+def arg_parse():
+
+    '''
+    Enter the arguments required
+    '''
+
+    parser = argparse.ArgumentParser(
+        description="Runs the benchmark suite of the repository scripts on generated synthetic collections \
+            and writes the timings as JSON, optionally comparing them with a stored baseline."
+    )
+
+    parser.add_argument('-scale',
+                        choices=list(SCALES),
+                        type=str,
+                        default='small',
+                        help="Size of the synthetic collections")
+
+    parser.add_argument('-repeat',
+                        type=int,
+                        default=3,
+                        help="Number of timed runs of each benchmark, the median is reported")
+
+    parser.add_argument('-only',
+                        type=str,
+                        nargs='+',
+                        default=[],
+                        help="Names of the benchmarks to run (default all)")
+
+    parser.add_argument('-latency',
+                        type=float,
+                        default=0.05,
+                        help="Latency in seconds of each call of the fake exiftool/mediainfo/jhove")
+
+    parser.add_argument('-read_rate',
+                        type=float,
+                        default=100,
+                        help="Rate in MiB/s at which the fake exiftool/mediainfo read files, as from a NAS (0 for the disk speed)")
+
+    parser.add_argument('-o',
+                        type=str,
+                        default="",
+                        help="JSON file to write the results to (default benchmarks/results/benchmark_<timestamp>.json)")
+
+    parser.add_argument('-baseline',
+                        type=str,
+                        default=os.path.join(BENCH_DIR, "baseline.json"),
+                        help="JSON results of a previous run to compare with")
+
+    parser.add_argument('-save_baseline',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="Store the results of this run as the baseline. Enter y/n")
+
+    parser.add_argument('-threshold',
+                        type=float,
+                        default=1.10,
+                        help="A benchmark slower than the baseline by more than this ratio is reported as a regression")
+
+    parser.add_argument('-workdir',
+                        type=str,
+                        default="",
+                        help="Directory to generate the synthetic collections in (default a temporary directory)")
+
+    parsed_args = parser.parse_args()
+    return parsed_args
+
+# Below function runs one of the repository scripts the way a user would, with its
+# logs written under the benchmark home directory.
+def run_script(ctx, script, *script_args):
+    command = [sys.executable, os.path.join(REPO_DIR, script)] + [str(a) for a in script_args]
+    completed = subprocess.run(command, cwd=REPO_DIR, env=ctx["env"], stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"{script} failed - {completed.stderr.strip()}")
+
+# Below functions set up one benchmark each. They return the function preparing a
+# run (not timed), the function timed, and the amount of work done by one run.
+
+def bench_hashlib_md5(ctx):
+    from ip_creator import hashlib_md5
+    av_folder = os.path.join(ctx["collection"]["root"], "av")
+    files = [os.path.join(av_folder, f) for f in sorted(os.listdir(av_folder))]
+
+    def run():
+        with redirect_stdout(io.StringIO()):
+            for f in files:
+                hashlib_md5(f)
+    return None, run, {"files": len(files), "bytes": sum(os.path.getsize(f) for f in files)}
+
+def bench_objects_and_supplements_ip(ctx):
+    from ip_creator import Arguments, objects_and_supplements_ip
+    output = os.path.join(ctx["workdir"], "ip_output")
+    args = Arguments()
+    args.i = ctx["collection"]["root"]
+    args.format = ".tiff"
+    args.format_list = [".tif", ".tiff"]
+    args.supplement = [".txt"]
+    args.o = output
+    args.uid = "bench0001"
+    args.kfs = 'y'
+    args.retries = 3
+    args.backoff = 2.0
+    args.objects_folder = os.path.join(output, args.uid, "objects")
+    args.supplement_folder = os.path.join(output, args.uid, "supplement")
+
+    def prepare():
+        shutil.rmtree(output, ignore_errors=True)
+        os.makedirs(args.objects_folder)
+        os.makedirs(args.supplement_folder)
+
+    def run():
+        with redirect_stdout(io.StringIO()):
+            objects_and_supplements_ip(args, ctx["log"])
+
+    files = 0
+    size = 0
+    for root, _, names in os.walk(args.i):
+        for name in names:
+            if os.path.splitext(name)[1].lower() in args.format_list + args.supplement:
+                files += 1
+                size += os.path.getsize(os.path.join(root, name))
+    return prepare, run, {"files": files, "bytes": size}
+
+def bench_master_csv_merge(ctx):
+    from metadata_extractor import merge_csv_files
+    csv_folder = os.path.join(ctx["workdir"], "exif_csv")
+    generated = make_csv_files(csv_folder, SCALES[ctx["scale"]]["csv_files"])
+    master_csv = os.path.join(ctx["workdir"], "exif_master.csv")
+
+    def run():
+        merge_csv_files(csv_folder, master_csv)
+    size = sum(os.path.getsize(os.path.join(csv_folder, f)) for f in os.listdir(csv_folder))
+    return None, run, {"files": generated["files"], "bytes": size}
+
+# Below function returns a folder of tiff images small enough for every image to go
+# through the fake exiftool, generating it on first use.
+def exif_input(ctx):
+    source = os.path.join(ctx["workdir"], "exif_input")
+    if not os.path.isdir(source):
+        rng = random.Random(1)
+        for n in range(SCALES[ctx["scale"]]["exif_files"]):
+            folder = os.path.join(source, f"folder_{n % 5}")
+            os.makedirs(folder, exist_ok=True)
+            write_file(os.path.join(folder, f"image_{n}.tif"), rng.randint(1 << 10, 1 << 20), rng)
+    return source
+
+def bench_image_exiftool(ctx):
+    from metadata_extractor import image_exiftool
+    from ip_creator import Arguments
+    source = exif_input(ctx)
+    output = os.path.join(ctx["workdir"], "exif_output")
+    args = Arguments()
+    args.i = source
+    args.img = ".tiff"
+    args.o = output
+
+    def prepare():
+        shutil.rmtree(output, ignore_errors=True)
+
+    def run():
+        with redirect_stdout(io.StringIO()):
+            image_exiftool(args, ctx["log"])
+
+    files = [os.path.join(r, n) for r, _, names in os.walk(source) for n in names if n.lower().endswith((".tif", ".tiff"))]
+    return prepare, run, {"files": len(files), "bytes": sum(os.path.getsize(f) for f in files)}
+
+# Below function returns a folder of RAW camera and AV files (the formats the fast
+# metadata tier is meant for), generating it on first use. The AV files start with
+# a QuickTime header so pymediainfo skips their media data as it does for real files.
+def raw_input(ctx):
+    source = os.path.join(ctx["workdir"], "raw_input")
+    if not os.path.isdir(source):
+        rng = random.Random(2)
+        os.makedirs(source)
+        for n in range(SCALES[ctx["scale"]]["raw_files"]):
+            ext = RAW_EXTENSIONS[n % len(RAW_EXTENSIONS)]
+            path = os.path.join(source, f"capture_{n}{ext}")
+            write_file(path, SCALES[ctx["scale"]]["raw_size"], rng)
+            if ext in (".mov", ".mxf"):
+                with open(path, 'r+b') as f:
+                    f.write(QUICKTIME_HEADER + struct.pack('>I4s', SCALES[ctx["scale"]]["raw_size"] - 20, b'mdat'))
+    return source
+
+# Below function times metadata_extractor.py over the RAW and AV files at one
+# extraction tier, dropping the files from the page cache before each run so the
+# tools read them from the disk as they would from a NAS.
+def bench_metadata_tier(ctx, fast):
+    from metadata_extractor import image_exiftool, av_mediainfo
+    from ip_creator import Arguments
+    from hash_reader import advise
+    source = raw_input(ctx)
+    output = os.path.join(ctx["workdir"], "raw_output")
+    args = Arguments()
+    args.i = source
+    args.img = ".cr2 .nef .iiq"
+    args.av = ".mov .mxf"
+    args.o = output
+    args.fast = fast
+    files = [os.path.join(source, n) for n in os.listdir(source)]
+
+    def prepare():
+        shutil.rmtree(output, ignore_errors=True)
+        for file in files:
+            with open(file, 'rb') as f:
+                advise(f.fileno(), 0, 0, 'POSIX_FADV_DONTNEED')
+
+    def run():
+        with redirect_stdout(io.StringIO()):
+            image_exiftool(args, ctx["log"])
+            av_mediainfo(args, ctx["log"])
+    return prepare, run, {"files": len(files), "bytes": sum(os.path.getsize(f) for f in files)}
+
+def bench_ip_creator(ctx, pipeline='n'):
+    source = exif_input(ctx)
+    output = os.path.join(ctx["workdir"], "ip_creator_output")
+
+    def prepare():
+        shutil.rmtree(output, ignore_errors=True)
+
+    def run():
+        run_script(ctx, "ip_creator.py", "-i", source, "-format", ".tiff", "-uid", "benc0001", "-o", output,
+                   "-kfs", "n", "-supplement", ".txt", "-jhove", "y", "-brunnhilde", "n", "-pipeline", pipeline)
+
+    files = [os.path.join(r, n) for r, _, names in os.walk(source) for n in names]
+    return prepare, run, {"files": len(files), "bytes": sum(os.path.getsize(f) for f in files)}
+
+def script_benchmark(script, *script_args, noise=True):
+    def bench(ctx):
+        root = ctx["collection"]["root"]
+
+        def prepare():
+            if noise:
+                add_noise(root, SCALES[ctx["scale"]]["noise"])
+
+        def run():
+            run_script(ctx, script, *[a.format(root=root, workdir=ctx["workdir"]) for a in script_args])
+        return prepare, run, {"files": ctx["collection"]["files"], "bytes": ctx["collection"]["bytes"]}
+    return bench
+
+def bench_pdf2csv(ctx, parallel='n'):
+    pdf = os.path.join(ctx["workdir"], "finding_aid.pdf")
+    pages = SCALES[ctx["scale"]]["pdf_pages"]
+    if not os.path.isfile(pdf):
+        make_pdf(pdf, pages)
+    output = os.path.join(ctx["workdir"], "pdf_output")
+
+    def run():
+        run_script(ctx, "pdf2csv.py", "-i", pdf, "-start", 1, "-end", pages, "-o", output,
+                   "-cache", "n", "-parallel", parallel)
+    return None, run, {"files": 1, "bytes": os.path.getsize(pdf), "pages": pages}
+
+BENCHMARKS = {
+    "hashlib_md5": bench_hashlib_md5,
+    "objects_and_supplements_ip": bench_objects_and_supplements_ip,
+    "master_csv_merge": bench_master_csv_merge,
+    "image_exiftool": bench_image_exiftool,
+    "metadata_full": lambda ctx: bench_metadata_tier(ctx, fast='n'),
+    "metadata_fast": lambda ctx: bench_metadata_tier(ctx, fast='y'),
+    "ip_creator": bench_ip_creator,
+    "ip_creator_pipeline": lambda ctx: bench_ip_creator(ctx, pipeline='y'),
+    "search_duplicates": script_benchmark("search_duplicates.py", "-i", "{root}"),
+    "search_duplicates_parallel": script_benchmark("search_duplicates.py", "-i", "{root}", "-parallel", "y"),
+    "folder_summary": script_benchmark("folder_summary.py", "-i", "{root}"),
+    "folder_summary_parallel": script_benchmark("folder_summary.py", "-i", "{root}", "-parallel", "y"),
+    "pdf2csv": bench_pdf2csv,
+    "pdf2csv_parallel": lambda ctx: bench_pdf2csv(ctx, parallel='y'),
+}
+
+# Below function times "repeat" runs of a benchmark and returns its results.
+def time_benchmark(ctx, name, repeat):
+    prepare, run, work = BENCHMARKS[name](ctx)
+    runs = []
+    for _ in range(repeat):
+        if prepare:
+            prepare()
+        start = time.perf_counter()
+        run()
+        runs.append(time.perf_counter() - start)
+    median = statistics.median(runs)
+    result = {"median_seconds": round(median, 6),
+              "min_seconds": round(min(runs), 6),
+              "runs": [round(r, 6) for r in runs]}
+    result.update(work)
+    if median and work.get("bytes"):
+        result["mb_per_second"] = round(work["bytes"] / median / 2**20, 2)
+    if median and work.get("files"):
+        result["files_per_second"] = round(work["files"] / median, 2)
+    return result
+
+# Below function prints the results next to the baseline and returns the names of
+# the benchmarks slower than the baseline by more than "threshold".
+def compare(results, baseline, threshold):
+    regressions = []
+    print(f"\n{'benchmark':32} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, result in results["benchmarks"].items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if not base:
+            print(f"{name:32} {'-':>10} {result['median_seconds']:>10.3f}")
+            continue
+        ratio = result["median_seconds"] / base["median_seconds"] if base["median_seconds"] else 0.0
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:32} {base['median_seconds']:>10.3f} {result['median_seconds']:>10.3f} {ratio:>6.2f}x{flag}")
+    if baseline.get("scale") != results["scale"]:
+        print(f"Warning - the baseline was recorded at scale {baseline.get('scale')}, this run used {results['scale']}")
+    return regressions
+
+# Below function generates the collections, runs the selected benchmarks and
+# writes/compares the results.
+def main():
+    args = arg_parse()
+    names = args.only or list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        print(f" - Unknown benchmark(s) {unknown}, available : {list(BENCHMARKS)}")
+        sys.exit(1)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="ucclib_bench_")
+    home = os.path.join(workdir, "home")
+    os.makedirs(os.path.join(home, "jhove"), exist_ok=True)
+    jhove = os.path.join(home, "jhove", "jhove")
+    if not os.path.exists(jhove):
+        os.symlink(os.path.join(FAKE_TOOLS_DIR, "jhove"), jhove)
+
+    # The scripts read their mapper csv files from the working directory and log to
+    # ~/Desktop, the fake tools come first on the PATH.
+    env = dict(os.environ)
+    env["HOME"] = home
+    env["PATH"] = FAKE_TOOLS_DIR + os.pathsep + env.get("PATH", "")
+    env["FAKE_TOOL_LATENCY"] = str(args.latency)
+    if args.read_rate:
+        env["FAKE_TOOL_READ_RATE"] = str(args.read_rate)
+    os.environ.update(env)
+    os.chdir(REPO_DIR)
+
+    print(f"Generating {args.scale} synthetic collection in {workdir}")
+    collection_root = os.path.join(workdir, "collection")
+    start = time.perf_counter()
+    collection = make_collection(collection_root, args.scale)
+    print(f"{collection['files']} files, {collection['bytes'] / 2**20:.1f} MiB generated in {time.perf_counter() - start:.1f} seconds")
+
+    ctx = {"workdir": workdir, "scale": args.scale, "collection": collection, "env": env,
+           "log": os.path.join(workdir, "benchmarks.log")}
+
+    results = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "scale": args.scale,
+               "repeat": args.repeat,
+               "fake_tool_latency": args.latency,
+               "fake_tool_read_rate": args.read_rate,
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "cpu_count": os.cpu_count(),
+               "benchmarks": {}}
+    try:
+        for name in names:
+            print(f"Running {name} ...", end=" ", flush=True)
+            results["benchmarks"][name] = time_benchmark(ctx, name, args.repeat)
+            print(f"{results['benchmarks'][name]['median_seconds']:.3f} s")
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.o or os.path.join(BENCH_DIR, "results", time.strftime("benchmark_%Y_%m_%dT%H_%M_%S.json"))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    regressions = []
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+    if args.save_baseline == 'y':
+        shutil.copyfile(output, args.baseline)
+        print(f"Baseline stored in {args.baseline}")
+
+    if regressions:
+        print(f"Regressions above {args.threshold}x : {regressions}")
+        sys.exit(1)
+
+# Below code marks the start of execution of the program.
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+import os
+import random
+
+# Size presets of the synthetic collections used by run_benchmarks.py.
+SCALES = {
+    "small": {"depth": 3, "fanout": 3, "files_per_dir": 10, "small_sizes": (1 << 10, 64 << 10),
+              "huge_files": 2, "huge_size": 32 << 20, "clusters": 20, "cluster_size": 3,
+              "noise": 40, "csv_files": 300, "exif_files": 40, "raw_files": 10, "raw_size": 16 << 20, "pdf_pages": 40},
+    "medium": {"depth": 4, "fanout": 3, "files_per_dir": 20, "small_sizes": (1 << 10, 256 << 10),
+               "huge_files": 2, "huge_size": 256 << 20, "clusters": 100, "cluster_size": 4,
+               "noise": 200, "csv_files": 2000, "exif_files": 200, "raw_files": 20, "raw_size": 64 << 20, "pdf_pages": 200},
+    "large": {"depth": 5, "fanout": 4, "files_per_dir": 20, "small_sizes": (1 << 10, 1 << 20),
+              "huge_files": 4, "huge_size": 1 << 30, "clusters": 500, "cluster_size": 4,
+              "noise": 1000, "csv_files": 10000, "exif_files": 1000, "raw_files": 40, "raw_size": 256 << 20, "pdf_pages": 800},
+}
+
+SMALL_EXTENSIONS = [".tif", ".tif", ".jpg", ".txt", ".docx", ".xml"]
+NOISE_FILES = [".DS_Store", "Thumbs.db", "desktop.ini"]
+BLOCK = 1 << 20
+
+# Below function writes "size" bytes of pseudo random content to a file. Large files
+# repeat one random block with a varying prefix, which is enough to defeat any
+# deduplication while keeping generation fast.
+def write_file(path, size, rng):
+    block = rng.randbytes(min(size, BLOCK))
+    with open(path, 'wb') as f:
+        written = 0
+        while written < size:
+            chunk = block[:min(BLOCK, size - written)]
+            f.write(written.to_bytes(8, 'little') + chunk[8:] if len(chunk) > 8 else chunk)
+            written += len(chunk)
+
+# Below function returns the folders of a tree "depth" levels deep with "fanout"
+# sub folders per folder, creating them under root.
+def make_tree(root, depth, fanout):
+    folders = [root]
+    level = [root]
+    for d in range(depth):
+        next_level = []
+        for folder in level:
+            for n in range(fanout):
+                sub = os.path.join(folder, f"folder_{d}_{n}")
+                os.makedirs(sub, exist_ok=True)
+                next_level.append(sub)
+        folders.extend(next_level)
+        level = next_level
+    return folders
+
+# Below function scatters unwanted files (.DS_Store, Thumbs.db, desktop.ini) over a
+# collection. Scripts sweep them on every run, so it is called before each run.
+def add_noise(root, count, seed=0):
+    rng = random.Random(seed)
+    folders = [subroot for subroot, _, _ in os.walk(root)]
+    for n in range(count):
+        folder = rng.choice(folders)
+        with open(os.path.join(folder, NOISE_FILES[n % len(NOISE_FILES)]), 'wb') as f:
+            f.write(rng.randbytes(rng.randint(0, 4096)))
+
+# Below function generates a synthetic collection under root: a deep tree of small
+# files, a few AV sized files, clusters of same size files (identical copies plus a
+# different file of the same size) and unwanted system files.
+# Returns a dict describing what was generated.
+def make_collection(root, scale="small", seed=0):
+    params = SCALES[scale]
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    folders = make_tree(root, params["depth"], params["fanout"])
+
+    files = 0
+    total = 0
+    for i, folder in enumerate(folders):
+        for n in range(params["files_per_dir"]):
+            size = rng.randint(*params["small_sizes"])
+            ext = SMALL_EXTENSIONS[n % len(SMALL_EXTENSIONS)]
+            write_file(os.path.join(folder, f"item_{i}_{n}{ext}"), size, rng)
+            files += 1
+            total += size
+
+    av_folder = os.path.join(root, "av")
+    os.makedirs(av_folder, exist_ok=True)
+    for n in range(params["huge_files"]):
+        write_file(os.path.join(av_folder, f"reel_{n}.mov"), params["huge_size"], rng)
+        files += 1
+        total += params["huge_size"]
+
+    for c in range(params["clusters"]):
+        size = 100000 + c
+        content = rng.randbytes(size)
+        for k in range(params["cluster_size"]):
+            with open(os.path.join(rng.choice(folders), f"copy_{c}_{k}.tif"), 'wb') as f:
+                f.write(content)
+        with open(os.path.join(rng.choice(folders), f"decoy_{c}.tif"), 'wb') as f:
+            f.write(rng.randbytes(size))
+        files += params["cluster_size"] + 1
+        total += size * (params["cluster_size"] + 1)
+
+    add_noise(root, params["noise"], seed)
+    return {"root": root, "files": files, "bytes": total, "folders": len(folders) + 1}
+
+# Below function writes "count" exiftool like csv files into a folder, with a few
+# columns varying between files as they do between cameras.
+def make_csv_files(folder, count, seed=0):
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    common = ["SourceFile", "FileName", "FileSize", "MIMEType", "ImageWidth", "ImageHeight"]
+    extra = ["Make", "Model", "ExposureTime", "FNumber", "ISO", "Software", "Artist", "Copyright"]
+    for n in range(count):
+        columns = common + rng.sample(extra, rng.randint(0, len(extra)))
+        values = [f"/data/item_{n}.tif", f"item_{n}.tif", str(rng.randint(1000, 10 ** 8)), "image/tiff",
+                  str(rng.randint(100, 9000)), str(rng.randint(100, 9000))]
+        values += [f"value {rng.randint(0, 999)}" for _ in columns[len(common):]]
+        with open(os.path.join(folder, f"item_{n}.tif.csv"), 'w', encoding='utf-8') as f:
+            f.write(",".join(columns) + "\n" + ",".join(values) + "\n")
+    return {"files": count}
+
+# Below function writes a finding aid like pdf of "pages" pages, each holding a few
+# descriptions followed by their extent ("12 pp", "3 items" ...).
+def make_pdf(path, pages, seed=0):
+    rng = random.Random(seed)
+    words = "letter from the bishop concerning parish records and accounts of the estate with notes".split()
+    contents = []
+    for _ in range(pages):
+        lines = []
+        for _ in range(rng.randint(3, 8)):
+            for _ in range(rng.randint(1, 4)):
+                lines.append(" ".join(rng.choice(words) for _ in range(8)).capitalize() + rng.choice([".", "", "!"]))
+            if rng.random() < 0.8:
+                lines.append(f"{rng.randint(1, 300)} {rng.choice(['pp', 'p', 'items', 'ff'])}")
+        contents.append("BT /F1 10 Tf 14 TL 40 800 Td " + " ".join(f"({line}) '" for line in lines) + " ET")
+
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for stream in contents:
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents {len(objects)} 0 R "
+                       "/Resources << /Font << /F1 3 0 R >> >> >>")
+        kids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(kids)} >>"
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for n, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{n} 0 obj\n{obj}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, 'wb') as f:
+        f.write(out)
+    return {"pages": pages, "bytes": len(out)}
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import signal
+import sqlite3
+import argparse
+from logger import make_desktop_logs_dir, generate_log, add_logging_args, configure_logging
+from metrics import add_metrics_args, start_run, stage, count
+from profiling import add_profile_args, run_main, span
+from hash_reader import file_digest
+
+MANIFEST = "objects_manifest.md5"
+
+# Below function parses input arguments from the command line provided by the user.
+def arg_parse():
+
+    '''
+    Enter the arguments required
+    '''
+
+    parser = argparse.ArgumentParser(
+        description="Re-verifies the packages of a directory against their objects_manifest.md5 a little at a time. \
+            Each run checks the files verified least recently first, within a budget of bytes, time and read rate, \
+            so scheduling it (e.g. nightly with cron) re-verifies the whole repository over a rolling period."
+    )
+
+    parser.add_argument('-i',
+                        required=True,
+                        type=str,
+                        help="Full path of the directory holding the packages")
+
+    parser.add_argument('-state',
+                        type=str,
+                        default="",
+                        help="Full path of the audit state database (default ~/.cache/ucclib/fixity_audit/<directory name>.db)")
+
+    parser.add_argument('-budget',
+                        type=float,
+                        default=0,
+                        help="Maximum number of GiB verified by a run (0 for no limit)")
+
+    parser.add_argument('-duration',
+                        type=float,
+                        default=0,
+                        help="Maximum number of minutes a run starts verifying files for (0 for no limit)")
+
+    parser.add_argument('-rate',
+                        type=float,
+                        default=0,
+                        help="Maximum read rate in MiB per second (0 for no limit)")
+
+    parser.add_argument('-share',
+                        type=float,
+                        default=1.0,
+                        help="Share of the run time spent reading files, between 0 and 1 : 0.25 pauses three times as long as it reads")
+
+    add_logging_args(parser)
+    add_metrics_args(parser)
+    add_profile_args(parser)
+
+    parsed_args = parser.parse_args()
+    return parsed_args
+
+# Limits the read rate of the audit, called by the hash reader after every block:
+# sleeps to keep under "rate" bytes per second, and pauses after each block long
+# enough for reading to take only "share" of the time.
+class Throttle():
+
+    def __init__(self, rate=0, share=1.0):
+        self.rate = rate
+        self.share = share
+        self.started = time.perf_counter()
+        self.read_size = 0
+        self.last = self.started
+
+    def __call__(self, n):
+        now = time.perf_counter()
+        self.read_size += n
+        pause = 0.0
+        if self.share < 1.0:
+            pause = (now - self.last) * (1 - self.share) / self.share
+        if self.rate:
+            pause = max(pause, self.read_size / self.rate - (now - self.started))
+        if pause > 0:
+            time.sleep(pause)
+        self.last = time.perf_counter()
+
+# Audit state: the files listed in the manifests of every package, with when each
+# was last verified and the result. Manifests are only read again when they change.
+class AuditState():
+
+    def __init__(self, state_file):
+        os.makedirs(os.path.dirname(os.path.abspath(state_file)), exist_ok=True)
+        self.db = sqlite3.connect(state_file)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS packages (path TEXT PRIMARY KEY, manifest_mtime_ns INTEGER)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS files (package TEXT, path TEXT, md5 TEXT, size INTEGER, "
+                            "last_verified REAL, result TEXT, PRIMARY KEY (package, path))")
+            self.db.execute("CREATE INDEX IF NOT EXISTS files_last_verified ON files (last_verified)")
+
+    def sync(self, input_path):
+        '''
+        Brings the state in line with the manifests found under input_path.
+        Returns the number of packages found and the packages whose manifest could
+        not be read, which are left as they were and read again next time.
+        '''
+        packages = {}
+        for root, dirs, files in os.walk(input_path):
+            if MANIFEST in files:
+                packages[root] = os.stat(os.path.join(root, MANIFEST)).st_mtime_ns
+                dirs.clear()
+            else:
+                dirs[:] = [d for d in dirs if not d.startswith(".")]
+
+        known = dict(self.db.execute("SELECT path, manifest_mtime_ns FROM packages"))
+        unreadable = []
+        with self.db:
+            for package in set(known) - set(packages):
+                self.db.execute("DELETE FROM files WHERE package = ?", (package,))
+                self.db.execute("DELETE FROM packages WHERE path = ?", (package,))
+            for package, mtime_ns in packages.items():
+                if known.get(package) != mtime_ns:
+                    try:
+                        entries = self._read_manifest(package)
+                    except (OSError, ValueError) as e:
+                        unreadable.append((package, e))
+                        continue
+                    self._load_manifest(package, entries)
+                    self.db.execute("INSERT OR REPLACE INTO packages VALUES (?, ?)", (package, mtime_ns))
+        return len(packages), unreadable
+
+    def _read_manifest(self, package):
+        entries = {}
+        with open(os.path.join(package, MANIFEST), encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    if "  " not in line:
+                        raise ValueError(f"line {number} is not '<md5>  <path>'")
+                    md5, rel_path = line.rstrip("\n").split("  ", 1)
+                    entries[rel_path] = md5.lower()
+        return entries
+
+    def _load_manifest(self, package, entries):
+        known = dict(self.db.execute("SELECT path, md5 FROM files WHERE package = ?", (package,)))
+        for rel_path in set(known) - set(entries):
+            self.db.execute("DELETE FROM files WHERE package = ? AND path = ?", (package, rel_path))
+        for rel_path, md5 in entries.items():
+            if known.get(rel_path) != md5:
+                self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, NULL, NULL, NULL)", (package, rel_path, md5))
+
+    def least_recent(self, before, limit=1000):
+        '''
+        Returns the files not verified since "before": those never verified first,
+        then those verified longest ago.
+        '''
+        return self.db.execute("SELECT package, path, md5 FROM files WHERE last_verified IS NULL OR last_verified < ? "
+                               "ORDER BY last_verified IS NOT NULL, last_verified LIMIT ?", (before, limit)).fetchall()
+
+    def record(self, package, rel_path, size, result):
+        with self.db:
+            self.db.execute("UPDATE files SET size = ?, last_verified = ?, result = ? WHERE package = ? AND path = ?",
+                            (size, time.time(), result, package, rel_path))
+
+    def summary(self):
+        files, never, oldest = self.db.execute("SELECT COUNT(*), SUM(last_verified IS NULL), MIN(last_verified) FROM files").fetchone()
+        failing = self.db.execute("SELECT package, path, result FROM files WHERE result != 'ok'").fetchall()
+        return files, never or 0, oldest, failing
+
+# Below function verifies one file of a package against its manifest checksum.
+# Returns the result ("ok", "mismatch", "missing" or "unreadable" for a read
+# error) and the bytes read.
+def verify_file(package, rel_path, md5, throttle):
+    file_path = os.path.join(package, rel_path)
+    if not os.path.isfile(file_path):
+        return "missing", 0
+    try:
+        with span("hash", "hash", file=file_path):
+            digest, read_size = file_digest(file_path, pace=throttle)
+    except OSError:
+        return "unreadable", 0
+    count("hash", bytes=read_size, files=1)
+    return ("ok" if digest == md5 else "mismatch"), read_size
+
+# Below function runs one budgeted audit pass and reports the state of the repository.
+def main():
+    args = arg_parse()
+    configure_logging(args)
+    input_path = args.i
+    log_name_source_ = "fixity_audit_" + str(os.path.basename(input_path)) + time.strftime("_%Y_%m_%dT%H_%M_%S") + ".log"
+    desktop_logs_dir = make_desktop_logs_dir()
+    log_name_source = os.path.join(desktop_logs_dir, log_name_source_)
+    start_run("fixity_audit", log_name_source, args)
+
+    if not os.path.isdir(input_path):
+        print(' - Input must be a directory/folder - exiting!')
+        generate_log(log_name_source, ' - Input must be a directory/folder - exiting!')
+        sys.exit()
+
+    if not 0 < args.share <= 1:
+        print(' - The share of time spent reading must be above 0 and at most 1 - exiting!')
+        generate_log(log_name_source, ' - The share of time spent reading must be above 0 and at most 1 - exiting!')
+        sys.exit()
+
+    state_file = args.state or os.path.join(os.path.expanduser("~/.cache/ucclib/fixity_audit"),
+                                            os.path.basename(os.path.normpath(input_path)) + ".db")
+    state = AuditState(state_file)
+    with stage("sync"):
+        packages, unreadable = state.sync(input_path)
+    for package, e in unreadable:
+        print(f"- The manifest of {package} could not be read, its files are not audited - {e}")
+        generate_log(log_name_source, f"- The manifest of {package} could not be read, its files are not audited - {e}")
+    print(f"Auditing {packages} packages of {input_path} (state kept in {state_file})")
+    generate_log(log_name_source, f"Auditing {packages} packages of {input_path} (state kept in {state_file})")
+
+    # SIGTERM stops the run like Ctrl+C, the file being verified is checked again next run.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    throttle = Throttle(args.rate * 2**20, args.share)
+    budget = args.budget * 2**30
+    deadline = time.monotonic() + args.duration * 60 if args.duration else None
+    verified = 0
+    verified_bytes = 0
+    failed = 0
+    stop_reason = "every file verified"
+
+    run_started = time.time()
+    try:
+        with stage("verify"):
+            done = False
+            while not done:
+                batch = state.least_recent(run_started)
+                if not batch:
+                    break
+                for package, rel_path, md5 in batch:
+                    if budget and verified_bytes >= budget:
+                        stop_reason, done = "byte budget used up", True
+                        break
+                    if deadline and time.monotonic() >= deadline:
+                        stop_reason, done = "time budget used up", True
+                        break
+                    result, read_size = verify_file(package, rel_path, md5, throttle)
+                    state.record(package, rel_path, read_size, result)
+                    verified += 1
+                    verified_bytes += read_size
+                    if result != "ok":
+                        failed += 1
+                        print(f"- {os.path.join(package, rel_path)} failed verification ({result})")
+                        generate_log(log_name_source, f"- {os.path.join(package, rel_path)} failed verification ({result})",
+                                     stage="verify", file=os.path.join(package, rel_path))
+    except KeyboardInterrupt:
+        stop_reason = "stopped by the user, it resumes with the next run"
+
+    print(f"Audit run finished ({stop_reason}) - {verified} files ({verified_bytes / 2**30:.2f} GiB) verified, {failed} failed")
+    generate_log(log_name_source, f"Audit run finished ({stop_reason}) - {verified} files ({verified_bytes} bytes) verified, {failed} failed")
+
+    files, never, oldest, failing = state.summary()
+    if oldest is not None:
+        age = (time.time() - oldest) / 86400
+        print(f"{files} files in the repository - {never} never verified, the oldest verification is {age:.1f} days old")
+        generate_log(log_name_source, f"{files} files in the repository - {never} never verified, the oldest verification is {age:.1f} days old")
+    for package, rel_path, result in failing:
+        print(f"- {os.path.join(package, rel_path)} failed its last verification ({result})")
+        generate_log(log_name_source, f"- {os.path.join(package, rel_path)} failed its last verification ({result})")
+
+    if failing:
+        sys.exit(1)
+
+# Below code marks the start of execution of the program.
+if __name__ == "__main__":
+    run_main(main)
@@ -4,7 +4,13 @@ import shutil
 import argparse
 import sys
 import time
-from logger import make_desktop_logs_dir, generate_log, remove_bad_files
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from logger import make_desktop_logs_dir, generate_log, remove_bad_files, add_logging_args, configure_logging
+from metrics import add_metrics_args, start_run, stage, count
+from profiling import add_profile_args, run_main
+from inventory import Inventory, SIZE_BIN_EDGES, size_label
 
 # Function takes in input arguments entered by the user while attempting to 
 # run this script.
@@ -24,37 +30,68 @@ def arg_parse():
                         type=str, 
                         help="Full path of input directory to summarize")
 
+    parser.add_argument('-parallel',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="List directories concurrently with os.scandir (recommended for SMB/NFS shares). Enter y/n")
+
+    parser.add_argument('-workers',
+                        type=int,
+                        default=16,
+                        help="Number of directories listed at the same time when -parallel is y")
+
+    parser.add_argument('-snapshot',
+                        type=str,
+                        default="",
+                        help="Full path of a snapshot file. If it exists, only directories whose mtime changed are rescanned and the \
+                            added/removed/changed files since that snapshot are reported. The snapshot is then updated")
+
+    parser.add_argument('-inventory',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="Build a compact in-memory inventory and report size histograms per format, the largest files \
+                            and a per-directory (du style) rollup. Enter y/n")
+
+    parser.add_argument('-top',
+                        type=int,
+                        default=20,
+                        help="Number of largest files listed with -inventory y")
+
+    parser.add_argument('-depth',
+                        type=int,
+                        default=1,
+                        help="Deepest directory level listed in the per-directory rollup with -inventory y")
+
+    parser.add_argument('-export',
+                        type=str,
+                        default="",
+                        help="Full path of a .npz file to save the inventory to (implies -inventory y)")
+
+    parser.add_argument('-load',
+                        type=str,
+                        default="",
+                        help="Full path of a .npz inventory saved with -export to report on instead of scanning the input directory")
+
     # parser.add_argument('-o',
     #                     type=str,
     #                     default="",
     #                     help="full path of output directory")   
 
+    add_logging_args(parser)
+    add_metrics_args(parser)
+    add_profile_args(parser)
+
     parsed_args = parser.parse_args()
     return parsed_args
 
-# Main function logic to print the summary of the folder contents
-def main():
-    
-    args = arg_parse()
-    input_path = args.i
-    log_name_source_ = "folder_summary_"  + str(os.path.basename(input_path)) + time.strftime("_%Y_%m_%dT%H_%M_%S") + ".log"
-    desktop_logs_dir = make_desktop_logs_dir()
-    log_name_source = os.path.join(desktop_logs_dir, log_name_source_)
-    # if args.o == "":
-    #     output_file = os.path.join(os.path.dirname(input_path), os.path.basename(input_path) + ".txt")
-    # else:
-    #     output_file = os.path.join(args.o, os.path.basename(input_path) + '.txt')
-
-    if not os.path.isdir(input_path):
-        print(' - Input must be a directory/folder - exiting!')
-        generate_log(log_name_source, ' - Input must be a directory/folder - exiting!')
-        sys.exit()
-
+# Below function walks the input directory one folder at a time and returns
+# the per-extension file counts and sizes along with the sub-directories count.
+def serial_summary(input_path):
     tracker = {}
     file_sizes = {}
     folder_counts = 0
-    
-    remove_bad_files(input_path, log_name_source)
 
     for root, subdirs, files in os.walk(input_path):
 
@@ -74,8 +111,316 @@ def main():
             size = (os.path.getsize(os.path.join(root, file)))
             
             file_sizes[ext + '_size'] = file_sizes.get(ext + '_size', 0) + size
-            
+
+    return tracker, file_sizes, folder_counts
+
+# Below function lists a single directory with os.scandir and returns the
+# sub-directories still to be visited, the number of sub-directories found and
+# the partial per-extension counts and sizes of its files. Sizes come from
+# DirEntry.stat() so no extra os.path.getsize round trip is made per file.
+def scan_directory(path):
+    subdirs = []
+    folder_count = 0
+    counts = {}
+    sizes = {}
+    try:
+        it = os.scandir(path)
+    except OSError:
+        # os.walk silently skips directories it cannot list, do the same.
+        return subdirs, folder_count, counts, sizes
+
+    with it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                folder_count += 1
+                # Like os.walk, symlinked directories are counted but not followed.
+                if not entry.is_symlink():
+                    subdirs.append(entry.path)
+                continue
+
+            ext = str(os.path.splitext(entry.name)[1]).lower()
+            if ext == "":
+                ext = "unknown"
+            counts[ext] = counts.get(ext, 0) + 1
+            sizes[ext + '_size'] = sizes.get(ext + '_size', 0) + entry.stat().st_size
+
+    return subdirs, folder_count, counts, sizes
+
+# Below function walks the input directory by fanning the directory listings out
+# across a thread pool. Every listing returns its own partial results which are
+# folded together by this (single) coordinating thread, so no locks are needed.
+def parallel_summary(input_path, workers):
+    tracker = {}
+    file_sizes = {}
+    folder_counts = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(scan_directory, input_path)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, folder_count, counts, sizes = future.result()
+                folder_counts += folder_count
+                for ext, count in counts.items():
+                    tracker[ext] = tracker.get(ext, 0) + count
+                for key, size in sizes.items():
+                    file_sizes[key] = file_sizes.get(key, 0) + size
+                for subdir in subdirs:
+                    pending.add(pool.submit(scan_directory, subdir))
+
+    # Completion order is not deterministic, report the formats alphabetically.
+    tracker = dict(sorted(tracker.items()))
+    return tracker, file_sizes, folder_counts
+
+# Below function builds an inventory snapshot of the input directory: for every
+# directory (keyed by its path relative to the input) it stores
+# [mtime_ns, followed sub-directory names, symlinked sub-directory names, {file: [size, mtime_ns]}].
+# When a previous snapshot is given, directories whose mtime did not change are
+# taken from it as they are, without listing them or stating their files again.
+# Note that a file rewritten in place does not change its directory mtime, so such
+# edits are only noticed once its directory changes or without a previous snapshot.
+def take_snapshot(input_path, previous=None):
+    previous = previous or {}
+    dirs = {}
+    reused = 0
+    stack = [""]
+
+    while stack:
+        rel = stack.pop()
+        path = os.path.join(input_path, rel) if rel else input_path
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            continue
+
+        old = previous.get(rel)
+        if old is not None and old[0] == mtime:
+            dirs[rel] = old
+            reused += 1
+            stack.extend(os.path.join(rel, d) for d in old[1])
+            continue
+
+        subdirs = []
+        linked = []
+        files = {}
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        (linked if entry.is_symlink() else subdirs).append(entry.name)
+                    else:
+                        # A dangling symlink is recorded as the link itself, an entry
+                        # that cannot be stat'ed at all is left out of its directory only.
+                        try:
+                            st = entry.stat()
+                        except OSError:
+                            try:
+                                st = entry.stat(follow_symlinks=False)
+                            except OSError:
+                                continue
+                        files[entry.name] = [st.st_size, st.st_mtime_ns]
+        except OSError:
+            continue
+
+        dirs[rel] = [mtime, subdirs, linked, files]
+        stack.extend(os.path.join(rel, d) for d in subdirs)
+
+    return dirs, reused
+
+# Below function returns the extension key used in the summary for a file name.
+def extension_of(name):
+    ext = str(os.path.splitext(name)[1]).lower()
+    return ext if ext != "" else "unknown"
+
+# Below function derives the usual per-extension summary from a snapshot.
+def snapshot_totals(dirs):
+    tracker = {}
+    file_sizes = {}
+    folder_counts = 0
+    for _, subdirs, linked, files in dirs.values():
+        folder_counts += len(subdirs) + len(linked)
+        for name, (size, _) in files.items():
+            ext = extension_of(name)
+            tracker[ext] = tracker.get(ext, 0) + 1
+            file_sizes[ext + '_size'] = file_sizes.get(ext + '_size', 0) + size
+    return tracker, file_sizes, folder_counts
+
+# Below function compares two snapshots and returns, per extension, the number of
+# files and bytes added, removed and changed (size or mtime differs; the bytes of a
+# changed file are its size difference).
+def diff_snapshots(old_dirs, new_dirs):
+    changes = {}
+
+    def record(name, kind, size):
+        entry = changes.setdefault(extension_of(name), {'added': [0, 0], 'removed': [0, 0], 'changed': [0, 0]})
+        entry[kind][0] += 1
+        entry[kind][1] += size
+
+    for rel in set(old_dirs) | set(new_dirs):
+        old = old_dirs.get(rel)
+        new = new_dirs.get(rel)
+        if old is new:
+            continue
+        old_files = old[3] if old else {}
+        new_files = new[3] if new else {}
+        for name, (size, mtime) in new_files.items():
+            before = old_files.get(name)
+            if before is None:
+                record(name, 'added', size)
+            elif before[0] != size or before[1] != mtime:
+                record(name, 'changed', size - before[0])
+        for name, (size, _) in old_files.items():
+            if name not in new_files:
+                record(name, 'removed', size)
+
+    return dict(sorted(changes.items()))
+
+# Below function reads a snapshot file written by save_snapshot().
+def load_snapshot(snapshot_file):
+    with gzip.open(snapshot_file, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+# Below function writes the snapshot as gzipped json, replacing the previous
+# snapshot only once the new one is completely written.
+def save_snapshot(snapshot_file, input_path, dirs):
+    tmp_file = snapshot_file + ".tmp"
+    with gzip.open(tmp_file, 'wt', encoding='utf-8') as f:
+        json.dump({"root": os.path.abspath(input_path),
+                   "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "dirs": dirs}, f, separators=(',', ':'))
+    os.replace(tmp_file, snapshot_file)
+
+# Below function runs the snapshot-and-diff mode: incremental scan against the
+# previous snapshot, report of the differences and update of the snapshot file.
+def snapshot_summary(input_path, snapshot_file, log_name_source):
+    previous = None
+    if os.path.isfile(snapshot_file):
+        snapshot = load_snapshot(snapshot_file)
+        if snapshot["root"] == os.path.abspath(input_path):
+            previous = snapshot
+        else:
+            print(f"Snapshot {snapshot_file} was taken of {snapshot['root']} - performing a full scan")
+            generate_log(log_name_source, f"Snapshot {snapshot_file} was taken of {snapshot['root']} - performing a full scan")
+
+    start = time.time()
+    dirs, reused = take_snapshot(input_path, previous["dirs"] if previous else None)
+    print(f"Scanned {len(dirs)} directories ({reused} unchanged since the last snapshot) in {time.time() - start:.1f} seconds")
+    generate_log(log_name_source, f"Scanned {len(dirs)} directories ({reused} unchanged since the last snapshot) in {time.time() - start:.1f} seconds")
+
+    if previous:
+        changes = diff_snapshots(previous["dirs"], dirs)
+        print(f"Changes since snapshot of {previous['created']}".center(100) + "\n")
+        generate_log(log_name_source, f"Changes since snapshot of {previous['created']}".center(100) + "\n")
+        header = ("File-type".center(25) + "Added".center(25) + "Removed".center(25) + "Changed".center(25) + "\n")
+        print(header)
+        generate_log(log_name_source, header)
+        if not changes:
+            print("No changes".center(100) + "\n")
+            generate_log(log_name_source, "No changes".center(100) + "\n")
+        for file_type, entry in changes.items():
+            line = str(file_type).center(25)
+            for kind in ('added', 'removed', 'changed'):
+                count, size = entry[kind]
+                line += f"{count} ({size / (1024*1024)} MB)".center(25)
+            print(line + "\n")
+            generate_log(log_name_source, line + "\n")
+
+    save_snapshot(snapshot_file, input_path, dirs)
+    print(f"Snapshot saved to {snapshot_file}")
+    generate_log(log_name_source, f"Snapshot saved to {snapshot_file}")
+
+    return snapshot_totals(dirs)
+
+# Below function prints and logs the inventory reports: size histogram of every
+# format, the largest files and the cumulative size of each directory down to "depth".
+def inventory_report(inv, top, depth, log_name_source):
+
+    def out(line):
+        print(line + "\n")
+        generate_log(log_name_source, line + "\n")
+
+    labels = [size_label(edge) for edge in SIZE_BIN_EDGES]
+    out("Size histogram per file-type".center(100))
+    for file_type, counts in inv.histograms().items():
+        bins = [f"{labels[i]}+ : {int(count)}" for i, count in enumerate(counts) if count]
+        out(str(file_type).center(15) + " | ".join(bins))
+
+    out(f"{top} largest files".center(100))
+    for path, size in inv.largest(top):
+        out((str(size / (1024*1024)) + " MB").center(33) + path)
+
+    out(f"Directory sizes (down to depth {depth})".center(100))
+    total_bytes, total_files = inv.rollup()
+    for index in range(len(inv.dir_parent)):
+        if inv.dir_depth[index] <= depth:
+            out((str(total_bytes[index] / (1024*1024)) + " MB").center(33)
+                + str(total_files[index]).center(15) + inv.dir_path(index))
+
+# Below function runs the traversal selected by the arguments and returns the
+# per-extension counts and sizes, the sub-directories count and the inventory (if any).
+def summarize(args, input_path, log_name_source):
+    if args.load or args.export or args.inventory == 'y':
+        if args.load:
+            # A saved inventory is reported on as it is, the input directory is not scanned.
+            inv = Inventory.load(args.load)
+            print(f"Inventory of {inv.root} loaded from {args.load}")
+            generate_log(log_name_source, f"Inventory of {inv.root} loaded from {args.load}")
+        else:
+            inv = Inventory.scan(input_path)
+            if inv.unreadable:
+                print(f"- {inv.unreadable} entries could not be read and are left out of the inventory")
+                generate_log(log_name_source, f"- {inv.unreadable} entries could not be read and are left out of the inventory")
+        if args.export:
+            inv.save(args.export)
+            print(f"Inventory of {len(inv)} files exported to {args.export}")
+            generate_log(log_name_source, f"Inventory of {len(inv)} files exported to {args.export}")
+        return inv.totals() + (inv,)
+    if args.snapshot:
+        return snapshot_summary(input_path, args.snapshot, log_name_source) + (None,)
+    if args.parallel == 'y':
+        return parallel_summary(input_path, args.workers) + (None,)
+    return serial_summary(input_path) + (None,)
+
+# Main function logic to print the summary of the folder contents
+def main():
     
+    args = arg_parse()
+    configure_logging(args)
+    input_path = args.i
+    log_name_source_ = "folder_summary_"  + str(os.path.basename(input_path)) + time.strftime("_%Y_%m_%dT%H_%M_%S") + ".log"
+    desktop_logs_dir = make_desktop_logs_dir()
+    log_name_source = os.path.join(desktop_logs_dir, log_name_source_)
+    start_run("folder_summary", log_name_source, args)
+    # if args.o == "":
+    #     output_file = os.path.join(os.path.dirname(input_path), os.path.basename(input_path) + ".txt")
+    # else:
+    #     output_file = os.path.join(args.o, os.path.basename(input_path) + '.txt')
+
+    if args.load:
+        if not os.path.isfile(args.load):
+            print(' - Inventory file to load does not exist - exiting!')
+            generate_log(log_name_source, ' - Inventory file to load does not exist - exiting!')
+            sys.exit()
+    elif not os.path.isdir(input_path):
+        print(' - Input must be a directory/folder - exiting!')
+        generate_log(log_name_source, ' - Input must be a directory/folder - exiting!')
+        sys.exit()
+    else:
+        with stage("sweep"):
+            remove_bad_files(input_path, log_name_source)
+
+    with stage("walk"):
+        tracker, file_sizes, folder_counts, inv = summarize(args, input_path, log_name_source)
+    count("walk", bytes=sum(file_sizes.values()), files=sum(tracker.values()))
+
     # print(output_file)
     
     
@@ -101,6 +446,9 @@ def main():
             + (str((file_sizes[file_type + '_size'])/ (1024*1024)) + " MB").center(33)
             + "\n")
 
+    if inv is not None:
+        inventory_report(inv, args.top, args.depth, log_name_source)
+
 # Below code marks the start of execution of the program.
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_main(main)
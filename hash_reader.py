@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+import os
+import sys
+import mmap
+import time
+import hashlib
+import argparse
+import threading
+from logger import make_desktop_logs_dir, generate_log, add_logging_args, configure_logging
+from metrics import add_metrics_args, start_run, stage, count
+from profiling import add_profile_args, run_main
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Block size and reading method used by every script, tuned per host with this
+# script (python3 hash_reader.py -i <sample>) and set through the environment.
+DEFAULT_BLOCK_SIZE = int(os.environ.get('UCCLIB_HASH_BLOCK_SIZE', '') or 2**20)
+DEFAULT_MMAP = os.environ.get('UCCLIB_HASH_MMAP', '') == 'y'
+
+# Block sizes compared by the tuner, from 64 KiB to 16 MiB.
+BLOCK_SIZES = [2**16, 2**18, 2**20, 2**22, 2**24]
+
+# Pages already hashed are released from the page cache every DROP_EVERY bytes, so
+# hashing a 100 GB file does not evict everything else the host has cached.
+DROP_EVERY = 2**26
+
+# Below function gives the kernel an access pattern hint for a range of an open
+# file. It does nothing where posix_fadvise is not available (MacOS, Windows).
+def advise(fd, offset, length, advice_name):
+    advice = getattr(os, advice_name, None)
+    if advice is None:
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        pass
+
+# Reader feeding files to hash objects through one preallocated buffer reused for
+# every block (readinto, no new bytes object per block), or through mmap. Reads are
+# announced as sequential and the pages read are dropped from the page cache behind
+# the reader. On MacOS, where posix_fadvise is missing, F_NOCACHE is used instead.
+# A reader owns its buffer: use one per thread (see reader()).
+class HashReader():
+
+    def __init__(self, block_size=DEFAULT_BLOCK_SIZE, use_mmap=DEFAULT_MMAP, drop_cache=True):
+        self.block_size = block_size
+        self.use_mmap = use_mmap
+        self.drop_cache = drop_cache
+        self.buffer = bytearray(block_size)
+        self.view = memoryview(self.buffer)
+
+    def update(self, h, fpath, progress=None, pace=None, drop_cache=None):
+        '''
+        Feeds the contents of fpath to the hash object h and returns the number of bytes read.
+        progress(read_size, total_size) is called at most once per percent read and
+        pace(block_size) after every block, for callers limiting their read rate.
+        drop_cache overrides the setting of the reader for this file, False keeps
+        the pages of a file about to be read again (a source before its copy) cached.
+        '''
+        if drop_cache is None:
+            drop_cache = self.drop_cache
+        with open(fpath, 'rb', buffering=0) as f:
+            fd = f.fileno()
+            total_size = os.fstat(fd).st_size
+            advise(fd, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+            if drop_cache and not hasattr(os, 'posix_fadvise') and hasattr(fcntl, 'F_NOCACHE'):
+                fcntl.fcntl(fd, fcntl.F_NOCACHE, 1)
+
+            if self.use_mmap and total_size > 0:
+                read_size = self._update_mmap(h, f, total_size, progress, pace)
+            else:
+                read_size = self._update_readinto(h, f, total_size, progress, pace, drop_cache)
+
+            if drop_cache:
+                advise(fd, 0, 0, 'POSIX_FADV_DONTNEED')
+        return read_size
+
+    def _update_readinto(self, h, f, total_size, progress, pace, drop_cache):
+        fd = f.fileno()
+        readinto = f.readinto
+        update = h.update
+        buffer = self.buffer
+        view = self.view
+        block_size = self.block_size
+        step = max(total_size // 100, 1)
+        next_report = step
+        read_size = 0
+        dropped = 0
+        while True:
+            n = readinto(buffer)
+            if not n:
+                break
+            update(view[:n] if n < block_size else buffer)
+            read_size += n
+            if progress and read_size >= next_report:
+                progress(read_size, total_size)
+                next_report = read_size + step
+            if pace:
+                pace(n)
+            if drop_cache and read_size - dropped >= DROP_EVERY:
+                advise(fd, dropped, read_size - dropped, 'POSIX_FADV_DONTNEED')
+                dropped = read_size
+        return read_size
+
+    def _update_mmap(self, h, f, total_size, progress, pace):
+        block_size = self.block_size
+        step = max(total_size // 100, 1)
+        next_report = step
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if hasattr(m, 'madvise'):
+                m.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(m)
+            try:
+                for offset in range(0, total_size, block_size):
+                    h.update(view[offset:offset + block_size])
+                    if pace:
+                        pace(min(block_size, total_size - offset))
+                    if progress and offset + block_size >= next_report:
+                        progress(min(offset + block_size, total_size), total_size)
+                        next_report = offset + block_size + step
+            finally:
+                view.release()
+        return total_size
+
+_readers = threading.local()
+
+# Below function returns the reader of the calling thread, created with the
+# block size and method set in the environment.
+def reader():
+    if not hasattr(_readers, 'reader'):
+        _readers.reader = HashReader()
+    return _readers.reader
+
+# Below function returns the checksum of a file (hex digest) and the number of
+# bytes read, using the reader of the calling thread.
+def file_digest(fpath, algorithm="md5", progress=None, pace=None, drop_cache=None):
+    h = hashlib.new(algorithm)
+    read_size = reader().update(h, fpath, progress, pace, drop_cache)
+    return h.hexdigest(), read_size
+
+# Below function parses input arguments from the command line provided by the user.
+def arg_parse():
+
+    '''
+    Enter the arguments required
+    '''
+
+    parser = argparse.ArgumentParser(
+        description="Times md5 hashing of sample files with different block sizes (and optionally mmap) and reports the \
+            fastest setting for the volume holding them, as environment variables to set for the other scripts."
+    )
+
+    parser.add_argument('-i',
+                        required=True,
+                        type=str,
+                        help="Full path of a sample file, or of a directory of sample files, on the volume to tune for")
+
+    parser.add_argument('-sizes',
+                        type=int,
+                        nargs='+',
+                        default=BLOCK_SIZES,
+                        help="Block sizes in bytes to compare")
+
+    parser.add_argument('-mmap',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='y',
+                        help="Also time reading the samples through mmap. Enter y/n")
+
+    parser.add_argument('-repeat',
+                        type=int,
+                        default=3,
+                        help="Number of timed runs of each setting, the best one is kept")
+
+    parser.add_argument('-limit',
+                        type=int,
+                        default=2**30,
+                        help="Stop collecting sample files from a directory once they add up to this many bytes")
+
+    add_logging_args(parser)
+    add_metrics_args(parser)
+    add_profile_args(parser)
+
+    parsed_args = parser.parse_args()
+    return parsed_args
+
+# Below function returns the sample files to hash, at most "limit" bytes of them
+# when the input is a directory.
+def sample_files(input_path, limit):
+    if os.path.isfile(input_path):
+        return [input_path]
+    samples = []
+    total = 0
+    for root, _, files in os.walk(input_path):
+        for file in sorted(files):
+            samples.append(os.path.join(root, file))
+            total += os.path.getsize(samples[-1])
+            if total >= limit:
+                return samples
+    return samples
+
+# Below function times hashing the samples with one reader, dropping them from the
+# page cache before each run so every run reads from the disk where the operating
+# system allows it.
+def time_reader(hash_reader, samples, repeat):
+    best = None
+    for _ in range(repeat):
+        for fpath in samples:
+            with open(fpath, 'rb') as f:
+                advise(f.fileno(), 0, 0, 'POSIX_FADV_DONTNEED')
+        start = time.perf_counter()
+        for fpath in samples:
+            hash_reader.update(hashlib.md5(), fpath)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+# Below function compares the block sizes/methods on the samples and reports the fastest.
+def main():
+    args = arg_parse()
+    configure_logging(args)
+    input_path = args.i
+    log_name_source_ = "hash_reader_" + str(os.path.basename(input_path)) + time.strftime("_%Y_%m_%dT%H_%M_%S") + ".log"
+    desktop_logs_dir = make_desktop_logs_dir()
+    log_name_source = os.path.join(desktop_logs_dir, log_name_source_)
+    start_run("hash_reader", log_name_source, args)
+
+    if not os.path.exists(input_path):
+        print(' - Input must be a file or a directory/folder - exiting!')
+        generate_log(log_name_source, ' - Input must be a file or a directory/folder - exiting!')
+        sys.exit()
+
+    samples = sample_files(input_path, args.limit)
+    total = sum(os.path.getsize(f) for f in samples)
+    if total == 0:
+        print(' - No data to hash in the input - exiting!')
+        generate_log(log_name_source, ' - No data to hash in the input - exiting!')
+        sys.exit()
+    print(f"Hashing {len(samples)} sample file(s), {total / 2**20:.1f} MiB, {args.repeat} time(s) per setting")
+    generate_log(log_name_source, f"Hashing {len(samples)} sample file(s), {total / 2**20:.1f} MiB, {args.repeat} time(s) per setting")
+    if not hasattr(os, 'posix_fadvise'):
+        print(" - The page cache cannot be dropped on this system, runs after the first may read from memory")
+
+    results = []
+    for use_mmap in ([False, True] if args.mmap == 'y' else [False]):
+        for block_size in args.sizes:
+            with stage("hash", block_size=block_size, mmap=use_mmap):
+                elapsed = time_reader(HashReader(block_size, use_mmap), samples, args.repeat)
+            count("hash", bytes=total * args.repeat, files=len(samples) * args.repeat)
+            speed = total / 2**20 / elapsed if elapsed else float('inf')
+            results.append((speed, block_size, use_mmap))
+            method = "mmap" if use_mmap else "readinto"
+            print(f"{method:>10} {block_size:>10} bytes : {speed:10.1f} MiB/s")
+            generate_log(log_name_source, f"{method} {block_size} bytes : {speed:.1f} MiB/s")
+
+    speed, block_size, use_mmap = max(results)
+    print(f"\nFastest : {'mmap' if use_mmap else 'readinto'} with {block_size} bytes blocks ({speed:.1f} MiB/s). Set it for the other scripts with -")
+    print(f"export UCCLIB_HASH_BLOCK_SIZE={block_size}")
+    print(f"export UCCLIB_HASH_MMAP={'y' if use_mmap else 'n'}")
+    generate_log(log_name_source, f"Fastest : UCCLIB_HASH_BLOCK_SIZE={block_size} UCCLIB_HASH_MMAP={'y' if use_mmap else 'n'} ({speed:.1f} MiB/s)")
+
+# Below code marks the start of execution of the program.
+if __name__ == "__main__":
+    run_main(main)
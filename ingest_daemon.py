@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import signal
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from logger import make_desktop_logs_dir, generate_log, remove_bad_files, forget_swept, add_logging_args, configure_logging
+from metrics import add_metrics_args, start_run, stage
+from profiling import add_profile_args, run_main
+from ip_creator import UID_PATTERN, QUARANTINE, IntegrityError, package_arguments, create_package, verify_package
+
+# Below function parses input arguments from the command line provided by the user.
+def arg_parse():
+
+    '''
+    Enter the arguments required
+    '''
+
+    parser = argparse.ArgumentParser(
+        description="Watches a drop folder and packages every deposit (a sub folder named after its uid) with ip_creator \
+            once its contents stop changing. Runs until stopped with Ctrl+C or SIGTERM."
+    )
+
+    parser.add_argument('-i',
+                        required=True,
+                        type=str,
+                        help="Full path of the drop folder to watch")
+
+    parser.add_argument('-o',
+                        required=True,
+                        type=str,
+                        help="Full path of output directory to place the uid packages")
+
+    parser.add_argument('-format',
+                        required=True,
+                        type=str,
+                        help="Enter the format you would like to package")
+
+    parser.add_argument('-supplement',
+                        type=str,
+                        default="",
+                        help="Enter the supplementary formats you would like to preserve")
+
+    parser.add_argument('-kfs',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="(KFS - Keep folder structure) : Enter your choice on preserving directory structure for the objects in the destination")
+
+    parser.add_argument('-jhove',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="Enter your choice on using 'jhove' utility IF available")
+
+    parser.add_argument('-brunnhilde',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="Enter your choice on using 'brunnhilde-ClamAV' utility IF available")
+
+    parser.add_argument('-pipeline',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="Package each deposit with the pipelined mode of ip_creator.py. Enter y/n")
+
+    parser.add_argument('-workers',
+                        type=int,
+                        default=4,
+                        help="Number of metadata extractor workers used with -pipeline y")
+
+    parser.add_argument('-fast',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="Extract the metadata from the headers of the objects only, as ip_creator.py -fast. Enter y/n")
+
+    parser.add_argument('-retries',
+                        type=int,
+                        default=3,
+                        help="Number of times the copy of an object is tried again before it is quarantined, as ip_creator.py -retries")
+
+    parser.add_argument('-backoff',
+                        type=float,
+                        default=2.0,
+                        help="Seconds waited before the first retry of a copy, doubled before every further retry")
+
+    parser.add_argument('-repackage',
+                        type=int,
+                        default=3,
+                        help="Number of times a deposit left with quarantined objects is packaged again, after settle seconds doubled every time")
+
+    parser.add_argument('-deposits',
+                        type=int,
+                        default=1,
+                        help="Number of deposits packaged at the same time")
+
+    parser.add_argument('-settle',
+                        type=float,
+                        default=60,
+                        help="Seconds the file count, size and modification times of a deposit must stay unchanged before it is packaged")
+
+    parser.add_argument('-poll',
+                        type=float,
+                        default=10,
+                        help="Seconds between two scans of the drop folder")
+
+    parser.add_argument('-verify',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="Verify every package against its objects manifest once created. Enter y/n")
+
+    parser.add_argument('-once',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="Package the deposits that are stable and exit instead of watching the drop folder. Enter y/n")
+
+    add_logging_args(parser)
+    add_metrics_args(parser)
+    add_profile_args(parser)
+
+    parsed_args = parser.parse_args()
+    return parsed_args
+
+# Below function returns the (file count, total size, latest modification time)
+# signature of a deposit, or None if it changed or could not be read while being walked.
+def deposit_signature(deposit):
+    files = 0
+    size = 0
+    def unreadable(error):
+        raise error
+    try:
+        latest = os.stat(deposit).st_mtime
+        # A folder that cannot be listed yet must not be taken for an empty one
+        for root, _, names in os.walk(deposit, onerror=unreadable):
+            latest = max(latest, os.stat(root).st_mtime)
+            for name in names:
+                st = os.stat(os.path.join(root, name))
+                files += 1
+                size += st.st_size
+                latest = max(latest, st.st_mtime)
+    except OSError:
+        # Removed, or not readable yet, while being copied in
+        return None
+    return (files, size, latest)
+
+# State of the deposits of the drop folder. A deposit is ready once its signature
+# has stayed the same for "settle" seconds; copies preserving modification times
+# (cp -p, rsync -t) are still caught by the file count and size.
+class DropFolder():
+
+    def __init__(self, drop_folder, output_path, settle, log_name_source):
+        self.drop_folder = drop_folder
+        self.output_path = output_path
+        self.settle = settle
+        self.log_name_source = log_name_source
+        self.seen = {}
+        self.failed = {}
+        self.requeued = {}
+        self.ignored = set()
+        self.done = set()
+
+    def note(self, message):
+        print(message)
+        generate_log(self.log_name_source, message)
+
+    def ready(self, running):
+        '''
+        Scans the drop folder and returns the paths of the deposits ready to package.
+        '''
+        now = time.monotonic()
+        deposits = []
+        with os.scandir(self.drop_folder) as entries:
+            names = sorted(entry.name for entry in entries if entry.is_dir() and not entry.name.startswith("."))
+        for name in set(self.seen) - set(names):
+            del self.seen[name]
+
+        for name in names:
+            if name in running or name in self.done or name in self.ignored:
+                continue
+            if name in self.requeued and now < self.requeued[name][1]:
+                continue
+            if UID_PATTERN.fullmatch(name) is None:
+                self.ignored.add(name)
+                self.note(f"Deposit {name} ignored - its folder name is not a uid (4 lowercase alphabets followed by 4 digits)")
+                continue
+            # A package left with quarantined objects is packaged again, only its failures are copied
+            package = os.path.join(self.output_path, name)
+            if os.path.exists(package) and not os.path.isdir(os.path.join(package, QUARANTINE)):
+                self.done.add(name)
+                self.note(f"Deposit {name} ignored - {package} already exists")
+                continue
+
+            deposit = os.path.join(self.drop_folder, name)
+            signature = deposit_signature(deposit)
+            if signature is None or self.failed.get(name) == signature:
+                continue
+            if name not in self.seen or self.seen[name][0] != signature:
+                self.seen[name] = (signature, now)
+            elif now - self.seen[name][1] >= self.settle:
+                deposits.append(deposit)
+        return deposits
+
+# Below function packages one deposit into output_path/<uid> with its own log,
+# optionally verifying the package once created.
+def package_deposit(args, deposit, desktop_logs_dir):
+    uid = os.path.basename(deposit)
+    log_name_source = os.path.join(desktop_logs_dir, "ip_creator_" + uid + time.strftime("_%Y_%m_%dT%H_%M_%S") + ".log")
+    generate_log(log_name_source, f"Packaging deposit {deposit} into {os.path.join(args.o, uid)}")
+
+    # Deposits dropped again or packaged again are swept again
+    forget_swept(deposit)
+    with stage("sweep"):
+        remove_bad_files(deposit, log_name_source)
+
+    package_args = package_arguments(deposit, args.o, uid, args.format,
+                                     supplement=args.supplement.split(), kfs=args.kfs, jhove=args.jhove,
+                                     brunnhilde=args.brunnhilde, pipeline=args.pipeline, workers=args.workers,
+                                     fast=args.fast, retries=args.retries, backoff=args.backoff)
+    with stage("package", uid=uid):
+        package_path = create_package(package_args, log_name_source)
+
+    if args.verify == 'y':
+        with stage("verify", uid=uid):
+            failed = verify_package(package_path, log_name_source)
+        if failed:
+            raise IntegrityError(f"{len(failed)} object(s) of {package_path} failed verification")
+    return package_path
+
+# Below function watches the drop folder and hands the deposits ready to package to
+# a pool of "deposits" workers kept for the whole run, so the interpreter, pandas and
+# the format mappers are only loaded once.
+def main():
+    args = arg_parse()
+    configure_logging(args)
+    drop_folder = args.i
+    log_name_source_ = "ingest_daemon_" + str(os.path.basename(drop_folder)) + time.strftime("_%Y_%m_%dT%H_%M_%S") + ".log"
+    desktop_logs_dir = make_desktop_logs_dir()
+    log_name_source = os.path.join(desktop_logs_dir, log_name_source_)
+    start_run("ingest_daemon", log_name_source, args)
+
+    if not os.path.isdir(drop_folder):
+        print(' - Input must be a directory/folder - exiting!')
+        generate_log(log_name_source, ' - Input must be a directory/folder - exiting!')
+        sys.exit()
+    os.makedirs(args.o, exist_ok=True)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    folder = DropFolder(drop_folder, args.o, args.settle, log_name_source)
+    running = {}
+
+    print(f"Watching {drop_folder} for {args.format} deposits every {args.poll} seconds (settle time {args.settle} seconds)")
+    generate_log(log_name_source, f"Watching {drop_folder} for {args.format} deposits every {args.poll} seconds (settle time {args.settle} seconds)")
+
+    # Below function logs the outcome of the deposits whose packaging has finished.
+    def collect():
+        for name, future in list(running.items()):
+            if not future.done():
+                continue
+            del running[name]
+            try:
+                folder.note(f"Deposit {name} packaged at {future.result()}")
+                folder.done.add(name)
+                folder.requeued.pop(name, None)
+            except (Exception, SystemExit) as e:
+                # Objects quarantined after a transient storage error are copied again after
+                # a while, up to "repackage" times, other failures wait for the deposit to change.
+                times = folder.requeued.get(name, (0, 0))[0]
+                if isinstance(e, IntegrityError) and os.path.isdir(os.path.join(args.o, name, QUARANTINE)) and times < args.repackage:
+                    delay = args.settle * 2 ** times
+                    folder.requeued[name] = (times + 1, time.monotonic() + delay)
+                    folder.note(f"Deposit {name} could not be packaged - {e!r} - its failed objects are copied again in {delay:g} seconds")
+                else:
+                    folder.requeued.pop(name, None)
+                    folder.failed[name] = deposit_signature(os.path.join(drop_folder, name))
+                    folder.note(f"Deposit {name} could not be packaged - {e!r} - it is retried once its contents change")
+                    # The package left behind would be taken for a packaged deposit, it is
+                    # moved aside unless it only waits for its quarantined objects.
+                    package = os.path.join(args.o, name)
+                    if os.path.isdir(package) and not os.path.isdir(os.path.join(package, QUARANTINE)):
+                        failed_package = package + time.strftime(".failed_%Y_%m_%dT%H_%M_%S")
+                        os.rename(package, failed_package)
+                        folder.note(f"Deposit {name} - its incomplete package was moved to {failed_package}")
+
+    with ThreadPoolExecutor(max_workers=max(args.deposits, 1), thread_name_prefix="deposit") as pool:
+        try:
+            while not stop.is_set():
+                collect()
+                for deposit in folder.ready(running):
+                    name = os.path.basename(deposit)
+                    folder.note(f"Deposit {name} is stable - packaging")
+                    running[name] = pool.submit(package_deposit, args, deposit, desktop_logs_dir)
+
+                if args.once == 'y':
+                    pending = [name for name in folder.seen if name not in folder.done and name not in folder.failed]
+                    if not running and not pending:
+                        break
+                    stop.wait(min(args.poll, args.settle))
+                else:
+                    stop.wait(args.poll)
+        except KeyboardInterrupt:
+            pass
+        if running:
+            folder.note(f"Stopping - waiting for {len(running)} deposit(s) being packaged")
+    collect()
+
+    print("ingest_daemon.py - Process Exiting")
+    generate_log(log_name_source, "ingest_daemon.py - Process Exiting")
+
+# Below code marks the start of execution of the program.
+if __name__ == "__main__":
+    run_main(main)
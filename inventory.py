@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+import os
+from array import array
+import numpy as np
+
+# Upper bounds of the size histogram bins, growing by a factor 4 from 1 KB to 64 GB.
+SIZE_BIN_EDGES = [0] + [1024 * 4**i for i in range(14)]
+
+# Below function returns a readable label (B/KB/MB/GB) for a size in bytes.
+def size_label(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:g} {unit}"
+        size /= 1024
+
+# Append-only table of strings stored as one contiguous utf-8 (surrogateescape)
+# byte buffer plus an offsets column, instead of millions of str objects.
+class StringTable():
+
+    def __init__(self, blob=None, offsets=None):
+        self.blob = bytearray() if blob is None else blob
+        self.offsets = array('Q', [0]) if offsets is None else offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def add(self, value):
+        self.blob += os.fsencode(value)
+        self.offsets.append(len(self.blob))
+        return len(self.offsets) - 2
+
+    def get(self, index):
+        return os.fsdecode(bytes(self.blob[self.offsets[index]:self.offsets[index + 1]]))
+
+# Column oriented inventory of a directory tree. Directories are stored in the
+# order they were discovered (a parent always before its children) with their
+# parent index and depth; files are stored as parallel typed columns (directory
+# index, size, mtime, extension code) next to the name table.
+class Inventory():
+
+    def __init__(self, root):
+        self.root = root
+        self.dir_paths = StringTable()
+        self.dir_parent = array('q')
+        self.dir_depth = array('H')
+        self.names = StringTable()
+        self.file_dir = array('I')
+        self.size = array('q')
+        self.mtime = array('q')
+        self.ext_code = array('H')
+        self.extensions = []
+        self._ext_index = {}
+        # Symlinked directories are not followed but still count as sub-directories.
+        self.linked_dirs = 0
+        # Entries left out of the scan because they could not be stat'ed at all.
+        self.unreadable = 0
+
+    def _ext(self, name):
+        ext = str(os.path.splitext(name)[1]).lower()
+        if ext == "":
+            ext = "unknown"
+        code = self._ext_index.get(ext)
+        if code is None:
+            code = self._ext_index[ext] = len(self.extensions)
+            self.extensions.append(ext)
+        return code
+
+    @classmethod
+    def scan(cls, input_path):
+        '''
+        Builds the inventory of input_path with os.scandir (symlinked directories are not followed).
+        '''
+        inv = cls(os.path.abspath(input_path))
+        stack = [("", -1, 0)]
+        while stack:
+            rel, parent, depth = stack.pop()
+            index = inv.dir_paths.add(rel)
+            inv.dir_parent.append(parent)
+            inv.dir_depth.append(depth)
+            try:
+                it = os.scandir(os.path.join(inv.root, rel) if rel else inv.root)
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        if entry.is_symlink():
+                            inv.linked_dirs += 1
+                        else:
+                            stack.append((os.path.join(rel, entry.name), index, depth + 1))
+                        continue
+                    # A dangling symlink is recorded as the link itself, as in take_snapshot()
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        try:
+                            st = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            inv.unreadable += 1
+                            continue
+                    inv.names.add(entry.name)
+                    inv.file_dir.append(index)
+                    inv.size.append(st.st_size)
+                    inv.mtime.append(st.st_mtime_ns)
+                    inv.ext_code.append(inv._ext(entry.name))
+        return inv
+
+    def __len__(self):
+        return len(self.size)
+
+    def _np(self, column, dtype):
+        return np.frombuffer(column, dtype=dtype) if len(column) else np.zeros(0, dtype=dtype)
+
+    def path(self, file_index):
+        rel = self.dir_paths.get(self.file_dir[file_index])
+        return os.path.join(self.root, rel, self.names.get(file_index))
+
+    def dir_path(self, dir_index):
+        rel = self.dir_paths.get(dir_index)
+        return os.path.join(self.root, rel) if rel else self.root
+
+    def totals(self):
+        '''
+        Returns the folder_summary style (tracker, file_sizes, folder_counts).
+        '''
+        codes = self._np(self.ext_code, np.uint16)
+        counts = np.bincount(codes, minlength=len(self.extensions))
+        sizes = np.bincount(codes, weights=self._np(self.size, np.int64), minlength=len(self.extensions))
+        tracker = {ext: int(counts[i]) for i, ext in enumerate(self.extensions)}
+        file_sizes = {ext + '_size': int(sizes[i]) for i, ext in enumerate(self.extensions)}
+        return tracker, file_sizes, len(self.dir_parent) - 1 + self.linked_dirs
+
+    def histograms(self):
+        '''
+        Returns {extension: file count per SIZE_BIN_EDGES bin}, computed in one vectorized pass.
+        '''
+        nbins = len(SIZE_BIN_EDGES)
+        bins = np.searchsorted(SIZE_BIN_EDGES, self._np(self.size, np.int64), side='right') - 1
+        flat = self._np(self.ext_code, np.uint16).astype(np.int64) * nbins + bins
+        counts = np.bincount(flat, minlength=len(self.extensions) * nbins).reshape(-1, nbins)
+        return {ext: counts[i] for i, ext in enumerate(self.extensions)}
+
+    def largest(self, n):
+        '''
+        Returns [(path, size)] of the n largest files, largest first.
+        '''
+        sizes = self._np(self.size, np.int64)
+        n = min(n, len(sizes))
+        if n == 0:
+            return []
+        top = np.argpartition(sizes, len(sizes) - n)[len(sizes) - n:]
+        top = top[np.argsort(sizes[top])[::-1]]
+        return [(self.path(int(i)), int(sizes[i])) for i in top]
+
+    def rollup(self):
+        '''
+        Returns (bytes, files) arrays indexed by directory holding the totals of every
+        directory including all its descendants (du style). Directory totals are added
+        into their parents level by level from the deepest level up, in a single pass.
+        '''
+        ndirs = len(self.dir_parent)
+        file_dir = self._np(self.file_dir, np.uint32)
+        total_bytes = np.bincount(file_dir, weights=self._np(self.size, np.int64), minlength=ndirs).astype(np.int64)
+        total_files = np.bincount(file_dir, minlength=ndirs).astype(np.int64)
+        parent = self._np(self.dir_parent, np.int64)
+        depth = self._np(self.dir_depth, np.uint16)
+        order = np.argsort(depth, kind='stable')[::-1]
+        levels = np.split(order, np.flatnonzero(np.diff(depth[order])) + 1)
+        for level in levels:
+            level = level[parent[level] >= 0]
+            np.add.at(total_bytes, parent[level], total_bytes[level])
+            np.add.at(total_files, parent[level], total_files[level])
+        return total_bytes, total_files
+
+    def save(self, inventory_file):
+        '''
+        Writes the inventory as an uncompressed .npz file that load() maps back quickly.
+        '''
+        ext_table = StringTable()
+        for ext in self.extensions:
+            ext_table.add(ext)
+        with open(inventory_file, 'wb') as f:
+            np.savez(f,
+                     root=np.frombuffer(os.fsencode(self.root), dtype=np.uint8),
+                     linked_dirs=np.array(self.linked_dirs, dtype=np.int64),
+                     dir_blob=np.frombuffer(bytes(self.dir_paths.blob), dtype=np.uint8),
+                     dir_offsets=self._np(self.dir_paths.offsets, np.uint64),
+                     dir_parent=self._np(self.dir_parent, np.int64),
+                     dir_depth=self._np(self.dir_depth, np.uint16),
+                     name_blob=np.frombuffer(bytes(self.names.blob), dtype=np.uint8),
+                     name_offsets=self._np(self.names.offsets, np.uint64),
+                     file_dir=self._np(self.file_dir, np.uint32),
+                     size=self._np(self.size, np.int64),
+                     mtime=self._np(self.mtime, np.int64),
+                     ext_code=self._np(self.ext_code, np.uint16),
+                     ext_blob=np.frombuffer(bytes(ext_table.blob), dtype=np.uint8),
+                     ext_offsets=self._np(ext_table.offsets, np.uint64))
+
+    @classmethod
+    def load(cls, inventory_file):
+        data = np.load(inventory_file)
+        inv = cls(os.fsdecode(data['root'].tobytes()))
+        inv.linked_dirs = int(data['linked_dirs'])
+        inv.dir_paths = StringTable(bytearray(data['dir_blob'].tobytes()), array('Q', data['dir_offsets'].tobytes()))
+        inv.dir_parent = array('q', data['dir_parent'].tobytes())
+        inv.dir_depth = array('H', data['dir_depth'].tobytes())
+        inv.names = StringTable(bytearray(data['name_blob'].tobytes()), array('Q', data['name_offsets'].tobytes()))
+        inv.file_dir = array('I', data['file_dir'].tobytes())
+        inv.size = array('q', data['size'].tobytes())
+        inv.mtime = array('q', data['mtime'].tobytes())
+        inv.ext_code = array('H', data['ext_code'].tobytes())
+        ext_table = StringTable(bytearray(data['ext_blob'].tobytes()), array('Q', data['ext_offsets'].tobytes()))
+        for i in range(len(ext_table)):
+            inv._ext_index[ext_table.get(i)] = i
+            inv.extensions.append(ext_table.get(i))
+        return inv
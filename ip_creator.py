@@ -5,15 +5,40 @@ import argparse
 import time
 import re
 import shutil
-import hashlib
 import subprocess
-from logger import generate_log, make_desktop_logs_dir, remove_bad_files
-from metadata_extractor import format_details, image_exiftool, av_mediainfo, others_exiftool
+import queue
+import hashlib
+import csv
+import tarfile
+import tempfile
+import threading
+from logger import generate_log, make_desktop_logs_dir, remove_bad_files, add_logging_args, configure_logging
+from metrics import add_metrics_args, start_run, stage, tool, count
+from profiling import add_profile_args, run_main, span
+from hash_reader import file_digest, advise, DEFAULT_BLOCK_SIZE
+from object_store import ObjectStore, LINK_CHOICES
+from metadata_extractor import format_details, image_exiftool, av_mediainfo, others_exiftool, \
+    exiftool_file, mediainfo_file, merge_csv_files, extraction_tier
 
 # Empty class to create custom objects. Useful to modify argument lists.
 class Arguments():
     pass
 
+# Raised when the copy of an object does not match its source checksum.
+class IntegrityError(Exception):
+    pass
+
+UID_PATTERN = re.compile(pattern=r"[a-z]{4}\d{4}")
+
+# Defaults of the optional arguments of create_package(), as on the command line.
+PACKAGE_DEFAULTS = {"supplement": [], "kfs": 'n', "jhove": 'n', "brunnhilde": 'n', "other_sup": "",
+                    "pipeline": 'n', "workers": 4, "queue": 32, "jhove_batch": 50, "tar": "",
+                    "store": "", "store_link": 'hardlink', "fast": 'n', "retries": 3, "backoff": 2.0}
+
+# Folder of a package holding the copies of the objects that failed verification
+# after every retry, with a report of the failures, until a rerun copies them.
+QUARANTINE = "quarantine"
+
 # Below function parses input arguments from the command line provided by the user.
 def arg_parse():
 
@@ -45,9 +70,8 @@ def arg_parse():
     
     parser.add_argument('-o',
                         type=str,
-                        required=True,
                         default="", 
-                        help="Full path of output directory to place the uid package")
+                        help="Full path of output directory to place the uid package (required unless -tar is used)")
 
     parser.add_argument('-supplement',
                         type=str,
@@ -77,40 +101,173 @@ def arg_parse():
                         type=str,
                         default='', 
                         help="Enter the additional directory/file to be copied from a different source to the destination")
+
+    parser.add_argument('-pipeline',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="Extract the metadata of each object and audit it with jhove as soon as it is copied and verified, \
+                            instead of waiting for every object to be copied. Enter y/n")
+
+    parser.add_argument('-workers',
+                        type=int,
+                        default=4,
+                        help="Number of metadata extractor workers used with -pipeline y")
+
+    parser.add_argument('-queue',
+                        type=int,
+                        default=32,
+                        help="Maximum number of objects waiting for each stage with -pipeline y, copying pauses when it is reached")
+
+    parser.add_argument('-jhove_batch',
+                        type=int,
+                        default=50,
+                        help="Number of objects audited by each jhove call with -pipeline y or -tar")
+
+    parser.add_argument('-tar',
+                        type=str,
+                        default="",
+                        help="Write the package as a tar archive to this file, or to the standard output for '-', instead of \
+                            a folder in the output directory")
+
+    parser.add_argument('-store',
+                        type=str,
+                        default="",
+                        help="Full path of a content addressed object store. Objects are stored there once and linked into \
+                            the package, objects already stored for another package are neither copied nor hashed again")
+
+    parser.add_argument('-store_link',
+                        choices=LINK_CHOICES,
+                        type=str,
+                        default='hardlink',
+                        help="How package objects are made from the store with -store (falls back to a copy when not possible)")
+
+    parser.add_argument('-fast',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="Extract the metadata from the headers of the objects only (exiftool -fast2, mediainfo ParseSpeed 0), \
+                            recorded in the extraction_tier column of the metadata csv files. Enter y/n")
+
+    parser.add_argument('-retries',
+                        type=int,
+                        default=3,
+                        help="Number of times the copy of an object is tried again when it does not match its source checksum \
+                            or fails with an I/O error, before the object is quarantined")
+
+    parser.add_argument('-backoff',
+                        type=float,
+                        default=2.0,
+                        help="Seconds waited before the first retry of a copy, doubled before every further retry")
     
+    add_logging_args(parser)
+    add_metrics_args(parser)
+    add_profile_args(parser)
+
     parsed_args = parser.parse_args()
 
     return parsed_args
 
 # Logic used to determine the manifest checksum for a single file.
 # Function taken from ififuncs.py from IFIscripts repository: https://github.com/Irish-Film-Institute/IFIscripts/blob/master/scripts/ififuncs.py
-def hashlib_md5(filename):
+def hashlib_md5(filename, drop_cache=None):
     '''
     uses hashlib to return an MD5 checksum of an input filename
     '''
-    read_size = 0
-    last_percent_done = 0
-    m = hashlib.md5()
-    total_size = os.path.getsize(filename)
-    with open(str(filename), 'rb') as f:
-        while True:
-            buf = f.read(2**20)
-            if not buf:
-                break
-            read_size += len(buf)
-            m.update(buf)
-            percent_done = 100 * read_size / total_size
-            if percent_done > last_percent_done:
-                sys.stdout.write('[%d%%]\r' % percent_done)
-                sys.stdout.flush()
-                last_percent_done = percent_done
-    md5_output = m.hexdigest()
+    with stage("hash", file=str(filename)):
+        md5_output, read_size = file_digest(str(filename), progress=show_progress, drop_cache=drop_cache)
+    count("hash", bytes=read_size, files=1)
     return md5_output
 
+# Below function shows how much of a file has been hashed.
+def show_progress(read_size, total_size):
+    sys.stdout.write('[%d%%]\r' % (100 * read_size / total_size))
+    sys.stdout.flush()
+
+# Below function copies one object to file_dest, through the object store if any,
+# and returns the checksums of the source and of the copy (they only differ if the
+# copy failed).
+def copy_object(file_src, file_dest, output_path, store=None):
+    if store:
+        # Linked from the object store, copied into it first if not held yet
+        return store.put(file_src, file_dest, output_path)
+    # The source is read again by the copy, its pages are kept cached until then
+    hash_source = str(hashlib_md5(file_src, drop_cache=False))
+    with span("copy", "copy", file=file_src):
+        shutil.copy2(file_src, file_dest)
+    hash_dest = str(hashlib_md5(file_dest))
+    return hash_source, hash_dest
+
+# Below function returns the number of times each object copy is attempted, a
+# negative number of retries meaning none.
+def copy_attempts(args):
+    return max(args.retries, 0) + 1
+
+# Below function copies one object, trying again up to args.retries times when the
+# copy does not match its source or fails with an I/O error (a network share glitch),
+# waiting args.backoff seconds before the first retry and twice as long before each
+# next one. Returns the checksum of the verified copy and None, or None and the
+# [source md5, copy md5, reason] of the last failure.
+def copy_with_retries(args, file_src, file_dest, output_path, store, log_name_source):
+    attempts = copy_attempts(args)
+    for attempt in range(1, attempts + 1):
+        try:
+            hash_source, hash_dest = copy_object(file_src, file_dest, output_path, store)
+            if hash_source == hash_dest:
+                return hash_dest, None
+            failure = [hash_source, hash_dest, "checksum mismatch"]
+        except OSError as e:
+            failure = ["", "", str(e)]
+        if attempt < attempts:
+            delay = args.backoff * 2 ** (attempt - 1)
+            print(f"- Attempt {attempt} of {attempts} to copy {file_src} failed ({failure[2]}) - retrying in {delay:g} seconds")
+            generate_log(log_name_source, f"- Attempt {attempt} of {attempts} to copy {file_src} failed ({failure[2]}) - retrying in {delay:g} seconds",
+                         stage="copy", file=file_src)
+            count("retry", files=1)
+            time.sleep(delay)
+    return None, failure
+
+# Below function moves what is left of a failed copy into the quarantine folder of
+# the package, out of its objects. Returns the path it was moved to, if any.
+def quarantine_object(output_path, file_dest):
+    if not os.path.lexists(file_dest):
+        return ""
+    quarantined = os.path.join(output_path, QUARANTINE, os.path.relpath(file_dest, output_path))
+    os.makedirs(os.path.dirname(quarantined), exist_ok=True)
+    os.replace(file_dest, quarantined)
+    return quarantined
+
+# Below function tells if an object listed in the manifest by an earlier run is
+# still the copy of its source : same size and modification time (kept by the copy,
+# within the 2 seconds resolution of some network shares).
+def already_copied(file_src, file_dest):
+    if not os.path.isfile(file_dest):
+        return False
+    st_src = os.stat(file_src)
+    st_dest = os.stat(file_dest)
+    return st_src.st_size == st_dest.st_size and abs(st_src.st_mtime - st_dest.st_mtime) <= 2
+
+# Below function reads the objects manifest of a package, if any, into a dictionary
+# of the relative paths of the objects and their md5 checksums.
+def read_objects_manifest(manifest):
+    copied = {}
+    if os.path.isfile(manifest):
+        with open(manifest, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    md5, rel_path = line.rstrip("\n").split("  ", 1)
+                    copied[rel_path] = md5
+    return copied
+
 # Below function is used to copy files of interest into the "objects"
 # folder while storing supplement files if required, in the "supplement"
-# folder.
-def objects_and_supplements_ip(args, log_name_source):
+# folder. "verified" is called with the source and destination paths of
+# every object once its copy is verified. Objects whose copy still fails
+# after every retry are quarantined and reported, the objects verified are
+# kept, and IntegrityError is raised once every object has been tried.
+# Objects listed in the manifest by an earlier run and unchanged since are
+# not copied again, so running the package again only copies the failures.
+def objects_and_supplements_ip(args, log_name_source, verified=None):
     
     input_path = args.i
     file_formats = args.format_list
@@ -119,6 +276,15 @@ def objects_and_supplements_ip(args, log_name_source):
     objects_folder = args.objects_folder
     supplement_folder = args.supplement_folder
     manifest = os.path.join(output_path, "objects_manifest.md5")
+    store = getattr(args, 'object_store', None)
+    quarantine_folder = os.path.join(output_path, QUARANTINE)
+    report = os.path.join(quarantine_folder, "failed_objects.csv")
+    copied = read_objects_manifest(manifest)
+    failures = []
+    rewrite = False
+
+    if os.path.isdir(quarantine_folder):
+        shutil.rmtree(quarantine_folder)
 
     for root, _, files in os.walk(input_path):
         if files == () or files == []:
@@ -128,15 +294,11 @@ def objects_and_supplements_ip(args, log_name_source):
             file_format = (os.path.splitext(file)[1]).lower()
             if file_format in file_formats:
                 file_src = os.path.join(root, file)
-                hash_source = str(hashlib_md5(file_src))
+                copy_start = time.time()
 
-                
                 if args.kfs == 'n':
-                    shutil.copy2(file_src, objects_folder)
-
                     new_file_name = os.path.basename(root) + "_" + file
                     file_dest = os.path.join(objects_folder, new_file_name)
-                    os.rename(os.path.join(objects_folder, file), file_dest)
 
                 else:
                     relative_path = os.path.relpath(root, os.path.dirname(input_path))
@@ -148,23 +310,41 @@ def objects_and_supplements_ip(args, log_name_source):
                     # Copy the file to the new destination preserving the directory structure
                     new_file_name = file
                     file_dest = os.path.join(dest_dir, new_file_name)
-                    shutil.copy2(file_src, file_dest)
-
-                hash_dest = str(hashlib_md5(file_dest))
 
-                if hash_source != hash_dest:
-                    print(f"- File {file} not copied properly, integrity compromised. Exiting ip_creator.py")
-                    generate_log(log_name_source, f'- File {file} not copied properly, integrity compromised. Exiting ip_creator.py')
-                    shutil.rmtree(output_path)
-                    sys.exit()
+                rel_path = os.path.relpath(file_dest, output_path)
+                if rel_path in copied and already_copied(file_src, file_dest):
+                    print(f"{file} already copied and verified by an earlier run - skipping")
+                    count("skip", bytes=os.path.getsize(file_dest), files=1)
+                    if verified:
+                        verified(file_src, file_dest)
+                    continue
+
+                hash_dest, failure = copy_with_retries(args, file_src, file_dest, output_path, store, log_name_source)
+                if failure:
+                    quarantined = quarantine_object(output_path, file_dest)
+                    failures.append([file_src, rel_path, quarantined] + failure)
+                    if copied.pop(rel_path, None) is not None:
+                        rewrite = True
+                    print(f"- File {file} not copied properly after {copy_attempts(args)} attempt(s), integrity compromised - quarantined")
+                    generate_log(log_name_source, f"- File {file} not copied properly after {copy_attempts(args)} attempt(s), integrity compromised - quarantined",
+                                 stage="copy", file=file_src)
+                    continue
                 
                 print(f"{file} copied to destination correctly")
-                generate_log(log_name_source, f"{file} copied to destination correctly")
-
+                count("copy", bytes=os.path.getsize(file_dest), files=1)
+                generate_log(log_name_source, f"{file} copied to destination correctly",
+                             stage="copy", file=file_dest, bytes=os.path.getsize(file_dest),
+                             duration=round(time.time() - copy_start, 3))
+
+                if rel_path in copied:
+                    rewrite = True
+                copied[rel_path] = hash_dest
                 with open(manifest, 'a', encoding='utf-8') as f:
-                    rel_path = os.path.relpath(file_dest, output_path)
                     f.write(hash_dest + "  " + str(rel_path))
                     f.write("\n")
+
+                if verified:
+                    verified(file_src, file_dest)
             
             elif supplement_formats!=[] and file_format in supplement_formats:
                 file_src = os.path.join(root, file)
@@ -174,9 +354,28 @@ def objects_and_supplements_ip(args, log_name_source):
                 new_file_name = os.path.basename(root) + "_" + file
                 file_dest = os.path.join(supplement_folder, new_file_name)
                 os.rename(os.path.join(supplement_folder, file), file_dest)
+
+    # Objects copied again or quarantined since an earlier run are listed once, with their new checksum
+    if rewrite:
+        with open(manifest, 'w', encoding='utf-8') as f:
+            for rel_path, md5 in copied.items():
+                f.write(md5 + "  " + str(rel_path))
+                f.write("\n")
             
     print(f"Manifest file ready for {args.format} files at {manifest}")
     generate_log(log_name_source, f"Manifest file ready for {args.format} files at {manifest}")
+
+    if failures:
+        os.makedirs(quarantine_folder, exist_ok=True)
+        with open(report, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(["source", "object", "quarantined_copy", "source_md5", "copy_md5", "reason"])
+            writer.writerows(failures)
+        print(f"- {len(failures)} object(s) could not be copied properly and are listed in {report}. "
+              f"Run ip_creator.py again with the same uid to copy only these objects")
+        generate_log(log_name_source, f"- {len(failures)} object(s) could not be copied properly and are listed in {report}")
+        raise IntegrityError(f"{len(failures)} object(s) of {output_path} not copied properly, see {report}")
+
     print(f"Finished processing object and supplementary files for {args.format} files")
     generate_log(log_name_source, f"Finished processing object and supplementary files for {args.format} files")
     return
@@ -184,13 +383,12 @@ def objects_and_supplements_ip(args, log_name_source):
 # Below function checks if the user entered "uid" names adheres to 
 # a specfic condition.
 def uid_pattern_check(uid):
-    uid_pattern = re.compile(pattern=r"[a-z]{4}\d{4}")
-    m = uid_pattern.fullmatch(uid)
+    m = UID_PATTERN.fullmatch(uid)
     while m is None: #or len(m.group()) != 7:
         print("\nWrong format followed - Enter the uid which follows the below rule")
         print("Name format - 4 lowercase alphabets followed by 4 digits (Example : 'doaa4321')")
         uid = input("Please input an uid which follows the above rule: ")
-        m = uid_pattern.fullmatch(uid)
+        m = UID_PATTERN.fullmatch(uid)
 
     return uid
 
@@ -206,7 +404,8 @@ def jhove_audit(args, log_name_source):
     {os.path.expanduser("~/")}jhove/jhove -h Audit -o "{jhove_xml_file}" "{args.objects_folder}"
     """
     print(command)
-    subprocess.run(command, shell=True, text=True)
+    with stage("jhove"), tool("jhove"):
+        subprocess.run(command, shell=True, text=True)
 
     print(' - JHOVE available/enabled - auditing process completed')
     generate_log(log_name_source, ' - JHOVE available/enabled - auditing process completed')
@@ -224,7 +423,8 @@ def brunnhilde_scan(args, log_name_source):
     brunnhilde.py "{args.objects_folder}" "{brunnhilde_output_folder}"
     """
     print(command)
-    subprocess.run(command, shell=True, text=True)
+    with stage("brunnhilde"), tool("brunnhilde"):
+        subprocess.run(command, shell=True, text=True)
 
 
     os.rename(os.path.join(brunnhilde_output_folder, "report.html"), \
@@ -239,79 +439,300 @@ def brunnhilde_scan(args, log_name_source):
     print(' - brunnhilde-ClamAV available/enabled - scanning process completed')
     generate_log(log_name_source, ' - brunnhilde-ClamAV available/enabled - scanning process completed')
 
-# Below function is the main logic to setup all the required folders for 
-# "information package" creation. It also ensures all required arguments
-# are entered properly by the user.
-def main():
-    args = arg_parse()
-    input_path = args.i
-    log_name_source_ = "ip_creator_"  + str(os.path.basename(input_path)) + time.strftime("_%Y_%m_%dT%H_%M_%S") + ".log"
-    desktop_logs_dir = make_desktop_logs_dir()
-    log_name_source = os.path.join(desktop_logs_dir, log_name_source_)
-    
-    if not os.path.isdir(input_path):
-        print(' - Input must be a directory/folder - exiting!')
-        generate_log(log_name_source, ' - Input must be a directory/folder - exiting!')
-        sys.exit()
+# Below function audits one batch of objects with jhove, writing the results of
+# batch number "shard" into its own xml file in the "metadata" folder.
+def jhove_shard(args, files, shard, log_name_source):
 
-    remove_bad_files(input_path, log_name_source)
-    
-    if args.uid == "":
-        uid = input('Please enter the uid name to be created (Do not enter an empty string): ')
-        uid = uid_pattern_check(uid)
+    jhove_xml_file = os.path.join(args.metadata_folder, args.uid + f"_jhove_audit_{shard:04d}.xml")
+    targets = " ".join(f'"{f}"' for f in files)
+    command = f"""\
+    {os.path.expanduser("~/")}jhove/jhove -h Audit -o "{jhove_xml_file}" {targets}
+    """
+    with stage("jhove", shard=shard), tool("jhove", shard=shard, files=len(files)):
+        subprocess.run(command, shell=True, text=True)
+
+    print(f' - JHOVE audit of {len(files)} objects written to {jhove_xml_file}')
+    generate_log(log_name_source, f' - JHOVE audit of {len(files)} objects written to {jhove_xml_file}')
+
+# Below function is the pipelined counterpart of the copy, metadata, jhove and
+# brunnhilde stages of main(). Every object is put on a bounded queue as soon as its
+# copy is verified; metadata extractor workers take objects from it and hand them on
+# to the jhove stage, which audits them in batches of "jhove_batch" objects. A full
+# queue pauses the stage feeding it, so a slow stage holds back copying instead of
+# piling up work. The brunnhilde scan needs the whole "objects" folder and runs once
+# copying is done, while the other stages catch up.
+def pipelined_ip(args, metadata, log_name_source):
+
+    if metadata is av_mediainfo:
+        extract_file = mediainfo_file
+        folders = ["mediainfo_csv", "mediainfo_pbcore"]
     else:
-        uid = uid_pattern_check(args.uid)
-    
-    args.uid = uid
-    output_path_ = args.o
-    os.makedirs(output_path_, exist_ok= True)
-    output_path = os.path.join(output_path_, uid)
+        extract_file = exiftool_file
+        folders = ["exif_csv", "exif_txt"]
+    for folder in folders:
+        os.makedirs(os.path.join(args.metadata_folder, folder), exist_ok=True)
 
-    if os.path.exists(output_path):
-        q = input(f"Warning - {output_path} path already exists, do you want to continue with package creation with this uid? (y/n): ")
-        generate_log(log_name_source, f"Warning - {output_path} path already exists, do you want to continue with package creation with this uid? (y/n)")
-        generate_log(log_name_source, str(q))
-        if q.lower() != 'y':
-            print("ip_creator.py - Process Exiting")
-            generate_log(log_name_source, "ip_creator.py - Process Exiting")
-            sys.exit()
-    
-    if args.supplement == "":
-        q = input("Would you like to preserve supplementary files of specific formats? (y/n): ")
-        if q.lower() == 'y':
-            supplement = input('Enter supplements list: ')
-            generate_log(log_name_source, f"Supplementary formats to be preserved - {supplement}")
-            supplement = list(map(str, supplement.strip().split(" ")))
-        else:
-            supplement = []
-            print("No supplmentary formats to be preserved")
-            generate_log(log_name_source, "No supplmentary formats to be preserved")
-    else:
-        supplement = args.supplement
-        generate_log(log_name_source, f"Supplementary formats to be preserved - {supplement}")
+    audit = args.jhove == 'y' and args.format in ['.tiff', '.jpeg', '.jpeg2000', '.pdf']
+    objects = queue.Queue(maxsize=args.queue)
+    audits = queue.Queue(maxsize=args.queue)
+    done = object()
 
-    if args.jhove == "":
-        q = input("Would you like to generate a jhove audit report? (Ensure jhove installed in this system. \
-                  Provide y/n as your input)")
-        if q.lower() == 'y':
-            args.jhove = 'y'
-            generate_log(log_name_source, f"Enabling jhove audit report")
-        else:
-            args.jhove = 'n'
-            generate_log(log_name_source, "Ignoring jhove auditing")
+    def extractor():
+        while True:
+            item = objects.get()
+            if item is done:
+                return
+            file_src, file_dest = item
+            try:
+                with stage("metadata", file=file_src):
+                    extract_file(file_src, args.metadata_folder, extraction_tier(args))
+            except Exception as e:
+                print(f"Could not extract the metadata of {file_src} - {e}")
+                generate_log(log_name_source, f"Could not extract the metadata of {file_src} - {e}")
+            if audit:
+                audits.put(file_dest)
+
+    audit_errors = []
+
+    def auditor():
+        batch = []
+        shard = 0
+        item = None
+        try:
+            while True:
+                item = audits.get()
+                if item is not done:
+                    batch.append(item)
+                if batch and (item is done or len(batch) >= args.jhove_batch):
+                    shard += 1
+                    jhove_shard(args, batch, shard, log_name_source)
+                    batch = []
+                if item is done:
+                    return
+        except Exception as e:
+            audit_errors.append(e)
+            print(f"- JHOVE audit failed - {e} - the remaining objects are not audited")
+            generate_log(log_name_source, f"- JHOVE audit failed - {e} - the remaining objects are not audited")
+            # Keep emptying the queue, the extractors must never block on it
+            while item is not done:
+                item = audits.get()
+
+    print(f"Pipelined mode - {args.workers} metadata worker(s), queues of {args.queue} objects")
+    generate_log(log_name_source, f"Pipelined mode - {args.workers} metadata worker(s), queues of {args.queue} objects")
+
+    extractors = [threading.Thread(target=extractor, name=f"metadata_{n}") for n in range(max(args.workers, 1))]
+    auditors = [threading.Thread(target=auditor, name="jhove")] if audit else []
+    for thread in extractors + auditors:
+        thread.start()
+
+    try:
+        with stage("copy"):
+            objects_and_supplements_ip(args, log_name_source,
+                                       verified=lambda file_src, file_dest: objects.put((file_src, file_dest)))
+        if args.brunnhilde == 'y':
+            brunnhilde_scan(args, log_name_source)
+    finally:
+        for _ in extractors:
+            objects.put(done)
+        with stage("drain"):
+            for thread in extractors:
+                thread.join()
+            audits.put(done)
+            for thread in auditors:
+                thread.join()
+
+    try:
+        merge_csv_files(os.path.join(args.metadata_folder, folders[0]),
+                        os.path.join(args.metadata_folder, args.uid + "_merged.csv"))
+        print(f'Merged csv files into master_csv for {args.format}')
+        generate_log(log_name_source, f' Merged csv files into master_csv for {args.format}')
+    except Exception as e:
+        print(f'Could not perform the csv files merge operation - \n {e}')
+        generate_log(log_name_source, f' Could not perform the csv files merge operation - \n {e}')
+
+    if audit_errors:
+        raise audit_errors[0]
+
+# File object hashing the bytes read through it, used to checksum each object
+# while tarfile streams it into the archive.
+class HashingFile():
+
+    def __init__(self, f, h):
+        self.f = f
+        self.h = h
+        self.read_size = 0
+
+    def read(self, size=-1):
+        buf = self.f.read(size)
+        self.h.update(buf)
+        self.read_size += len(buf)
+        return buf
+
+# Below function keeps the standard output for the tar stream and points file
+# descriptor 1 at the standard error, so messages, prompts and external tools
+# writing to the standard output cannot corrupt the archive.
+def claim_stdout():
+    sys.stdout.flush()
+    tar_stream = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+    return tar_stream
+
+# Below function streams one file into the archive as "arcname" and returns its
+# md5 checksum, computed from the bytes written to the archive.
+def add_to_tar(tar, file_src, arcname):
+    tarinfo = tar.gettarinfo(file_src, arcname)
+    m = hashlib.md5()
+    with open(file_src, 'rb') as f:
+        advise(f.fileno(), 0, 0, 'POSIX_FADV_SEQUENTIAL')
+        hashing_file = HashingFile(f, m)
+        tar.addfile(tarinfo, hashing_file)
+        advise(f.fileno(), 0, 0, 'POSIX_FADV_DONTNEED')
+    if hashing_file.read_size != tarinfo.size:
+        raise IntegrityError(f"{file_src} changed while being archived")
+    count("copy", bytes=tarinfo.size, files=1)
+    return m.hexdigest()
+
+# Below function is the tar counterpart of create_package(): the package is written
+# as "<uid>/..." members of a tar archive (args.tar, or the standard output for "-")
+# instead of a folder, so tape/cold storage bound packages are written only once.
+# Objects and supplements are streamed into the archive straight from the source,
+# each object being hashed on its way in. The metadata is extracted into a temporary
+# folder (jhove audits the source objects) and appended with the manifest at the end.
+def tar_ip(args, metadata, args_object, log_name_source):
 
-    if args.brunnhilde == "":
-        q = input("Would you like to generate a siegfried-brunnhilde virus report? (Ensure \
-                  brunnhilde/clamAV installed in this system. Recommended OS for using this feature is MacOS.\
-                  Provide y/n as your input) ")
-        if q.lower() == 'y':
-            args.brunnhilde = 'y'
-            generate_log(log_name_source, f"Enabling jhove audit report")
+    if args.brunnhilde == 'y':
+        print("- Brunnhilde scanning needs the objects folder and is not available with -tar, scan the extracted package instead")
+        generate_log(log_name_source, "- Brunnhilde scanning is not available with -tar - skipped")
+
+    # The archive is written as "<tar>.partial" and only renamed once complete, so a
+    # run failing half way never leaves a truncated archive looking like a package.
+    if args.tar == '-':
+        fileobj = getattr(args, 'tar_stream', None) or claim_stdout()
+        partial = ""
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(args.tar)), exist_ok=True)
+        partial = args.tar + ".partial"
+        fileobj = open(partial, 'wb')
+
+    staging_folder = tempfile.mkdtemp(prefix=args.uid + "_")
+    args_object.dest = os.path.join(staging_folder, args.uid)
+    args.metadata_folder = os.path.join(args_object.dest, "metadata")
+    os.makedirs(args.metadata_folder)
+    manifest = []
+    objects = []
+
+    try:
+        with fileobj, tarfile.open(fileobj=fileobj, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+            tar.copybufsize = DEFAULT_BLOCK_SIZE
+            with stage("copy"):
+                for root, _, files in os.walk(args.i):
+                    for file in files:
+                        file_format = (os.path.splitext(file)[1]).lower()
+                        file_src = os.path.join(root, file)
+                        if file_format in args.format_list:
+                            if args.kfs == 'n':
+                                rel_path = os.path.join("objects", os.path.basename(root) + "_" + file)
+                            else:
+                                rel_path = os.path.join("objects", os.path.relpath(root, os.path.dirname(args.i)), file)
+                            copy_start = time.time()
+                            with span("copy", "copy", file=file_src):
+                                md5 = add_to_tar(tar, file_src, os.path.join(args.uid, rel_path))
+                            manifest.append(md5 + "  " + rel_path + "\n")
+                            objects.append(file_src)
+                            print(f"{file} copied to archive")
+                            generate_log(log_name_source, f"{file} copied to archive",
+                                         stage="copy", file=file_src, bytes=os.path.getsize(file_src),
+                                         duration=round(time.time() - copy_start, 3))
+                        elif args.supplement != [] and file_format in args.supplement:
+                            rel_path = os.path.join("supplement", os.path.basename(root) + "_" + file)
+                            tar.add(file_src, os.path.join(args.uid, rel_path))
+
+                if args.other_sup and os.path.exists(args.other_sup):
+                    print("Other folder/directory is entered for copying into the archive")
+                    generate_log(log_name_source, "Other folder/directory is entered for copying into the archive")
+                    tar.add(args.other_sup, os.path.join(args.uid, "supplement", os.path.basename(args.other_sup)))
+                elif args.other_sup:
+                    print("Enter a valid directory or file to copied in the destination")
+                    generate_log(log_name_source, "Enter a valid directory or file to copied in the destination - Exiting")
+
+            with stage("metadata"):
+                metadata(args_object, log_name_source)
+
+            if args.jhove == 'y' and args.format in ['.tiff', '.jpeg', '.jpeg2000', '.pdf']:
+                for shard, start in enumerate(range(0, len(objects), args.jhove_batch), 1):
+                    jhove_shard(args, objects[start:start + args.jhove_batch], shard, log_name_source)
+
+            manifest_file = os.path.join(args_object.dest, "objects_manifest.md5")
+            with open(manifest_file, 'w', encoding='utf-8') as f:
+                f.writelines(manifest)
+            tar.add(manifest_file, os.path.join(args.uid, "objects_manifest.md5"))
+            tar.add(args.metadata_folder, os.path.join(args.uid, "metadata"))
+        if partial:
+            os.replace(partial, args.tar)
+    except BaseException:
+        if partial:
+            if os.path.exists(partial):
+                os.remove(partial)
+            print(f"- Packaging failed, the incomplete archive {partial} was deleted")
+            generate_log(log_name_source, f"- Packaging failed, the incomplete archive {partial} was deleted")
         else:
-            args.brunnhilde = 'n'
-            generate_log(log_name_source, "Ignoring jhove auditing")
-    
+            print("- Packaging failed, the archive written to the standard output is incomplete")
+            generate_log(log_name_source, "- Packaging failed, the archive written to the standard output is incomplete")
+        raise
+    finally:
+        shutil.rmtree(staging_folder, ignore_errors=True)
+
+    print(f"Package of {len(manifest)} {args.format} objects written to {'the standard output' if args.tar == '-' else args.tar}")
+    generate_log(log_name_source, f"Package of {len(manifest)} {args.format} objects written to {'the standard output' if args.tar == '-' else args.tar}")
+    return args.tar
+
+# Below function returns the arguments of create_package() for packaging the
+# "format" objects of input_path into output_path/uid, the remaining options taking
+# the defaults of the command line unless given as keyword arguments.
+def package_arguments(input_path, output_path, uid, format, **options):
+    args = Arguments()
+    args.i = input_path
+    args.o = output_path
+    args.uid = uid
+    args.format = format
+    for option, default in PACKAGE_DEFAULTS.items():
+        setattr(args, option, options.pop(option, default))
+    if options:
+        raise TypeError(f"Unknown package option(s) {list(options)}")
+    return args
+
+# Below function verifies a package against its objects manifest and returns the
+# relative paths of the objects missing or whose md5 checksum does not match.
+def verify_package(package_path, log_name_source):
+    failed = []
+    with open(os.path.join(package_path, "objects_manifest.md5"), encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            md5, rel_path = line.rstrip("\n").split("  ", 1)
+            file_path = os.path.join(package_path, rel_path)
+            if not os.path.isfile(file_path) or hashlib_md5(file_path) != md5:
+                failed.append(rel_path)
+                print(f"- {rel_path} failed verification")
+                generate_log(log_name_source, f"- {rel_path} failed verification")
+    print(f"Package {package_path} verified - {len(failed)} object(s) failed")
+    generate_log(log_name_source, f"Package {package_path} verified - {len(failed)} object(s) failed")
+    return failed
+
+# Below function creates the information package of args.uid from args.i in args.o
+# without asking anything, so it can be called from other scripts (see
+# ingest_daemon.py) with the arguments built by package_arguments(). main() asks
+# for whatever is missing from the command line, then calls it. Raises ValueError
+# for an invalid uid/format and IntegrityError if an object is not copied properly.
+# Returns the path of the package created.
+def create_package(args, log_name_source):
+
+    if UID_PATTERN.fullmatch(args.uid) is None:
+        print(f"{args.uid} is not a valid uid - 4 lowercase alphabets followed by 4 digits (Example : 'doaa4321')")
+        generate_log(log_name_source, f"{args.uid} is not a valid uid - 4 lowercase alphabets followed by 4 digits")
+        raise ValueError(f"{args.uid} is not a valid uid")
 
+    output_path = os.path.join(args.o, args.uid)
     args_object = Arguments()
 
     # format = args.format
@@ -347,11 +768,18 @@ def main():
     else:
         generate_log(log_name_source, "Enter a proper av/image/text format to package")
         print("Enter a proper image/av/text format to package")
-        sys.exit()
+        raise ValueError(f"{format} is not a known av/image/text format")
 
 
-    args_object.i = input_path
+    args_object.i = args.i
     args_object.dest = output_path
+    args_object.fast = args.fast
+
+    if args.tar:
+        return tar_ip(args, metadata, args_object, log_name_source)
+
+    if args.store:
+        args.object_store = ObjectStore(args.store, args.store_link)
     
     os.makedirs(output_path, exist_ok=True)
 
@@ -368,11 +796,20 @@ def main():
     
     os.makedirs(supplement_folder, exist_ok=True)
     
-    # Creating required objects structure of the information package creation
-    objects_and_supplements_ip(args, log_name_source)
+    try:
+        if args.pipeline == 'y':
+            pipelined_ip(args, metadata, log_name_source)
+        else:
+            # Creating required objects structure of the information package creation
+            with stage("copy"):
+                objects_and_supplements_ip(args, log_name_source)
 
-    # Calling appropriate metadata extractor function
-    metadata(args_object, log_name_source)
+            # Calling appropriate metadata extractor function
+            with stage("metadata"):
+                metadata(args_object, log_name_source)
+    finally:
+        if args.store:
+            args.object_store.close()
 
     other = args.other_sup
     if other:
@@ -395,10 +832,10 @@ def main():
             print("Enter a valid directory or file to copied in the destination")
             generate_log(log_name_source, "Enter a valid directory or file to copied in the destination - Exiting")
     
-    if args.jhove == 'y' and args.format in ['.tiff', '.jpeg', '.jpeg2000', '.pdf']:
+    if args.pipeline == 'n' and args.jhove == 'y' and args.format in ['.tiff', '.jpeg', '.jpeg2000', '.pdf']:
         jhove_audit(args, log_name_source)
     
-    if args.brunnhilde == 'y':
+    if args.pipeline == 'n' and args.brunnhilde == 'y':
         brunnhilde_scan(args, log_name_source)
     
 
@@ -406,8 +843,108 @@ def main():
         if len(os.listdir(supplement_folder)) == 0:
             os.removedirs(supplement_folder)
     
+    return output_path
+
+# Below function is the main logic to setup all the required folders for 
+# "information package" creation. It also ensures all required arguments
+# are entered properly by the user.
+def main():
+    args = arg_parse()
+    if args.tar == '-':
+        args.tar_stream = claim_stdout()
+    configure_logging(args)
+    input_path = args.i
+    log_name_source_ = "ip_creator_"  + str(os.path.basename(input_path)) + time.strftime("_%Y_%m_%dT%H_%M_%S") + ".log"
+    desktop_logs_dir = make_desktop_logs_dir()
+    log_name_source = os.path.join(desktop_logs_dir, log_name_source_)
+    start_run("ip_creator", log_name_source, args)
+    
+    if not os.path.isdir(input_path):
+        print(' - Input must be a directory/folder - exiting!')
+        generate_log(log_name_source, ' - Input must be a directory/folder - exiting!')
+        sys.exit()
+
+    if not args.o and not args.tar:
+        print(' - An output directory (-o) or a tar archive (-tar) must be provided - exiting!')
+        generate_log(log_name_source, ' - An output directory (-o) or a tar archive (-tar) must be provided - exiting!')
+        sys.exit()
+
+    with stage("sweep"):
+        remove_bad_files(input_path, log_name_source)
+    
+    if args.uid == "":
+        uid = input('Please enter the uid name to be created (Do not enter an empty string): ')
+        uid = uid_pattern_check(uid)
+    else:
+        uid = uid_pattern_check(args.uid)
+    
+    args.uid = uid
+    output_path_ = args.o
+    if output_path_:
+        os.makedirs(output_path_, exist_ok= True)
+    output_path = os.path.join(output_path_, uid)
+
+    if args.tar and os.path.exists(args.tar):
+        q = input(f"Warning - {args.tar} already exists, do you want to overwrite it? (y/n): ")
+        generate_log(log_name_source, f"Warning - {args.tar} already exists, do you want to overwrite it? (y/n)")
+        generate_log(log_name_source, str(q))
+        if q.lower() != 'y':
+            print("ip_creator.py - Process Exiting")
+            generate_log(log_name_source, "ip_creator.py - Process Exiting")
+            sys.exit()
+    elif not args.tar and os.path.exists(output_path):
+        q = input(f"Warning - {output_path} path already exists, do you want to continue with package creation with this uid? (y/n): ")
+        generate_log(log_name_source, f"Warning - {output_path} path already exists, do you want to continue with package creation with this uid? (y/n)")
+        generate_log(log_name_source, str(q))
+        if q.lower() != 'y':
+            print("ip_creator.py - Process Exiting")
+            generate_log(log_name_source, "ip_creator.py - Process Exiting")
+            sys.exit()
+    
+    if args.supplement == "":
+        q = input("Would you like to preserve supplementary files of specific formats? (y/n): ")
+        if q.lower() == 'y':
+            supplement = input('Enter supplements list: ')
+            generate_log(log_name_source, f"Supplementary formats to be preserved - {supplement}")
+            supplement = list(map(str, supplement.strip().split(" ")))
+        else:
+            supplement = []
+            print("No supplmentary formats to be preserved")
+            generate_log(log_name_source, "No supplmentary formats to be preserved")
+    else:
+        supplement = args.supplement
+        generate_log(log_name_source, f"Supplementary formats to be preserved - {supplement}")
+
+    if args.jhove == "":
+        q = input("Would you like to generate a jhove audit report? (Ensure jhove installed in this system. \
+                  Provide y/n as your input)")
+        if q.lower() == 'y':
+            args.jhove = 'y'
+            generate_log(log_name_source, f"Enabling jhove audit report")
+        else:
+            args.jhove = 'n'
+            generate_log(log_name_source, "Ignoring jhove auditing")
+
+    if args.brunnhilde == "":
+        q = input("Would you like to generate a siegfried-brunnhilde virus report? (Ensure \
+                  brunnhilde/clamAV installed in this system. Recommended OS for using this feature is MacOS.\
+                  Provide y/n as your input) ")
+        if q.lower() == 'y':
+            args.brunnhilde = 'y'
+            generate_log(log_name_source, f"Enabling jhove audit report")
+        else:
+            args.brunnhilde = 'n'
+            generate_log(log_name_source, "Ignoring jhove auditing")
+
+    args.supplement = supplement
+    try:
+        create_package(args, log_name_source)
+    except ValueError:
+        sys.exit()
+    except IntegrityError:
+        sys.exit(1)
     return
 
 # Below code marks the start of execution of the program.
 if __name__ == "__main__":
-    main()
+    run_main(main)
@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
 import os
+import sys
 import time
 import getpass
 import csv
+import fnmatch
+import json
+import queue
+import atexit
+import threading
 from pymediainfo import MediaInfo
 
 # Code from IFIScripts github repository
@@ -11,37 +17,175 @@ def make_desktop_logs_dir():
     os.makedirs(desktop_logs_dir, exist_ok= True)
     return desktop_logs_dir
 
-def generate_log(log, what2log):
-    if not os.path.isfile(log):
-        with open(log, "w", encoding='utf-8') as fo:
-            fo.write(time.strftime("%Y-%m-%dT%H:%M:%S ")
-                     + getpass.getuser()
-                     + ' ' + what2log + ' \n')
-    else:
-        with open(log, "a", encoding='utf-8') as fo:
-            fo.write(time.strftime("%Y-%m-%dT%H:%M:%S ")
-                     + getpass.getuser()
-                     + ' ' + what2log + ' \n')
+# Background writer for the log files. Records are queued by generate_log() and
+# a single daemon thread appends them in batches, opening each log file once per
+# batch instead of once per message. Pending records are flushed at exit.
+class LogWriter():
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.records = queue.SimpleQueue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def put(self, path, line):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                    self.thread.start()
+                    atexit.register(self.flush)
+        self.records.put((path, line))
+
+    def flush(self):
+        '''
+        Blocks until every record queued so far is written.
+        '''
+        if self.thread is None:
+            return
+        done = threading.Event()
+        self.records.put((None, done))
+        # Never wait on a writer thread that is gone, nor forever on a stuck one.
+        while not done.wait(1) and self.thread.is_alive():
+            pass
+
+    def _run(self):
+        while True:
+            batch = [self.records.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = {}
+            markers = []
+            for path, line in batch:
+                if path is None:
+                    markers.append(line)
+                else:
+                    lines.setdefault(path, []).append(line)
+            # Names os.walk decoded with surrogate escapes (non UTF-8 file names) are
+            # written backslash escaped, and no failed write may stop the thread.
+            for path, chunk in lines.items():
+                try:
+                    with open(path, "a", encoding='utf-8', errors='backslashreplace') as fo:
+                        fo.writelines(chunk)
+                except Exception as e:
+                    sys.stderr.write(f"Could not write to log {path} - {e}\n")
+            for done in markers:
+                done.set()
+
+_writer = LogWriter()
+_user = None
+_json_lines = os.environ.get('UCCLIB_JSON_LOG', '') == 'y'
+
+def log_user():
+    global _user
+    if _user is None:
+        _user = getpass.getuser()
+    return _user
+
+# Below function adds the logging options shared by all scripts to their argument parser.
+def add_logging_args(parser):
+    parser.add_argument('-json_log',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="Additionally write the log as JSON lines (<log name>.jsonl) with stage, file, bytes and duration fields")
+
+# Below function applies the logging options parsed by add_logging_args().
+def configure_logging(args):
+    global _json_lines
+    _json_lines = _json_lines or getattr(args, 'json_log', 'n') == 'y'
+
+def flush_logs():
+    _writer.flush()
+
+def generate_log(log, what2log, stage=None, file=None, bytes=None, duration=None):
+    '''
+    Queues a log record. The text log keeps its usual "timestamp user message" lines;
+    the optional stage/file/bytes/duration fields only appear in the JSON lines log.
+    '''
+    now = time.strftime("%Y-%m-%dT%H:%M:%S ")
+    _writer.put(log, now + log_user() + ' ' + what2log + ' \n')
+    if _json_lines:
+        record = {"time": now.strip(), "user": log_user(), "message": what2log.strip()}
+        for key, value in (("stage", stage), ("file", file), ("bytes", bytes), ("duration", duration)):
+            if value is not None:
+                record[key] = value
+        _writer.put(os.path.splitext(log)[0] + ".jsonl", json.dumps(record) + "\n")
+
+# Operating system clutter that never belongs in a package.
+UNWANTED_FILES = ['.DS_Store', 'Thumbs.db', 'desktop.ini']
+
+# Additional unwanted file name patterns (shell style, e.g. "._*" for AppleDouble files).
+# Extended with register_unwanted_patterns() or the UCCLIB_UNWANTED_PATTERNS
+# environment variable (patterns separated by os.pathsep).
+UNWANTED_PATTERNS = [p for p in os.environ.get('UCCLIB_UNWANTED_PATTERNS', '').split(os.pathsep) if p]
+
+# Roots already swept during this run, mapped to the rules they were swept with.
+# Long running scripts (ingest_daemon.py) call forget_swept() before sweeping a
+# folder again, as files may have been added to it since.
+_swept_roots = {}
+_swept_lock = threading.Lock()
+
+def register_unwanted_patterns(*patterns):
+    for pattern in patterns:
+        if pattern not in UNWANTED_PATTERNS:
+            UNWANTED_PATTERNS.append(pattern)
+
+def is_unwanted(name):
+    return name in UNWANTED_FILES or any(fnmatch.fnmatchcase(name, p) for p in UNWANTED_PATTERNS)
 
 def remove_bad_files(root_dir, log_name_source):
     '''
     Removes unwanted files.
     Verify if this is different than the same function in ififuncs.
+    The sweep is done once per root per run: later calls for the same root (or a
+    folder inside it) return straight away unless the unwanted rules changed.
     '''
-    rm_these = ['.DS_Store', 'Thumbs.db', 'desktop.ini']
-    for root, _, files in os.walk(root_dir):
+    root = os.path.realpath(root_dir)
+    rules = (tuple(UNWANTED_FILES), tuple(UNWANTED_PATTERNS))
+    with _swept_lock:
+        for swept, swept_rules in _swept_roots.items():
+            if swept_rules == rules and (root == swept or root.startswith(swept.rstrip(os.sep) + os.sep)):
+                return
+
+    start = time.time()
+    removed = 0
+    removed_bytes = 0
+    for root_, _, files in os.walk(root_dir):
         for name in files:
-            path = os.path.join(root, name)
-            for i in rm_these:
-                if name == i:
-                    print(('***********************' + 'removing: ' + path))
-                    generate_log(
-                        log_name_source,
-                        'EVENT = Unwanted file removal - %s was removed' % path
-                    )
-                    try:
-                        os.remove(path)
-                    except OSError:
-                        print('can\'t delete as source is read-only')
-
-    print("Bad files removed - exiting process")
\ No newline at end of file
+            if not is_unwanted(name):
+                continue
+            path = os.path.join(root_, name)
+            print(('***********************' + 'removing: ' + path))
+            generate_log(
+                log_name_source,
+                'EVENT = Unwanted file removal - %s was removed' % path
+            )
+            try:
+                size = os.lstat(path).st_size
+                os.remove(path)
+                removed += 1
+                removed_bytes += size
+            except OSError:
+                print('can\'t delete as source is read-only')
+
+    with _swept_lock:
+        _swept_roots[root] = rules
+    print("Bad files removed - exiting process")
+    print(f"Unwanted files sweep of {root_dir} - {removed} files ({removed_bytes} bytes) removed in {time.time() - start:.2f} seconds")
+    generate_log(log_name_source, f"Unwanted files sweep of {root_dir} - {removed} files ({removed_bytes} bytes) removed in {time.time() - start:.2f} seconds")
+
+# Below function makes the next remove_bad_files() call for root_dir sweep it again,
+# forgetting the sweeps of root_dir, of the folders inside it and of those holding it.
+def forget_swept(root_dir):
+    root = os.path.realpath(root_dir)
+    with _swept_lock:
+        for swept in list(_swept_roots):
+            inside = swept.startswith(root.rstrip(os.sep) + os.sep)
+            holding = root.startswith(swept.rstrip(os.sep) + os.sep)
+            if swept == root or inside or holding:
+                del _swept_roots[swept]
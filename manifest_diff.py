@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+import os
+import sys
+import csv
+import time
+import bisect
+import shutil
+import argparse
+import tempfile
+from itertools import chain, groupby, islice, repeat
+from operator import itemgetter
+from logger import make_desktop_logs_dir, generate_log, add_logging_args, configure_logging
+from metrics import add_metrics_args, start_run, stage, count
+from profiling import add_profile_args, run_main
+
+# Below function parses input arguments from the command line provided by the user.
+def arg_parse():
+
+    '''
+    Enter the arguments required
+    '''
+
+    parser = argparse.ArgumentParser(
+        description="Compares two md5 manifests (copyfixity.sh/manifest_creator.sh source and destination manifests, \
+            objects_manifest.md5 ...) on their relative paths and reports the missing, extra, renamed and changed entries. \
+            The manifests are sorted on disk, so memory use does not grow with their size."
+    )
+
+    parser.add_argument('-source',
+                        required=True,
+                        type=str,
+                        help="Full path of the reference manifest")
+
+    parser.add_argument('-dest',
+                        required=True,
+                        type=str,
+                        help="Full path of the manifest to compare with it")
+
+    parser.add_argument('-strip_source',
+                        type=int,
+                        default=0,
+                        help="Number of leading folders removed from the paths of the source manifest")
+
+    parser.add_argument('-strip_dest',
+                        type=int,
+                        default=0,
+                        help="Number of leading folders removed from the paths of the destination manifest")
+
+    parser.add_argument('-o',
+                        type=str,
+                        default="",
+                        help="Full path of the csv file to write the differences to (default in the logs folder)")
+
+    parser.add_argument('-chunk',
+                        type=int,
+                        default=1000000,
+                        help="Number of manifest entries sorted in memory at a time, larger chunks are faster and use more memory")
+
+    add_logging_args(parser)
+    add_metrics_args(parser)
+    add_profile_args(parser)
+
+    parsed_args = parser.parse_args()
+    return parsed_args
+
+# Lines of a manifest are "<md5> <path>" (bash scripts, md5 -r), "<md5>  <path>" (python
+# scripts, md5sum) or "<md5> *<path>" (md5sum binary mode) : the byte following the
+# first space is dropped when it is one of these.
+SEPARATORS = (ord(" "), ord("*"))
+
+# Below function turns manifest lines into "<path>\0<md5>\n" records, which sort
+# and compare as bytes in the order of their paths (\0 sorts before any character).
+# Paths are only rewritten (leading "./" and "strip" folders removed) when needed.
+def manifest_records(lines, strip=0, rewrite=False):
+    records = [(p[1:] if p[0] in SEPARATORS else p) + b"\0" + h + b"\n"
+               for h, _, p in map(bytes.partition, lines, repeat(b" ")) if p]
+    if strip or rewrite:
+        records = [strip_record(r, strip) for r in records]
+    return records
+
+def strip_record(record, strip):
+    if record.startswith(b"./"):
+        record = record[2:]
+    if strip:
+        record = record.split(b"/", strip)[-1]
+    return record
+
+# Below function reads a manifest in blocks of about block_size bytes and yields
+# the records of each block.
+def read_manifest(manifest, strip=0, block_size=2**24):
+    with open(manifest, 'rb') as f:
+        tail = b""
+        for data in iter(lambda: f.read(block_size), b""):
+            data = tail + data
+            cut = data.rfind(b"\n") + 1
+            tail = data[cut:]
+            if cut:
+                data = data[:cut]
+                yield manifest_records(data.splitlines(), strip, b" ./" in data or b"*./" in data)
+        if tail:
+            yield manifest_records(tail.splitlines(), strip, True)
+
+# Below function returns the part of a record before its \0 separator.
+def record_key(record):
+    return record[:record.index(b"\0")]
+
+# Number of records per stream held by the block merges below.
+BLOCK = 100000
+
+# Below function reads streams of records sorted on their key in blocks of about
+# "size" records, and yields lists of blocks (one per stream) holding the same range
+# of keys. Merging and joining the streams block by block keeps the per record work
+# in C (list slices, bisect, sort, set operations) instead of a python loop.
+def aligned_blocks(streams, size=BLOCK):
+    streams = [iter(stream) for stream in streams]
+    buffers = [[] for _ in streams]
+    ended = [False] * len(streams)
+    while True:
+        for n, stream in enumerate(streams):
+            if not ended[n] and len(buffers[n]) < size:
+                more = list(islice(stream, size))
+                ended[n] = len(more) < size
+                buffers[n] += more
+        if not any(buffers):
+            return
+        # Every key up to the last one read by a stream not ended yet is buffered, the
+        # bound is just above it ("\1" follows the "\0" ending the key).
+        bounds = [record_key(buffer[-1]) + b"\1" for buffer, end in zip(buffers, ended) if not end]
+        if bounds:
+            cuts = [bisect.bisect_left(buffer, min(bounds)) for buffer in buffers]
+        else:
+            cuts = [len(buffer) for buffer in buffers]
+        yield [buffer[:cut] for buffer, cut in zip(buffers, cuts)]
+        for buffer, cut in zip(buffers, cuts):
+            del buffer[:cut]
+
+# Sorts records (bytes ending with a newline) larger than memory : records are added
+# in lists, every "chunk" of them is sorted and written to a run file, and the runs
+# are merged block by block when iterating. A single chunk never touches the disk.
+class ExternalSort():
+
+    def __init__(self, chunk, tmp_dir):
+        self.chunk = chunk
+        self.tmp_dir = tmp_dir
+        self.block = []
+        self.runs = []
+
+    def add(self, records):
+        self.block += records
+        if len(self.block) >= self.chunk:
+            self.block.sort()
+            with tempfile.NamedTemporaryFile(dir=self.tmp_dir, suffix=".run", delete=False) as f:
+                f.writelines(self.block)
+            self.runs.append(open(f.name, 'rb', buffering=2**20))
+            self.block = []
+
+    def blocks(self):
+        self.block.sort()
+        if not self.runs:
+            for start in range(0, len(self.block), BLOCK):
+                yield self.block[start:start + BLOCK]
+            return
+        for parts in aligned_blocks(self.runs + [self.block]):
+            merged = list(chain.from_iterable(parts))
+            merged.sort()
+            yield merged
+
+    def __iter__(self):
+        return chain.from_iterable(self.blocks())
+
+    def close(self):
+        for run in self.runs:
+            run.close()
+
+# Below function splits a "<key>\0<value>\n" record into its key and value.
+def split_record(record):
+    key, _, value = record[:-1].partition(b"\0")
+    return key, value
+
+# Below function merges two iterators of (key, value) pairs sorted on their key and
+# yields (key, value of a, value of b), a missing side being None.
+def merge_join(a, b):
+    end = object()
+    a = iter(a)
+    b = iter(b)
+    entry_a = next(a, end)
+    entry_b = next(b, end)
+    while entry_a is not end and entry_b is not end:
+        if entry_a[0] == entry_b[0]:
+            yield entry_a[0], entry_a[1], entry_b[1]
+            entry_a = next(a, end)
+            entry_b = next(b, end)
+        elif entry_a[0] < entry_b[0]:
+            yield entry_a[0], entry_a[1], None
+            entry_a = next(a, end)
+        else:
+            yield entry_b[0], None, entry_b[1]
+            entry_b = next(b, end)
+    while entry_a is not end:
+        yield entry_a[0], entry_a[1], None
+        entry_a = next(a, end)
+    while entry_b is not end:
+        yield entry_b[0], None, entry_b[1]
+        entry_b = next(b, end)
+
+# Below function groups "<checksum>\0<path>\n" records sorted on checksum into
+# (checksum, [paths]) pairs.
+def group_by_checksum(records):
+    for checksum, group in groupby(map(split_record, records), key=itemgetter(0)):
+        yield checksum, [path for _, path in group]
+
+# Below function compares the two manifests and calls report(status, path, new_path,
+# source_md5, dest_md5) for every difference, status being "changed", "renamed",
+# "missing" (in the source only) or "extra" (in the destination only).
+# Returns the number of entries of each status, "unchanged" included.
+def diff_manifests(source, dest, report, strip_source=0, strip_dest=0, chunk=1000000):
+    counts = dict.fromkeys(["unchanged", "changed", "renamed", "missing", "extra"], 0)
+    tmp_dir = tempfile.mkdtemp(prefix="manifest_diff_")
+    sorts = []
+    try:
+        # First pass : join on the relative paths. Blocks of identical records are only
+        # compared as a whole, the entries of the other blocks found on one side only
+        # are sorted again on their checksum for the second pass.
+        with stage("sort"):
+            source_records = ExternalSort(chunk, tmp_dir)
+            dest_records = ExternalSort(chunk, tmp_dir)
+            sorts += [source_records, dest_records]
+            for records in read_manifest(source, strip_source):
+                source_records.add(records)
+            for records in read_manifest(dest, strip_dest):
+                dest_records.add(records)
+        missing = ExternalSort(chunk, tmp_dir)
+        extra = ExternalSort(chunk, tmp_dir)
+        sorts += [missing, extra]
+        with stage("join"):
+            for block_source, block_dest in aligned_blocks([source_records, dest_records]):
+                if block_source == block_dest:
+                    counts["unchanged"] += len(block_source)
+                    continue
+                only_dest = set(block_dest)
+                only_source = set(block_source)
+                only_source.difference_update(block_dest)
+                only_dest.difference_update(block_source)
+                counts["unchanged"] += len(block_source) - len(only_source)
+                paths_source = dict(map(split_record, only_source))
+                paths_dest = dict(map(split_record, only_dest))
+                for path in sorted(paths_source.keys() | paths_dest.keys()):
+                    md5_source = paths_source.get(path)
+                    md5_dest = paths_dest.get(path)
+                    if md5_source and md5_dest and md5_source.lower() == md5_dest.lower():
+                        counts["unchanged"] += 1
+                    elif md5_dest is None:
+                        missing.add([md5_source.lower() + b"\0" + path + b"\n"])
+                    elif md5_source is None:
+                        extra.add([md5_dest.lower() + b"\0" + path + b"\n"])
+                    else:
+                        counts["changed"] += 1
+                        report("changed", path, None, md5_source, md5_dest)
+
+        # Second pass : join the paths missing and extra on their checksum, a missing
+        # path and an extra path holding the same content are a renamed entry.
+        with stage("renames"):
+            groups = merge_join(group_by_checksum(missing), group_by_checksum(extra))
+            for checksum, missing_paths, extra_paths in groups:
+                missing_paths = missing_paths or []
+                extra_paths = extra_paths or []
+                for path, new_path in zip(missing_paths, extra_paths):
+                    counts["renamed"] += 1
+                    report("renamed", path, new_path, checksum, checksum)
+                for path in missing_paths[len(extra_paths):]:
+                    counts["missing"] += 1
+                    report("missing", path, None, checksum, None)
+                for path in extra_paths[len(missing_paths):]:
+                    counts["extra"] += 1
+                    report("extra", path, None, None, checksum)
+    finally:
+        for records in sorts:
+            records.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    count("entries", files=sum(counts.values()))
+    return counts
+
+# Below function compares the manifests and writes the differences to a csv file.
+def main():
+    args = arg_parse()
+    configure_logging(args)
+    log_name_source_ = "manifest_diff_" + str(os.path.basename(args.dest)) + time.strftime("_%Y_%m_%dT%H_%M_%S") + ".log"
+    desktop_logs_dir = make_desktop_logs_dir()
+    log_name_source = os.path.join(desktop_logs_dir, log_name_source_)
+    start_run("manifest_diff", log_name_source, args)
+
+    for manifest in (args.source, args.dest):
+        if not os.path.isfile(manifest):
+            print(f' - {manifest} is not a file - exiting!')
+            generate_log(log_name_source, f' - {manifest} is not a file - exiting!')
+            sys.exit()
+
+    output_csv = args.o or os.path.join(desktop_logs_dir, log_name_source_[:-len(".log")] + ".csv")
+    print(f"Comparing {args.dest} with {args.source}")
+    generate_log(log_name_source, f"Comparing {args.dest} with {args.source}")
+
+    with open(output_csv, 'w', newline='', encoding='utf-8', errors='surrogateescape') as f:
+        writer = csv.writer(f)
+        writer.writerow(["status", "path", "new_path", "source_md5", "dest_md5"])
+
+        def report(status, path, new_path, md5_source, md5_dest):
+            writer.writerow([status, os.fsdecode(path), os.fsdecode(new_path) if new_path else "",
+                             (md5_source or b"").decode(), (md5_dest or b"").decode()])
+
+        counts = diff_manifests(args.source, args.dest, report, args.strip_source, args.strip_dest, args.chunk)
+
+    summary = ", ".join(f"{n} {status}" for status, n in counts.items())
+    print(f"{summary} - differences written to {output_csv}")
+    generate_log(log_name_source, f"{summary} - differences written to {output_csv}")
+
+    if sum(counts.values()) != counts["unchanged"]:
+        sys.exit(1)
+
+# Below code marks the start of execution of the program.
+if __name__ == "__main__":
+    run_main(main)
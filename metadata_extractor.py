@@ -4,15 +4,24 @@ import argparse
 import subprocess
 import sys
 import time
+import functools
 import pandas as pd
-from logger import make_desktop_logs_dir, generate_log, remove_bad_files
+from logger import make_desktop_logs_dir, generate_log, remove_bad_files, add_logging_args, configure_logging
+from metrics import add_metrics_args, start_run, stage, tool, count
+from profiling import add_profile_args, run_main
 import csv
 from pymediainfo import MediaInfo
 
+# Below function reads a format mapper csv once per modification of the file, as
+# long running callers (ingest_daemon.py) look formats up for every deposit.
+@functools.lru_cache(maxsize=16)
+def format_mapper(file, mtime):
+    return pd.read_csv(file, header=0, index_col="format")
+
 # Below function provides the list of file formats
 # mapped to the file of interest
 def format_details(format, file):
-    df = pd.read_csv(file, header=0, index_col="format")
+    df = format_mapper(os.path.abspath(file), os.path.getmtime(file))
     try:
         mapped_formats = list(map(str.strip, df.loc[format, "map_list"].split(",")))
     except: 
@@ -76,13 +85,58 @@ def arg_parse():
                         default='', 
                         help="Enter your choice on using 'brunnhilde-ClamAV' utility IF available")
 
+    parser.add_argument('-fast',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="Read only the headers of the files (exiftool -fast2, mediainfo ParseSpeed 0) for large RAW and AV files \
+                            on network storage. The tier used is recorded in the extraction_tier column of the csv files. Enter y/n")
+
+    parser.add_argument('-upgrade',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="Only extract the full metadata of the files extracted with -fast y (or not extracted yet) \
+                            and merge the master csv again. Enter y/n")
+
+    add_logging_args(parser)
+    add_metrics_args(parser)
+    add_profile_args(parser)
+
     parsed_args = parser.parse_args()
 
     return parsed_args
 
+# Below function returns the extraction tier of a run : "fast" only reads the headers
+# of the files, "full" lets exiftool/mediainfo read as much of them as they need.
+def extraction_tier(args):
+    return "fast" if getattr(args, 'fast', 'n') == 'y' else "full"
+
+# Below function returns the extraction tier recorded in the csv metadata of a file,
+# or None if it has not been extracted yet (or before tiers were recorded).
+def recorded_tier(csv_file):
+    try:
+        with open(csv_file, newline='', encoding='utf-8') as f:
+            row = next(csv.DictReader(f), None)
+    except (OSError, UnicodeDecodeError):
+        return None
+    return row.get("extraction_tier") if row else None
+
+# Below function adds the extraction_tier column to every row of a csv file.
+def add_tier_column(csv_file, tier):
+    with open(csv_file, newline='', encoding='utf-8') as f:
+        rows = list(csv.reader(f))
+    if not rows:
+        return
+    rows[0].append("extraction_tier")
+    for row in rows[1:]:
+        row.append(tier)
+    with open(csv_file, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows(rows)
+
 # Below function converts media information of a file to CSV format.
-def mediainfo_to_csv(file_path, csv_path):
-    media_info = MediaInfo.parse(file_path)
+def mediainfo_to_csv(file_path, csv_path, tier="full"):
+    media_info = MediaInfo.parse(file_path, parse_speed=0 if tier == "fast" else 0.5)
     data = []
 
     # Collecting the headers
@@ -94,12 +148,13 @@ def mediainfo_to_csv(file_path, csv_path):
     headers = sorted(headers)
     
     # Add 'file_path' as the first header
-    headers = ['file_path'] + headers
+    headers = ['file_path'] + headers + ['extraction_tier']
 
     # Collecting the data
     for track in media_info.tracks:
-        row = {header: track.to_data().get(header, '') for header in headers[1:]}  # Skip 'file_path' for now
+        row = {header: track.to_data().get(header, '') for header in headers[1:-1]}  # Skip 'file_path' for now
         row['file_path'] = file_path
+        row['extraction_tier'] = tier
         data.append(row)
 
     # Writing to CSV
@@ -108,11 +163,74 @@ def mediainfo_to_csv(file_path, csv_path):
         writer.writeheader()
         writer.writerows(data)
 
+# Below function merges the csv files of a folder, one per object, into a master csv.
+# The error raised for a csv that cannot be read names the file causing it.
+def merge_csv_files(csv_path, master_csv):
+    merged_csv = pd.DataFrame()
+
+    with stage("merge"):
+        for file in os.listdir(csv_path):
+            try:
+                df = pd.read_csv(os.path.join(csv_path, file), header=0)
+            except Exception as e:
+                raise ValueError(f'File causing an error in creating master csv - {file} ({e})') from e
+            merged_csv = pd.concat([merged_csv, df], ignore_index=True)
+
+    merged_csv.to_csv(master_csv, index=False, encoding='utf-8')
+
+# Below function runs exiftool on a single file, writing its csv and txt metadata
+# files into the "exif_csv" and "exif_txt" folders of the destination directory.
+# The "fast" tier stops reading the file after its header (-fast2). With upgrade,
+# files whose metadata were already extracted at the full tier are skipped.
+def exiftool_file(source_file, destination_directory, tier="full", upgrade=False):
+    dest_file = os.path.basename(os.path.dirname(source_file)) + "_" + os.path.basename(source_file)
+    exif_csv = os.path.join(destination_directory, "exif_csv", dest_file)
+    if upgrade and recorded_tier(exif_csv + ".csv") == "full":
+        return
+    options = "-fast2 " if tier == "fast" else ""
+    command = f"""\
+    exiftool {options}-csv "{source_file}" > "{exif_csv}.csv"
+    """      
+    with tool("exiftool", file=source_file, tier=tier):
+        subprocess.run(command, shell=True, text=True)
+    add_tier_column(exif_csv + ".csv", tier)
+
+    exif_txt = os.path.join(destination_directory, "exif_txt", dest_file)
+    command = f"""\
+    exiftool {options}"{source_file}" > "{exif_txt}.txt"
+    """
+    with tool("exiftool", file=source_file, tier=tier):
+        subprocess.run(command, shell=True, text=True) 
+    count("exiftool", bytes=os.path.getsize(source_file), files=1)
+
+# Below function runs mediainfo on a single file, writing its csv and PBCore xml
+# metadata files into the "mediainfo_csv" and "mediainfo_pbcore" folders of the
+# destination directory. The "fast" tier parses as little of the file as possible
+# (ParseSpeed 0). With upgrade, files whose metadata were already extracted at the
+# full tier are skipped.
+def mediainfo_file(source_file, destination_directory, tier="full", upgrade=False):
+    dest_file = os.path.basename(os.path.dirname(source_file)) + "_" + os.path.basename(source_file)
+    exif_csv = os.path.join(destination_directory, "mediainfo_csv", dest_file) + "_mediainfo.csv"
+    if upgrade and recorded_tier(exif_csv) == "full":
+        return
+    with tool("mediainfo", file=source_file, tier=tier):
+        mediainfo_to_csv(source_file, exif_csv, tier)
+
+    exif_txt = os.path.join(destination_directory, "mediainfo_pbcore", dest_file)
+    options = "--ParseSpeed=0 " if tier == "fast" else ""
+    command = f"""\
+    mediainfo -f {options}"{source_file}" --Output=PBCore2 > "{exif_txt}_mediainfo.xml"
+    """
+    with tool("mediainfo", file=source_file, tier=tier):
+        subprocess.run(command, shell=True, text=True) 
+    count("mediainfo", bytes=os.path.getsize(source_file), files=1)
+
 # Below function processes image files using exiftool and generates technical metadata files.
 def image_exiftool(args, log_name_source):
 
     input_path = args.i
     img_formats_list = list(args.img.split(" "))
+    upgrade = getattr(args, 'upgrade', 'n') == 'y'
 
     print(f"Beginning exiftool processing of target {img_formats_list} image formats")
     generate_log(log_name_source, f" Beginning exiftool processing of target {img_formats_list} image formats")
@@ -149,37 +267,18 @@ def image_exiftool(args, log_name_source):
             
             for file in files:
                 if str(os.path.splitext(file)[1]).lower() in format_detailed_list:
-                    
-                    source_file = os.path.join(root, file)
-                    dest_file = os.path.basename(root) + "_" + file 
-                    exif_csv = os.path.join(csv_path, dest_file)
-                    command = f"""\
-                    exiftool -csv "{source_file}" > "{exif_csv}.csv"
-                    """      
-                    subprocess.run(command, shell=True, text=True)
-
-                    exif_txt = os.path.join(txt_path, dest_file)
-                    command = f"""\
-                    exiftool "{source_file}" > "{exif_txt}.txt"
-                    """
-                    subprocess.run(command, shell=True, text=True) 
+                    exiftool_file(os.path.join(root, file), destination_directory, extraction_tier(args), upgrade)
         
         print(f'- csv and txt folders are created successfully for {format} format')
         generate_log(log_name_source, f'- csv and txt folders are created successfully for {format} format')
 
         try:
-            merged_csv = pd.DataFrame()
-
-            for file in os.listdir(csv_path):
-                df = pd.read_csv(os.path.join(csv_path, file), header=0)
-                merged_csv = pd.concat([merged_csv, df], ignore_index=True)
-            
             if hasattr(args, 'dest'):
                 csv_file_name = os.path.basename(args.dest) + "_merged.csv"
             else:
                 csv_file_name = os.path.basename(input_path) + "_exif_master.csv"
 
-            merged_csv.to_csv(os.path.join(destination_directory, csv_file_name), index=False, encoding='utf-8')
+            merge_csv_files(csv_path, os.path.join(destination_directory, csv_file_name))
             print(f'Merged csv files into master_csv for {format}')
             generate_log(log_name_source, f' Merged csv files into master_csv for {format}')
 
@@ -187,8 +286,6 @@ def image_exiftool(args, log_name_source):
             
             print(f'Could not perform the csv files merge operation - \n {e}')
             generate_log(log_name_source, f' Could not perform the csv files merge operation - \n {e}')
-            print(f'File causing an error in creating master csv - {file}')
-            generate_log(log_name_source, f' File causing an error in creating master csv - {file}')
         
         print(f'Exiting Processing for {format} format')
         generate_log(log_name_source,f' Exiting Processing for {format} format')
@@ -202,6 +299,7 @@ def av_mediainfo(args, log_name_source):
 
     input_path = args.i
     av_formats_list = list(args.av.split(" "))
+    upgrade = getattr(args, 'upgrade', 'n') == 'y'
 
     print(f"Beginning mediainfo processing of target {av_formats_list} av formats")
     generate_log(log_name_source, f" Beginning mediainfo processing of target {av_formats_list} av formats")
@@ -236,38 +334,18 @@ def av_mediainfo(args, log_name_source):
 
             for file in files:
                 if str(os.path.splitext(file)[1]).lower() in format_detailed_list:
-                    
-                    source_file = os.path.join(root, file)
-                    dest_file = os.path.basename(root) + "_" + file 
-                    exif_csv = os.path.join(csv_path, dest_file) + "_mediainfo.csv"
-                    mediainfo_to_csv(source_file, exif_csv)
-                    # command = f"""\
-                    # mediainfo -f "{source_file}" > "{exif_csv}_mediainfo.csv"
-                    # """      
-                    # subprocess.run(command, shell=True, text=True)
-
-                    exif_txt = os.path.join(xml_path, dest_file)
-                    command = f"""\
-                    mediainfo -f "{source_file}" --Output=PBCore2 > "{exif_txt}_mediainfo.xml"
-                    """
-                    subprocess.run(command, shell=True, text=True) 
+                    mediainfo_file(os.path.join(root, file), destination_directory, extraction_tier(args), upgrade)
         
         print(f'- csv and xml folders are created successfully for {format} format')
         generate_log(log_name_source, f'- csv and xml folders are created successfully for {format} format')
 
         try:
-            merged_csv = pd.DataFrame()
-
-            for file in os.listdir(csv_path):
-                df = pd.read_csv(os.path.join(csv_path, file), header=0)
-                merged_csv = pd.concat([merged_csv, df], ignore_index=True)
-            
             if hasattr(args, 'dest'):
                 csv_file_name = os.path.basename(args.dest) + "_merged.csv"
             else:
                 csv_file_name = os.path.basename(input_path) + "_mediainfo_master.csv"
             
-            merged_csv.to_csv(os.path.join(destination_directory, csv_file_name), index=False, encoding='utf-8')
+            merge_csv_files(csv_path, os.path.join(destination_directory, csv_file_name))
             print(f'Merged csv files into master_csv for {format} format')
             generate_log(log_name_source, f' Merged csv files into master_csv for {format} format')
 
@@ -275,8 +353,6 @@ def av_mediainfo(args, log_name_source):
             
             print(f'Could not perform the csv files merge operation - \n {e}')
             generate_log(log_name_source, f' Could not perform the csv files merge operation - \n {e}')
-            print(f'File causing an error in creating master csv - {file}')
-            generate_log(log_name_source, f' File causing an error in creating master csv - {file}')
     
         print(f'Exiting Processing for {format} format')
         generate_log(log_name_source,f' Exiting Processing for {format} format')
@@ -289,6 +365,7 @@ def others_exiftool(args, log_name_source):
 
     input_path = args.i
     txt_formats_list = list(args.text.split(" "))
+    upgrade = getattr(args, 'upgrade', 'n') == 'y'
 
     print(f"Beginning exiftool processing of target {txt_formats_list} text formats")
     generate_log(log_name_source, f" Beginning exiftool processing of target {txt_formats_list} text formats")
@@ -325,37 +402,18 @@ def others_exiftool(args, log_name_source):
             
             for file in files:
                 if str(os.path.splitext(file)[1]).lower() in format_detailed_list:
-                    
-                    source_file = os.path.join(root, file)
-                    dest_file = os.path.basename(root) + "_" + file 
-                    exif_csv = os.path.join(csv_path, dest_file)
-                    command = f"""\
-                    exiftool -csv "{source_file}" > "{exif_csv}.csv"
-                    """      
-                    subprocess.run(command, shell=True, text=True)
-
-                    exif_txt = os.path.join(txt_path, dest_file)
-                    command = f"""\
-                    exiftool "{source_file}" > "{exif_txt}.txt"
-                    """
-                    subprocess.run(command, shell=True, text=True) 
+                    exiftool_file(os.path.join(root, file), destination_directory, extraction_tier(args), upgrade)
         
         print(f'- csv and txt folders are created successfully for {format} format')
         generate_log(log_name_source, f'- csv and txt folders are created successfully for {format} format')
 
         try:
-            merged_csv = pd.DataFrame()
-
-            for file in os.listdir(csv_path):
-                df = pd.read_csv(os.path.join(csv_path, file), header=0)
-                merged_csv = pd.concat([merged_csv, df], ignore_index=True)
-            
             if hasattr(args, 'dest'):
                 csv_file_name = os.path.basename(args.dest) + "_merged.csv"
             else:
                 csv_file_name = os.path.basename(input_path) + "_exif_master.csv"
 
-            merged_csv.to_csv(os.path.join(destination_directory, csv_file_name), index=False, encoding='utf-8')
+            merge_csv_files(csv_path, os.path.join(destination_directory, csv_file_name))
             print(f'Merged csv files into master_csv for {format}')
             generate_log(log_name_source, f' Merged csv files into master_csv for {format}')
 
@@ -363,8 +421,6 @@ def others_exiftool(args, log_name_source):
             
             print(f'Could not perform the csv files merge operation - \n {e}')
             generate_log(log_name_source, f' Could not perform the csv files merge operation - \n {e}')
-            print(f'File causing an error in creating master csv - {file}')
-            generate_log(log_name_source, f' File causing an error in creating master csv - {file}')
         
         print(f'Exiting Processing for {format} format')
         generate_log(log_name_source,f' Exiting Processing for {format} format')
@@ -391,7 +447,8 @@ def jhove_audit(args, log_name_source):
     command = f"""\
     {os.path.expanduser("~/")}jhove/jhove -h Audit -o "{jhove_xml_file}" "{input_path}"
     """
-    subprocess.run(command, shell=True, text=True)
+    with stage("jhove"), tool("jhove"):
+        subprocess.run(command, shell=True, text=True)
 
     print(' - JHOVE available/enabled - auditing process completed')
     generate_log(log_name_source, ' - JHOVE available/enabled - auditing process completed')
@@ -417,7 +474,8 @@ def brunnhilde_scan(args, log_name_source):
     brunnhilde.py "{input_path}" "{brunnhilde_output_folder}"
     """
     print(command)
-    subprocess.run(command, shell=True, text=True)
+    with stage("brunnhilde"), tool("brunnhilde"):
+        subprocess.run(command, shell=True, text=True)
 
 
     os.rename(os.path.join(brunnhilde_output_folder, "report.html"), \
@@ -432,13 +490,30 @@ def brunnhilde_scan(args, log_name_source):
     print(' - brunnhilde-ClamAV available/enabled - scanning process completed')
     generate_log(log_name_source, ' - brunnhilde-ClamAV available/enabled - scanning process completed')
 
+# Below function runs the extractors of the formats requested in args.img, args.av
+# and args.text without asking anything, so it can be called from other scripts.
+def extract_metadata(args, log_name_source):
+    if args.img:
+        with stage("exiftool"):
+            image_exiftool(args, log_name_source)
+    
+    if args.av:
+        with stage("mediainfo"):
+            av_mediainfo(args, log_name_source)
+    
+    if args.text:
+        with stage("exiftool"):
+            others_exiftool(args, log_name_source)
+
 # Main function that controls the flow of the script.
 def main():
     args = arg_parse()
+    configure_logging(args)
     input_path = args.i
     log_name_source_ = "metadata_extractor_"  + str(os.path.basename(input_path)) + time.strftime("_%Y_%m_%dT%H_%M_%S") + ".log"
     desktop_logs_dir = make_desktop_logs_dir()
     log_name_source = os.path.join(desktop_logs_dir, log_name_source_)
+    start_run("metadata_extractor", log_name_source, args)
     
 
     if not os.path.isdir(input_path):
@@ -451,6 +526,11 @@ def main():
             generate_log(log_name_source, ' - At least once format must be provided as input')
             sys.exit()    
     
+    if args.fast == 'y' and args.upgrade == 'y':
+            print(' - -fast and -upgrade cannot be used together, -upgrade extracts the full metadata - exiting!')
+            generate_log(log_name_source, ' - -fast and -upgrade cannot be used together - exiting!')
+            sys.exit()
+
     if args.jhove == "":
         q = input("Would you like to generate a jhove audit report? (Ensure jhove installed in this system. \
                   Provide y/n as your input)")
@@ -472,14 +552,7 @@ def main():
             args.brunnhilde = 'n'
             generate_log(log_name_source, "Ignoring jhove auditing")
     
-    if args.img:
-        image_exiftool(args, log_name_source)
-    
-    if args.av:
-        av_mediainfo(args, log_name_source)
-    
-    if args.text:
-        others_exiftool(args, log_name_source)
+    extract_metadata(args, log_name_source)
 
     if args.o:
         output_path = args.o
@@ -520,4 +593,4 @@ def main():
     
 # Below code marks the start of execution of the program.
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_main(main)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+import os
+import time
+import json
+import atexit
+import threading
+from contextlib import contextmanager
+from logger import generate_log, flush_logs
+from profiling import span
+
+# Below function adds the run report options shared by all scripts to their argument parser.
+def add_metrics_args(parser):
+    parser.add_argument('-prom_textfile',
+                        type=str,
+                        default="",
+                        help="Directory of the node exporter textfile collector, a <script>.prom file with the stage metrics of this run is written there")
+
+# Below function returns the CPU seconds used so far by this process and by the
+# external tools (exiftool, mediainfo, jhove ...) it has waited for.
+def cpu_times():
+    t = os.times()
+    return t.user + t.system, t.children_user + t.children_system
+
+# Below function returns the q-th percentile (0-100) of a list of samples.
+def percentile(samples, q):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * q / 100
+    low = int(k)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+# Totals of one stage of a run. Wall time is summed over every time the stage is
+# entered; CPU time is process wide, so stages running in parallel threads share it.
+# Times are exclusive: the time of a stage entered within another one by the same
+# thread (hashing during the copy) only counts for the inner stage. The inclusive
+# wall time is kept as total_wall_seconds.
+class StageMetrics():
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.total_wall = 0.0
+        self.cpu = 0.0
+        self.tools_cpu = 0.0
+        self.bytes = 0
+        self.files = 0
+
+    def to_dict(self):
+        return {"calls": self.calls,
+                "wall_seconds": round(self.wall, 6),
+                "total_wall_seconds": round(self.total_wall, 6),
+                "cpu_seconds": round(self.cpu, 6),
+                "external_tools_cpu_seconds": round(self.tools_cpu, 6),
+                "bytes": self.bytes,
+                "files": self.files,
+                "bytes_per_second": round(self.bytes / self.wall, 2) if self.wall else 0.0}
+
+# Collector for the metrics of a script run: per-stage wall/CPU time, bytes and
+# files processed, and latency samples of every external tool call.
+class RunMetrics():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.tools = {}
+        self.script = ""
+        self.log_name_source = ""
+        self.textfile_dir = ""
+        self.started = time.time()
+        self.nesting = threading.local()
+
+    def _stage(self, name):
+        with self.lock:
+            if name not in self.stages:
+                self.stages[name] = StageMetrics()
+            return self.stages[name]
+
+    @contextmanager
+    def stage(self, name, **args):
+        '''
+        Times the enclosed block as (one more call of) stage "name".
+        Keyword arguments (file=...) are attached to its trace span.
+        '''
+        # Wall, CPU and tools CPU time of the stages entered within this one
+        frames = self.nesting.__dict__.setdefault("frames", [])
+        nested = [0.0, 0.0, 0.0]
+        frames.append(nested)
+        wall_start = time.perf_counter()
+        cpu_start, tools_start = cpu_times()
+        try:
+            with span(name, "stage", **args):
+                yield self._stage(name)
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu_end, tools_end = cpu_times()
+            cpu = cpu_end - cpu_start
+            tools_cpu = tools_end - tools_start
+            frames.pop()
+            if frames:
+                frames[-1][0] += wall
+                frames[-1][1] += cpu
+                frames[-1][2] += tools_cpu
+            metrics = self._stage(name)
+            with self.lock:
+                metrics.calls += 1
+                metrics.wall += wall - nested[0]
+                metrics.total_wall += wall
+                metrics.cpu += cpu - nested[1]
+                metrics.tools_cpu += tools_cpu - nested[2]
+
+    def count(self, name, bytes=0, files=0):
+        metrics = self._stage(name)
+        with self.lock:
+            metrics.bytes += bytes
+            metrics.files += files
+
+    @contextmanager
+    def tool(self, name, **args):
+        '''
+        Times one call of the external tool "name" (exiftool, mediainfo, jhove ...).
+        Keyword arguments (file=..., shard=...) are attached to its trace span.
+        '''
+        start = time.perf_counter()
+        try:
+            with span(name, "tool", **args):
+                yield
+        finally:
+            latency = time.perf_counter() - start
+            with self.lock:
+                self.tools.setdefault(name, []).append(latency)
+
+    def report(self):
+        with self.lock:
+            stages = {name: m.to_dict() for name, m in self.stages.items()}
+            tools = {name: {"calls": len(samples),
+                            "total_seconds": round(sum(samples), 6),
+                            "p50_seconds": round(percentile(samples, 50), 6),
+                            "p90_seconds": round(percentile(samples, 90), 6),
+                            "p99_seconds": round(percentile(samples, 99), 6),
+                            "max_seconds": round(max(samples), 6)}
+                     for name, samples in self.tools.items()}
+        cpu, tools_cpu = cpu_times()
+        return {"script": self.script,
+                "log": self.log_name_source,
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "wall_seconds": round(time.time() - self.started, 6),
+                "cpu_seconds": round(cpu, 6),
+                "external_tools_cpu_seconds": round(tools_cpu, 6),
+                "stages": stages,
+                "tools": tools}
+
+    def prometheus(self, report):
+        labels = f'script="{self.script}"'
+        lines = ["# HELP ucclib_run_wall_seconds Wall time of the last run.",
+                 "# TYPE ucclib_run_wall_seconds gauge",
+                 f"ucclib_run_wall_seconds{{{labels}}} {report['wall_seconds']}",
+                 "# HELP ucclib_run_timestamp_seconds Start time of the last run.",
+                 "# TYPE ucclib_run_timestamp_seconds gauge",
+                 f"ucclib_run_timestamp_seconds{{{labels}}} {self.started}"]
+        for metric, key, text in (("stage_wall_seconds", "wall_seconds", "Wall time spent in each stage"),
+                                  ("stage_cpu_seconds", "cpu_seconds", "CPU time of this process during each stage"),
+                                  ("stage_bytes", "bytes", "Bytes processed by each stage"),
+                                  ("stage_files", "files", "Files processed by each stage"),
+                                  ("stage_bytes_per_second", "bytes_per_second", "Throughput of each stage")):
+            lines.append(f"# HELP ucclib_{metric} {text} during the last run.")
+            lines.append(f"# TYPE ucclib_{metric} gauge")
+            for name, values in report["stages"].items():
+                lines.append(f'ucclib_{metric}{{{labels},stage="{name}"}} {values[key]}')
+        lines.append("# HELP ucclib_tool_latency_seconds Latency of external tool calls during the last run.")
+        lines.append("# TYPE ucclib_tool_latency_seconds gauge")
+        for name, values in report["tools"].items():
+            for quantile in ("50", "90", "99"):
+                lines.append(f'ucclib_tool_latency_seconds{{{labels},tool="{name}",quantile="0.{quantile}"}} {values["p" + quantile + "_seconds"]}')
+        return "\n".join(lines) + "\n"
+
+    def write_report(self):
+        '''
+        Writes the JSON run report next to the log and, if requested, the Prometheus textfile.
+        '''
+        report = self.report()
+        report_file = os.path.splitext(self.log_name_source)[0] + "_report.json"
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Run report written to {report_file}")
+        generate_log(self.log_name_source, f"Run report written to {report_file}")
+
+        if self.textfile_dir:
+            os.makedirs(self.textfile_dir, exist_ok=True)
+            prom_file = os.path.join(self.textfile_dir, f"ucclib_{self.script}.prom")
+            # Write then rename, the collector must never read a partial file.
+            with open(prom_file + ".tmp", 'w', encoding='utf-8') as f:
+                f.write(self.prometheus(report))
+            os.replace(prom_file + ".tmp", prom_file)
+            generate_log(self.log_name_source, f"Prometheus metrics written to {prom_file}")
+        flush_logs()
+
+run_metrics = RunMetrics()
+stage = run_metrics.stage
+tool = run_metrics.tool
+count = run_metrics.count
+
+# Below function starts collecting metrics for a script run. The report is written
+# when the script exits, including early exits through sys.exit().
+def start_run(script, log_name_source, args=None):
+    run_metrics.script = script
+    run_metrics.log_name_source = log_name_source
+    run_metrics.textfile_dir = getattr(args, 'prom_textfile', "") or ""
+    run_metrics.started = time.time()
+    atexit.register(run_metrics.write_report)
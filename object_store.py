@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+from logger import make_desktop_logs_dir, generate_log, add_logging_args, configure_logging
+from metrics import add_metrics_args, start_run, stage, count
+from profiling import add_profile_args, run_main, span
+from hash_reader import file_digest
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LINK_CHOICES = ['hardlink', 'reflink', 'copy']
+
+# ioctl cloning a whole file on Linux filesystems supporting reflinks (btrfs, xfs).
+FICLONE = 0x40049409
+
+# Copies into the store not finished (or stored objects not indexed) for this many
+# seconds are left over from an interrupted or failed run, gc() only deletes those,
+# never the files of a run in progress.
+PARTIAL_AGE = 24 * 3600
+
+# Below function makes dst a copy on write clone of src (APFS clonefile on MacOS,
+# FICLONE on Linux). Raises OSError where the filesystem cannot clone.
+def reflink(src, dst):
+    if sys.platform == 'darwin':
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), dst)
+        return
+    if fcntl is None:
+        raise OSError(f"reflinks are not supported on {sys.platform}")
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+# Content addressed store of package objects. Every distinct object is kept once,
+# as <store>/objects/<md5[:2]>/<md5>, and package "objects" trees are built from
+# hardlinks (or reflinks) to it. An sqlite index records the objects held, the
+# package files referencing each of them (reference counts) and the checksum of
+# every source file already stored, so unchanged masters packaged again are
+# neither hashed nor copied.
+class ObjectStore():
+
+    def __init__(self, root, link='hardlink'):
+        self.root = os.path.abspath(root)
+        self.link = link
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(self.root, "store.db"))
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS objects (md5 TEXT PRIMARY KEY, size INTEGER)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS refs (package TEXT, path TEXT, md5 TEXT, PRIMARY KEY (package, path))")
+            self.db.execute("CREATE INDEX IF NOT EXISTS refs_md5 ON refs (md5)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, md5 TEXT)")
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def path(self, md5):
+        return os.path.join(self.root, "objects", md5[:2], md5)
+
+    def refcount(self, md5):
+        return self.db.execute("SELECT COUNT(*) FROM refs WHERE md5 = ?", (md5,)).fetchone()[0]
+
+    def source_digest(self, file_src, st):
+        '''
+        Returns the checksum of a source file already stored, if it has not changed since.
+        '''
+        row = self.db.execute("SELECT md5 FROM sources WHERE path = ? AND size = ? AND mtime_ns = ?",
+                              (os.path.abspath(file_src), st.st_size, st.st_mtime_ns)).fetchone()
+        if row and self.db.execute("SELECT 1 FROM objects WHERE md5 = ?", (row[0],)).fetchone():
+            return row[0]
+        return None
+
+    def _place(self, store_path, file_dest):
+        '''
+        Links file_dest to the stored object, or copies it where the link is not possible.
+        Returns the checksum of the copy, None for a link.
+        '''
+        if os.path.lexists(file_dest):
+            os.remove(file_dest)
+        try:
+            if self.link == 'hardlink':
+                os.link(store_path, file_dest)
+                return None
+            if self.link == 'reflink':
+                reflink(store_path, file_dest)
+                return None
+        except OSError:
+            # Store and package on different filesystems, or no reflink support
+            count("link_fallback", files=1)
+        with span("copy", "copy", file=store_path):
+            shutil.copy2(store_path, file_dest)
+        md5_copy, read_size = file_digest(file_dest)
+        count("hash", bytes=read_size, files=1)
+        return md5_copy
+
+    def put(self, file_src, file_dest, package):
+        '''
+        Places file_src at file_dest inside "package" from the store, storing it first
+        if no object with its checksum is held yet. Returns the checksums of the source
+        and of the package object (the stored object it links to, or the copy made of
+        it), which only differ if a copy failed.
+        '''
+        st = os.stat(file_src)
+        md5_source = self.source_digest(file_src, st)
+        if md5_source is None:
+            md5_source, read_size = file_digest(file_src, drop_cache=False)
+            count("hash", bytes=read_size, files=1)
+        md5_store = md5_source
+        store_path = self.path(md5_source)
+
+        if not os.path.exists(store_path):
+            os.makedirs(os.path.dirname(store_path), exist_ok=True)
+            fd, partial = tempfile.mkstemp(prefix=md5_source + ".", suffix=".partial", dir=os.path.dirname(store_path))
+            os.close(fd)
+            try:
+                with span("copy", "copy", file=file_src):
+                    shutil.copy2(file_src, partial)
+                md5_store, read_size = file_digest(partial)
+            except BaseException:
+                os.remove(partial)
+                raise
+            count("hash", bytes=read_size, files=1)
+            if md5_store != md5_source:
+                os.remove(partial)
+                return md5_source, md5_store
+            os.chmod(partial, 0o444)
+            os.replace(partial, store_path)
+            count("store", bytes=st.st_size, files=1)
+        else:
+            count("dedup", bytes=st.st_size, files=1)
+
+        md5_copy = self._place(store_path, file_dest)
+        if md5_copy is not None and md5_copy != md5_source:
+            return md5_source, md5_copy
+        package = os.path.abspath(package)
+        with self.db:
+            self.db.execute("INSERT OR IGNORE INTO objects VALUES (?, ?)", (md5_source, st.st_size))
+            self.db.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)",
+                            (os.path.abspath(file_src), st.st_size, st.st_mtime_ns, md5_source))
+            self.db.execute("INSERT OR REPLACE INTO refs VALUES (?, ?, ?)",
+                            (package, os.path.relpath(file_dest, package), md5_source))
+        return md5_source, md5_store
+
+    def _delete_unreferenced(self, digests):
+        removed = 0
+        freed = 0
+        for md5 in digests:
+            if self.refcount(md5):
+                continue
+            store_path = self.path(md5)
+            if os.path.exists(store_path):
+                freed += os.path.getsize(store_path)
+                os.remove(store_path)
+            with self.db:
+                self.db.execute("DELETE FROM objects WHERE md5 = ?", (md5,))
+                self.db.execute("DELETE FROM sources WHERE md5 = ?", (md5,))
+            removed += 1
+        return removed, freed
+
+    def release(self, package):
+        '''
+        Deletes a package and the stored objects no other package references.
+        Returns the number of objects and bytes freed from the store.
+        '''
+        package = os.path.abspath(package)
+        digests = {md5 for (md5,) in self.db.execute("SELECT md5 FROM refs WHERE package = ?", (package,))}
+        if os.path.exists(package):
+            shutil.rmtree(package)
+        with self.db:
+            self.db.execute("DELETE FROM refs WHERE package = ?", (package,))
+        return self._delete_unreferenced(digests)
+
+    def gc(self):
+        '''
+        Forgets the packages deleted without release() and deletes the stored objects
+        left unreferenced, along with copies interrupted half way and objects stored
+        but never indexed (when placing them in the package failed), older than PARTIAL_AGE.
+        Returns the number of objects and bytes freed from the store.
+        '''
+        packages = [package for (package,) in self.db.execute("SELECT DISTINCT package FROM refs")]
+        with self.db:
+            for package in packages:
+                if not os.path.isdir(package):
+                    self.db.execute("DELETE FROM refs WHERE package = ?", (package,))
+        indexed = {md5 for (md5,) in self.db.execute("SELECT md5 FROM objects")}
+        removed = 0
+        freed = 0
+        # ctime, as the copy gives the partial file the modification time of its source
+        for subroot, _, files in os.walk(os.path.join(self.root, "objects")):
+            for file in files:
+                if file in indexed:
+                    continue
+                leftover = os.path.join(subroot, file)
+                st = os.stat(leftover)
+                if time.time() - st.st_ctime > PARTIAL_AGE:
+                    os.remove(leftover)
+                    if not file.endswith(".partial"):
+                        removed += 1
+                        freed += st.st_size
+        unreferenced_removed, unreferenced_freed = self._delete_unreferenced(indexed)
+        return removed + unreferenced_removed, freed + unreferenced_freed
+
+    def stats(self):
+        objects, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects").fetchone()
+        packages, refs = self.db.execute("SELECT COUNT(DISTINCT package), COUNT(*) FROM refs").fetchone()
+        referenced = self.db.execute("SELECT COALESCE(SUM(o.size), 0) FROM refs r JOIN objects o ON r.md5 = o.md5").fetchone()[0]
+        return {"objects": objects, "bytes": size, "packages": packages, "references": refs, "referenced_bytes": referenced}
+
+# Below function parses input arguments from the command line provided by the user.
+def arg_parse():
+
+    '''
+    Enter the arguments required
+    '''
+
+    parser = argparse.ArgumentParser(
+        description="Maintains the content addressed object store used by ip_creator.py -store : releases packages \
+            (deleting the stored objects no other package uses), collects unreferenced objects and reports the space saved."
+    )
+
+    parser.add_argument('-store',
+                        required=True,
+                        type=str,
+                        help="Full path of the object store")
+
+    parser.add_argument('-release',
+                        type=str,
+                        nargs='+',
+                        default=[],
+                        help="Full paths of the packages to delete")
+
+    parser.add_argument('-gc',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="Forget packages deleted by hand and delete the objects no package uses any more. Enter y/n")
+
+    add_logging_args(parser)
+    add_metrics_args(parser)
+    add_profile_args(parser)
+
+    parsed_args = parser.parse_args()
+    return parsed_args
+
+# Below function releases packages and/or collects the store, then reports its state.
+def main():
+    args = arg_parse()
+    configure_logging(args)
+    log_name_source_ = "object_store_" + str(os.path.basename(args.store)) + time.strftime("_%Y_%m_%dT%H_%M_%S") + ".log"
+    desktop_logs_dir = make_desktop_logs_dir()
+    log_name_source = os.path.join(desktop_logs_dir, log_name_source_)
+    start_run("object_store", log_name_source, args)
+
+    if not os.path.isfile(os.path.join(args.store, "store.db")):
+        print(' - Input must be an object store created by ip_creator.py -store - exiting!')
+        generate_log(log_name_source, ' - Input must be an object store created by ip_creator.py -store - exiting!')
+        sys.exit()
+    with ObjectStore(args.store) as store:
+        for package in args.release:
+            with stage("release", package=package):
+                removed, freed = store.release(package)
+            print(f"Package {package} released - {removed} objects ({freed / 2**20:.1f} MiB) deleted from the store")
+            generate_log(log_name_source, f"Package {package} released - {removed} objects ({freed} bytes) deleted from the store")
+
+        if args.gc == 'y':
+            with stage("gc"):
+                removed, freed = store.gc()
+            print(f"Garbage collection - {removed} unreferenced objects ({freed / 2**20:.1f} MiB) deleted from the store")
+            generate_log(log_name_source, f"Garbage collection - {removed} unreferenced objects ({freed} bytes) deleted from the store")
+
+        stats = store.stats()
+        print(f"Store {args.store} - {stats['objects']} objects ({stats['bytes'] / 2**20:.1f} MiB) referenced {stats['references']} times "
+              f"by {stats['packages']} packages ({stats['referenced_bytes'] / 2**20:.1f} MiB)")
+        generate_log(log_name_source, f"Store {args.store} - {stats}")
+
+# Below code marks the start of execution of the program.
+if __name__ == "__main__":
+    run_main(main)
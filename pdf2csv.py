@@ -3,10 +3,23 @@ import os
 import time
 import sys
 import re
+import csv
+import json
+import hashlib
 import pandas as pd
-import pdfminer.high_level
+from io import StringIO
+from pdfminer.layout import LAParams
+from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+from pdfminer.converter import TextConverter
+from pdfminer.pdfpage import PDFPage
 import argparse
-from logger import make_desktop_logs_dir, generate_log
+from concurrent.futures import ProcessPoolExecutor
+from logger import make_desktop_logs_dir, generate_log, add_logging_args, configure_logging
+from metrics import add_metrics_args, start_run, stage, count
+from profiling import add_profile_args, run_main
+import hash_reader
+
+COLUMNS = ['reference column', 'level', 'date', 'title', 'extent', 'description']
 
 # Below function parses input arguments from the command line provided by the user.
 def arg_parse():
@@ -22,7 +35,7 @@ def arg_parse():
     parser.add_argument('-i', 
                         required=True,
                         type=str, 
-                        help="Full path of input directory")
+                        help="Full path of input pdf, or of a directory of pdfs to extract in one batch")
     
     parser.add_argument('-start',
                         required=True, 
@@ -40,6 +53,43 @@ def arg_parse():
                         default="", 
                         help="Full path of output directory to place the spreadsheet")
 
+    parser.add_argument('-parallel',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="Extract the page range in chunks using a pool of processes. Enter y/n")
+
+    parser.add_argument('-workers',
+                        type=int,
+                        default=os.cpu_count(),
+                        help="Number of processes extracting pages at the same time when -parallel is y")
+
+    parser.add_argument('-chunk',
+                        type=int,
+                        default=16,
+                        help="Number of pages extracted by a process at a time when -parallel is y")
+
+    parser.add_argument('-parser',
+                        choices=['lines', 'regex'],
+                        type=str,
+                        default='lines',
+                        help="lines: parse descriptions line by line while the pages are extracted. regex: match the original description pattern over the whole extracted text")
+
+    parser.add_argument('-cache',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='y',
+                        help="Keep the extracted text of every page on disk so re-runs only extract pages not seen before. Enter y/n")
+
+    parser.add_argument('-cache_dir',
+                        type=str,
+                        default=os.path.join(os.path.expanduser("~"), ".cache", "ucclib", "pdf2csv"),
+                        help="Directory of the page text cache")
+
+    add_logging_args(parser)
+    add_metrics_args(parser)
+    add_profile_args(parser)
+
     parsed_args = parser.parse_args()
 
     return parsed_args
@@ -58,9 +108,304 @@ def extract_first_sentence(paragraph):
     match = re.match(r'[^.!?]*[.!?]', paragraph)
     return match.group(0).strip() if match else ''
 
+# Below function extracts the text of pages "first" to "last" (1-based, inclusive)
+# the same way pdfminer.high_level.extract_text does, but returns it page by page
+# as {page number: text}. Pages past the end of the pdf are left out.
+def extract_pages(file_path, first, last):
+    pages = {}
+    with open(file_path, 'rb') as fp, StringIO() as output_string:
+        rsrcmgr = PDFResourceManager(caching=True)
+        device = TextConverter(rsrcmgr, output_string, codec='utf-8', laparams=LAParams())
+        interpreter = PDFPageInterpreter(rsrcmgr, device)
+        page_numbers = range(first - 1, last)
+        for page_number, page in zip(page_numbers, PDFPage.get_pages(fp, page_numbers, caching=True)):
+            position = output_string.tell()
+            interpreter.process_page(page)
+            pages[page_number + 1] = output_string.getvalue()[position:]
+    return pages
+
+# Below function groups the pages to extract into chunks of at most "size"
+# consecutive pages.
+def page_chunks(pages, size):
+    chunks = []
+    for page in pages:
+        if chunks and page == chunks[-1][1] + 1 and page - chunks[-1][0] < size:
+            chunks[-1][1] = page
+        else:
+            chunks.append([page, page])
+    return [tuple(chunk) for chunk in chunks]
+
+# Below function returns the md5 checksum of a file, keeping it cached as its
+# pages are read again when not found in the cache.
+def file_digest(file_path):
+    return hash_reader.file_digest(file_path, drop_cache=False)[0]
+
+# On-disk cache of extracted page text, one file per page under
+# <cache_dir>/<md5 of the pdf>/<LAParams key>/, so that changing the page
+# range or the description pattern does not repeat the layout analysis.
+class PageCache():
+
+    def __init__(self, cache_dir, file_path):
+        params = json.dumps(vars(LAParams()), sort_keys=True, default=str)
+        params_key = hashlib.md5(params.encode('utf-8')).hexdigest()[:12]
+        self.path = os.path.join(cache_dir, file_digest(file_path), params_key)
+        os.makedirs(self.path, exist_ok=True)
+
+    def get(self, page):
+        try:
+            with open(os.path.join(self.path, f"{page}.txt"), 'r', encoding='utf-8', newline='') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, page, text):
+        page_file = os.path.join(self.path, f"{page}.txt")
+        with open(page_file + ".tmp", 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+        os.replace(page_file + ".tmp", page_file)
+
+# Below function yields the text of every page of the range in page order. Pages
+# found in the cache are read back from it, the others are extracted in chunks,
+# by a pool of processes when "workers" is above 1, and added to the cache.
+# pdfminer ends the text of every page with a form feed, so the pages joined
+# together are the text of the whole range.
+def page_texts(file_path, page_start, page_end, workers=1, chunk=16, cache=None):
+    pages = range(page_start, page_end + 1)
+    cached = {}
+    if cache:
+        for page in pages:
+            text = cache.get(page)
+            if text is not None:
+                cached[page] = text
+    chunks = page_chunks([page for page in pages if page not in cached], max(chunk, 1))
+
+    pool = None
+    if workers > 1 and len(chunks) > 1:
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(chunks)))
+        extracted = pool.map(extract_pages, [file_path] * len(chunks), *zip(*chunks))
+    else:
+        extracted = (extract_pages(file_path, first, last) for first, last in chunks)
+
+    try:
+        chunks = zip(chunks, extracted)
+        last = page_start - 1
+        for page in pages:
+            if page in cached:
+                yield cached.pop(page)
+                continue
+            if page > last:
+                (_, last), ready = next(chunks)
+                for number, text in ready.items():
+                    count("extract", bytes=len(text), files=1)
+                    if cache:
+                        cache.put(number, text)
+            yield ready.get(page, "")
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+
+# Below function returns the text of the page range.
+def extract_range(file_path, page_start, page_end, workers=1, chunk=16, cache=None):
+    return "".join(page_texts(file_path, page_start, page_end, workers, chunk, cache))
+
+DESCRIPTION_PATTERN = r'(?P<paragraph>.+?(?:\n.+?)*?)\n\s*(?P<extent>\d+\s*(?:pp|p|items|ff))'
+EXTENT_DIGITS = re.compile(r'\d+')
+EXTENT_UNIT = re.compile(r'pp|p|items|ff', re.IGNORECASE)
+SPACES = re.compile(r'\s*')
+
+# Below function builds the spreadsheet row of one description.
+def description_row(paragraph, extent):
+    cleaned_paragraph = re.sub(r'\s{3,}', ' ', paragraph)
+
+    level = determine_level(extent)
+    
+    title = extract_first_sentence(cleaned_paragraph)
+
+    return {
+        'reference column': '',
+        'level': level,
+        'date': '',
+        'title': title,
+        'extent': extent,
+        'description': cleaned_paragraph
+    }
+
+# Below function returns the description rows found in the extracted text using
+# DESCRIPTION_PATTERN. It is kept as the reference for parse_lines(), its nested
+# lazy quantifiers backtrack heavily over long stretches of text without an extent.
+def parse_descriptions(text):
+    regexp = re.compile(DESCRIPTION_PATTERN, re.IGNORECASE)
+
+    data = []
+
+    for m in regexp.finditer(text):
+        paragraph = m.group('paragraph').strip()
+        extent = m.group('extent').strip()
+        data.append(description_row(paragraph, extent))
+    return data
+
+# Below function splits text arriving in pieces (the pages of a pdf) into lines.
+# Every line but the last was followed by a newline in the joined text.
+def split_lines(pieces):
+    tail = []
+    for piece in pieces:
+        lines = piece.split("\n")
+        if len(lines) > 1:
+            tail.append(lines[0])
+            yield "".join(tail)
+            yield from lines[1:-1]
+            tail = []
+        tail.append(lines[-1])
+    yield "".join(tail)
+
+# Lines of a stream, read ahead on demand and released once parsed.
+class LineWindow():
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.window = []
+        self.first = 0
+
+    def get(self, index):
+        '''
+        Returns line "index" of the stream, None past the last line.
+        '''
+        while index - self.first >= len(self.window):
+            line = next(self.lines, None)
+            if line is None:
+                return None
+            self.window.append(line)
+        return self.window[index - self.first]
+
+    def release(self, index):
+        del self.window[:index - self.first]
+        self.first = index
+
+# Below function is a streaming state machine giving the same rows as
+# parse_descriptions(): a description is a run of non-empty lines, starting where
+# the previous extent ended, up to the first line holding an extent ("12 pp",
+# "3 items" ...). An empty line before any extent discards the run. Each line is
+# read a bounded number of times, so the parse is linear in the length of the text,
+# and rows are yielded as soon as their extent is read.
+def parse_lines(lines):
+    window = LineWindow(lines)
+    blank_run = [0, -1]
+
+    # Returns the first line at or after "index" holding something other than
+    # whitespace with the column of that character, or None at the end. Runs of
+    # blank lines are remembered so that each one is scanned only once.
+    def next_text(index):
+        if blank_run[0] <= index <= blank_run[1]:
+            index = blank_run[1]
+        start = index
+        while True:
+            line = window.get(index)
+            if line is None:
+                return None
+            column = SPACES.match(line).end()
+            if column < len(line):
+                blank_run[:] = [start, index]
+                return index, column
+            index += 1
+
+    # Matches "\s*\d+\s*(?:pp|p|items|ff)" at the start of line "index", the
+    # whitespace may span lines. Returns the extent with the line and column where
+    # it ends, or None.
+    def extent_at(index):
+        found = next_text(index)
+        if found is None:
+            return None
+        first, column = found
+        line = window.get(first)
+        digits = EXTENT_DIGITS.match(line, column)
+        if not digits:
+            return None
+        last, end = first, SPACES.match(line, digits.end()).end()
+        if end == len(line):
+            found = next_text(first + 1)
+            if found is None:
+                return None
+            last, end = found
+        unit = EXTENT_UNIT.match(window.get(last), end)
+        if not unit:
+            return None
+        if last == first:
+            extent = line[column:unit.end()]
+        else:
+            between = [window.get(i) for i in range(first + 1, last)]
+            extent = "\n".join([line[column:]] + between + [window.get(last)[:unit.end()]])
+        return extent, last, unit.end()
+
+    index, column = 0, 0
+    while True:
+        line = window.get(index)
+        if line is None or window.get(index + 1) is None:
+            return
+        if column >= len(line):
+            index, column = index + 1, 0
+            continue
+
+        paragraph = [line[column:]]
+        following = index + 1
+        while True:
+            found = extent_at(following)
+            if found:
+                extent, index, column = found
+                yield description_row("\n".join(paragraph).strip(), extent.strip())
+                break
+            line = window.get(following)
+            if line == "" or window.get(following + 1) is None:
+                index, column = following, 0
+                break
+            paragraph.append(line)
+            following += 1
+        window.release(index)
+
+# Below function extracts the descriptions of one pdf into its own spreadsheet
+# and returns the rows written. The spreadsheet is named after "name", the name
+# of the pdf by default.
+def pdf_to_csv(args, file_path, log_name_source, name=None):
+    page_start = args.start
+    page_end = args.end
+    file_name = os.path.splitext(name or os.path.basename(file_path))[0]
+    workers = args.workers if args.parallel == 'y' else 1
+
+    generate_log(log_name_source, f"pdf file to be extracted - {file_path}")
+    if workers > 1:
+        generate_log(log_name_source, f"Extracting in chunks of {args.chunk} pages with {workers} processes")
+
+    cache = PageCache(args.cache_dir, file_path) if args.cache == 'y' else None
+    output_file = os.path.join(args.o, file_name+f"_{page_start}-{page_end}.csv")
+
+    if args.parser == 'regex':
+        with stage("extract"):
+            text = extract_range(file_path, page_start, page_end, workers, args.chunk, cache)
+        with stage("parse"):
+            data = parse_descriptions(text)
+        # Create a DataFrame from the extracted data
+        df = pd.DataFrame(data, columns=COLUMNS)
+        # Save DataFrame to CSV
+        df.to_csv(output_file, index=False)
+    else:
+        # Rows are written as soon as their extent is read, while the following
+        # pages are still being extracted.
+        data = []
+        with stage("extract"), open(output_file, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS, lineterminator=os.linesep)
+            writer.writeheader()
+            pages = page_texts(file_path, page_start, page_end, workers, args.chunk, cache)
+            for row in parse_lines(split_lines(pages)):
+                writer.writerow(row)
+                data.append(row)
+
+    print(f"Spreadsheet created at {output_file} successfully.")
+    generate_log(log_name_source, f"Spreadsheet successfully created at {output_file}")
+    return data
+
 # Main function to extract the content from pdf and store it in the ecel spreadsheet.
 def main():
     args = arg_parse()
+    configure_logging(args)
     
     desktop_logs_dir = make_desktop_logs_dir()
     join = os.path.join
@@ -71,67 +416,65 @@ def main():
     page_end = args.end
     output_path = args.o
 
+    file_name, file_ext = os.path.splitext(os.path.normpath(file_path))
+    file_name = os.path.basename(file_name)
+
+    log_name_source_ = "pdf_extractor_" + file_name + "_" + time.strftime("_%Y_%m_%dT%H_%M_%S") + ".log"
+    log_name_source = join(desktop_logs_dir, log_name_source_)
+
     if not os.path.exists(file_path):
         print(' - Input file does not exist, enter proper file path !')
         generate_log(log_name_source, ' - Input file does not exist, enter proper file path - exiting !')
         sys.exit()
-    
-    file_name, file_ext = os.path.splitext(file_path)
-    file_name = os.path.basename(file_name)
 
-    log_name_source_ = "pdf_extractor_" + file_name + "_" + time.strftime("_%Y_%m_%dT%H_%M_%S") + ".log"
-    log_name_source = join(desktop_logs_dir, log_name_source_)
+    start_run("pdf2csv", log_name_source, args)
 
-    if not os.path.isfile(file_path) or file_ext != ".pdf":
+    if os.path.isdir(file_path):
+        pdf_files = []
+        for root, _, files in os.walk(file_path):
+            pdf_files.extend(join(root, file) for file in files if os.path.splitext(file)[1].lower() == ".pdf")
+        pdf_files.sort()
+        if not pdf_files:
+            print(' - No pdf files found in the input directory !')
+            generate_log(log_name_source, ' - No pdf files found in the input directory !')
+            sys.exit()
+    elif file_ext != ".pdf":
         print(' - Input must be a file of pdf format !')
         generate_log(log_name_source, ' - Input must be a file of pdf format !')
         sys.exit()
+    else:
+        pdf_files = [file_path]
 
     if not isinstance(page_start, int) or not isinstance(page_end, int) or page_start > page_end:
         print(' - Start and ending page numbers should be positive whole numbers and starting page number should be lesser than ending page number')
         generate_log(log_name_source, ' - Input must be a file of pdf format !')
         sys.exit()
-    
+
     os.makedirs(output_path, exist_ok=True)
 
-    generate_log(log_name_source, f"pdf file to be extracted - {file_path}")
     generate_log(log_name_source, f"Starting page : {page_start}")
     generate_log(log_name_source, f"Page end : {page_end}")
 
-    text = pdfminer.high_level.extract_text(file_path, page_numbers=list(range(page_start - 1, page_end)))
-    pattern = r'(?P<paragraph>.+?(?:\n.+?)*?)\n\s*(?P<extent>\d+\s*(?:pp|p|items|ff))'
-    regexp = re.compile(pattern, re.IGNORECASE)
+    if len(pdf_files) == 1 and not os.path.isdir(file_path):
+        pdf_to_csv(args, file_path, log_name_source)
+        return
 
-    data = []
+    print(f"Batch mode - extracting {len(pdf_files)} pdf files")
+    generate_log(log_name_source, f"Batch mode - extracting {len(pdf_files)} pdf files from {file_path}")
+    combined = []
+    for pdf_file in pdf_files:
+        # Named after the path in the input directory, pdfs of the same name in
+        # different sub folders must not overwrite each other's spreadsheet.
+        rel_path = os.path.relpath(pdf_file, file_path)
+        for row in pdf_to_csv(args, pdf_file, log_name_source, name=rel_path.replace(os.sep, "_")):
+            combined.append({'file': rel_path, **row})
 
-    for m in regexp.finditer(text):
-        paragraph = m.group('paragraph').strip()
-        extent = m.group('extent').strip()
-        
-        cleaned_paragraph = re.sub(r'\s{3,}', ' ', paragraph)
-
-        level = determine_level(extent)
-        
-        title = extract_first_sentence(cleaned_paragraph)
-
-        data.append({
-            'reference column': '',
-            'level': level,
-            'date': '',
-            'title': title,
-            'extent': extent,
-            'description': cleaned_paragraph
-        })
-
-    # Create a DataFrame from the extracted data
-    df = pd.DataFrame(data, columns=['reference column', 'level', 'date', 'title', 'extent', 'description'])
-    output_file = join(output_path, file_name+f"_{page_start}-{page_end}.csv")
-
-    # Save DataFrame to CSV
+    df = pd.DataFrame(combined, columns=['file'] + COLUMNS)
+    output_file = join(output_path, file_name+f"_combined_{page_start}-{page_end}.csv")
     df.to_csv(output_file, index=False)
 
-    print(f"Spreadsheet created at {output_file} successfully.")
-    generate_log(log_name_source, f"Spreadsheet successfully created at {output_file}")
+    print(f"Combined spreadsheet created at {output_file} successfully.")
+    generate_log(log_name_source, f"Combined spreadsheet successfully created at {output_file}")
 
 if __name__ == "__main__":
-    main()
+    run_main(main)
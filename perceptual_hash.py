@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+import csv
+import numpy as np
+from PIL import Image
+
+# Collections are trusted archival masters, large scans must not be refused
+# by Pillow's decompression bomb check.
+Image.MAX_IMAGE_PIXELS = None
+
+# Below function returns every file extension listed in the "map_list" column
+# of the image format mapper csv file.
+def image_extensions(mapper="image_format_mapper.csv"):
+    extensions = set()
+    with open(mapper, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            for ext in row["map_list"].split(","):
+                extensions.add(ext.strip().lower())
+    return extensions
+
+# Below function builds the orthonormal DCT-II matrix used by the pHash algorithm.
+def dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0, :] = np.sqrt(1.0 / n)
+    return matrix
+
+# Below function opens an image and returns it as a greyscale numpy array
+# of the requested (width, height).
+def load_grey(path, size):
+    with Image.open(path) as img:
+        # Let the JPEG decoder downscale while decoding, much cheaper than a full decode.
+        img.draft('L', (size[0] * 4, size[1] * 4))
+        img = img.convert('L').resize(size, Image.LANCZOS)
+        return np.asarray(img, dtype=np.float32)
+
+# Below function packs each row of a boolean matrix into one integer hash.
+def pack_bits(bits):
+    packed = np.packbits(bits.reshape(bits.shape[0], -1), axis=1)
+    return [int.from_bytes(row.tobytes(), 'big') for row in packed]
+
+# Below function computes the difference hash of a stack of greyscale images
+# shaped (n, hash_size, hash_size + 1) in a single vectorized step.
+def dhash_stack(stack):
+    return pack_bits(stack[:, :, 1:] > stack[:, :, :-1])
+
+# Below function computes the DCT based perceptual hash of a stack of greyscale
+# images shaped (n, 4 * hash_size, 4 * hash_size) in a single vectorized step.
+def phash_stack(stack, hash_size=8):
+    d = dct_matrix(stack.shape[1])
+    dct = np.einsum('ij,njk,lk->nil', d, stack, d)
+    low = dct[:, :hash_size, :hash_size]
+    medians = np.median(low.reshape(low.shape[0], -1), axis=1)
+    return pack_bits(low > medians[:, None, None])
+
+# Below function returns the hash of every readable image in "paths" as a
+# dictionary, images that cannot be decoded are returned in a separate list.
+def hash_images(paths, method='dhash', hash_size=8, mapper=map, batch=256):
+    if method == 'dhash':
+        size = (hash_size + 1, hash_size)
+        hasher = dhash_stack
+    else:
+        size = (4 * hash_size, 4 * hash_size)
+        hasher = lambda stack: phash_stack(stack, hash_size)
+
+    def load(path):
+        try:
+            return path, load_grey(path, size)
+        except Exception as e:
+            return path, e
+
+    hashes = {}
+    unreadable = []
+    paths = list(paths)
+    for start in range(0, len(paths), batch):
+        loaded = []
+        for path, result in mapper(load, paths[start:start + batch]):
+            if isinstance(result, Exception):
+                unreadable.append((path, result))
+            else:
+                loaded.append((path, result))
+        if loaded:
+            stack = np.stack([pixels for _, pixels in loaded])
+            for (path, _), value in zip(loaded, hasher(stack)):
+                hashes[path] = value
+    return hashes, unreadable
+
+# Below function returns the number of differing bits between two hashes.
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+# Metric tree over hamming distance. Every node keeps the items sharing its
+# hash and its children keyed by their distance to the node, so a query within
+# distance k only descends into children whose key lies in [d - k, d + k].
+class BKTree():
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, item):
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(value, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, [item], {}]
+                return
+            node = child
+
+    def query(self, value, k):
+        '''
+        Returns (item, distance) for every stored item within distance k of value.
+        '''
+        found = []
+        if self.root is None:
+            return found
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= k:
+                found.extend((item, d) for item in node[1])
+            for key, child in node[2].items():
+                if d - k <= key <= d + k:
+                    stack.append(child)
+        return found
+
+# Below function returns, for each image in the order of "hashes", the later
+# images lying within distance k of it. Each image is queried against the tree
+# of the images seen before it and then inserted, so every pair is found once.
+def near_duplicates(hashes, k):
+    tree = BKTree()
+    matches = {}
+    for path, value in hashes.items():
+        for earlier, d in tree.query(value, k):
+            matches.setdefault(earlier, []).append((path, d))
+        tree.add(value, path)
+    return [(path, matches[path]) for path in hashes if path in matches]
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import json
+import argparse
+import threading
+import cProfile
+from contextlib import contextmanager, nullcontext
+
+PROFILE_CHOICES = ['cprofile', 'trace', 'all']
+
+# Below function adds the profiling option shared by all scripts to their argument parser.
+def add_profile_args(parser):
+    parser.add_argument('-profile', '--profile',
+                        choices=PROFILE_CHOICES,
+                        type=str,
+                        default="",
+                        help="cprofile: dump a .pstats profile of the run next to the log. trace: write a Chrome/Perfetto \
+                            trace timeline (<log name>_trace.json) of the walks, hashes, copies and external tool calls. all: both")
+
+# Recorder of Chrome trace format "complete" events. When disabled, span() hands
+# back one shared no-op context manager so instrumented code pays only a call.
+class Tracer():
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.threads = set()
+        self.origin = time.perf_counter_ns()
+        self._null = nullcontext()
+
+    def enable(self):
+        self.enabled = True
+        self.origin = time.perf_counter_ns()
+
+    def span(self, name, cat="stage", **args):
+        if not self.enabled:
+            return self._null
+        return self._span(name, cat, args)
+
+    @contextmanager
+    def _span(self, name, cat, args):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            tid = threading.get_native_id()
+            if tid not in self.threads:
+                self.threads.add(tid)
+                self.events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                                    "args": {"name": threading.current_thread().name}})
+            event = {"name": name, "cat": cat, "ph": "X", "pid": os.getpid(), "tid": tid,
+                     "ts": (start - self.origin) / 1000, "dur": (end - start) / 1000}
+            if args:
+                event["args"] = args
+            self.events.append(event)
+
+    def write(self, trace_file):
+        with open(trace_file, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+tracer = Tracer()
+span = tracer.span
+
+# Below function returns "<log name><suffix>" for the log of the current run, or
+# "<script><suffix>" in the working directory if the run never named its log.
+def _output_path(script, suffix):
+    from metrics import run_metrics
+    if run_metrics.log_name_source:
+        return os.path.splitext(run_metrics.log_name_source)[0] + suffix
+    return os.path.abspath(script + suffix)
+
+# Below function runs a script's main() honouring the -profile option: main() is run
+# under cProfile and/or with the trace recorder enabled, and the .pstats/trace files
+# are written next to the log once main() returns or exits.
+def run_main(main):
+    parser = argparse.ArgumentParser(add_help=False)
+    add_profile_args(parser)
+    mode = parser.parse_known_args()[0].profile
+    if not mode:
+        return main()
+
+    script = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    if mode in ('trace', 'all'):
+        tracer.enable()
+    profiler = cProfile.Profile() if mode in ('cprofile', 'all') else None
+    try:
+        with tracer.span("main", "run"):
+            if profiler:
+                return profiler.runcall(main)
+            return main()
+    finally:
+        if profiler:
+            pstats_file = _output_path(script, ".pstats")
+            profiler.dump_stats(pstats_file)
+            print(f"Profile written to {pstats_file} (inspect with: python3 -m pstats {pstats_file})")
+        if tracer.enabled:
+            trace_file = _output_path(script, "_trace.json")
+            tracer.write(trace_file)
+            print(f"Trace timeline written to {trace_file} (open it in https://ui.perfetto.dev or chrome://tracing)")
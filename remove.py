@@ -3,7 +3,10 @@ import os
 import argparse
 import time
 import sys
-from logger import make_desktop_logs_dir, generate_log, remove_bad_files
+from concurrent.futures import ThreadPoolExecutor
+from logger import make_desktop_logs_dir, generate_log, is_unwanted, add_logging_args, configure_logging
+from metrics import add_metrics_args, start_run, stage, count
+from profiling import add_profile_args, run_main
 
 # Below function parses input arguments from the command line provided by the user.
 def arg_parse():
@@ -34,18 +37,121 @@ def arg_parse():
                         default="",
                         help="Would you like to remove empty directories? Enter y/n")     
 
+    parser.add_argument('-dry_run',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="Only print the cleanup plan (files, folders and bytes to be reclaimed) without deleting anything. Enter y/n")
+
+    parser.add_argument('-workers',
+                        type=int,
+                        default=8,
+                        help="Number of files/folders deleted at the same time (useful on network shares)")
+
+    add_logging_args(parser)
+    add_metrics_args(parser)
+    add_profile_args(parser)
+
     parsed_args = parser.parse_args()
     return parsed_args
 
+# Below function walks the input directory once, bottom-up, and returns the cleanup plan:
+# the files to delete as (path, size, reason) and the folders that end up empty once
+# those files and their own empty sub-folders are gone. Because children are visited
+# before their parent, a folder that only becomes empty through the cleanup is
+# removed in the same run. The input directory itself is never removed.
+def cleanup_plan(input_path, formats, remove_empty):
+    files = []
+    folders = []
+    emptied = set()
+
+    for root, subdirs, names in os.walk(input_path, topdown=False):
+        remaining = 0
+        for name in names:
+            path = os.path.join(root, name)
+            if is_unwanted(name):
+                reason = 'unwanted'
+            elif str(os.path.splitext(name)[1]).lower() in formats:
+                reason = 'format'
+            else:
+                remaining += 1
+                continue
+            try:
+                size = os.lstat(path).st_size
+            except OSError:
+                size = 0
+            files.append((path, size, reason))
+
+        if remove_empty and root != input_path and remaining == 0 \
+                and all(os.path.join(root, subdir) in emptied for subdir in subdirs):
+            emptied.add(root)
+            folders.append(root)
+
+    return files, folders
+
+# Below function prints and logs the cleanup plan totals.
+def report_plan(files, folders, log_name_source):
+    unwanted = [f for f in files if f[2] == 'unwanted']
+    formats = [f for f in files if f[2] == 'format']
+    reclaimed = sum(f[1] for f in files)
+    for label, count, size in (("Unwanted files", len(unwanted), sum(f[1] for f in unwanted)),
+                               ("Files of the requested formats", len(formats), sum(f[1] for f in formats))):
+        print(f"{label} to remove - {count} ({size / (1024*1024)} MB)")
+        generate_log(log_name_source, f"{label} to remove - {count} ({size / (1024*1024)} MB)")
+    print(f"Empty folders to remove - {len(folders)}")
+    generate_log(log_name_source, f"Empty folders to remove - {len(folders)}")
+    print(f"Total space to be reclaimed - {reclaimed / (1024*1024)} MB")
+    generate_log(log_name_source, f"Total space to be reclaimed - {reclaimed / (1024*1024)} MB")
+
+# Below function deletes a single file or empty folder and returns the error, if any.
+def _remove(path, remover):
+    try:
+        remover(path)
+    except OSError as e:
+        return e
+    return None
+
+# Below function carries out the cleanup plan. Files are unlinked in batches across a
+# thread pool, then the folders are removed level by level, deepest first, so a folder
+# is only removed once all of its sub-folders are gone.
+def execute_plan(files, folders, workers, log_name_source):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        file_paths = [f[0] for f in files]
+        for (path, _, reason), error in zip(files, pool.map(lambda p: _remove(p, os.remove), file_paths)):
+            if error is not None:
+                print(f"Could not remove {path} - {error}")
+                generate_log(log_name_source, f"Could not remove {path} - {error}")
+            elif reason == 'unwanted':
+                print(('***********************' + 'removing: ' + path))
+                generate_log(log_name_source, 'EVENT = Unwanted file removal - %s was removed' % path)
+            else:
+                print(f"File {os.path.basename(path)} removed from {os.path.dirname(path)}")
+                generate_log(log_name_source, f"File {os.path.basename(path)} removed from {os.path.dirname(path)}")
+
+        levels = {}
+        for folder in folders:
+            levels.setdefault(folder.count(os.sep), []).append(folder)
+        for depth in sorted(levels, reverse=True):
+            level = levels[depth]
+            for path, error in zip(level, pool.map(lambda p: _remove(p, os.rmdir), level)):
+                if error is not None:
+                    print(f"Could not remove folder {path} - {error}")
+                    generate_log(log_name_source, f"Could not remove folder {path} - {error}")
+                else:
+                    print(f"Empty Folder {os.path.basename(path)} removed from {os.path.dirname(path)}")
+                    generate_log(log_name_source, f"Empty Folder {os.path.basename(path)} removed from {os.path.dirname(path)}")
+
 # Below main function provides the logic on removing files belonging to a specific format
 # and removes empty directories if necessary.
 def main():
 
     args = arg_parse()
+    configure_logging(args)
     input_path = args.i
     log_name_source_ = "remove_bad_"  + str(os.path.basename(input_path)) + time.strftime("_%Y_%m_%dT%H_%M_%S") + ".log"
     desktop_logs_dir = make_desktop_logs_dir()
     log_name_source = os.path.join(desktop_logs_dir, log_name_source_)
+    start_run("remove", log_name_source, args)
 
     if args.formats or args.ref:
         if not os.path.isdir(input_path):
@@ -53,29 +159,26 @@ def main():
             generate_log(log_name_source, ' - Input must be a directory/folder - exiting remove.py!')
             sys.exit()
         
-        remove_bad_files(input_path, log_name_source)
-        
-        if args.formats:
-            formats = list(str(args.formats).strip().split(' '))    
-            for root, subdirs, files in os.walk(input_path):
-                
-                if files == () or files == []:
-                    continue
-
-                for file in files:
-                    if str(os.path.splitext(file)[1]).lower() in formats:
-                        print(f"File {file} removed from {root}")
-                        generate_log(log_name_source, f"File {file} removed from {root}")
-                        os.remove(os.path.join(root,file))
-        
-        if args.ref == 'y':
-            for root, subdirs, files in os.walk(input_path):    
-                for subdir in subdirs:
-                    l = len(os.listdir(os.path.join(root,subdir)))
-                    if l == 0:
-                        print(f"Empty Folder {subdir} removed from {root}")
-                        generate_log(log_name_source, f"Empty Folder {subdir} removed from {root}")
-                        os.rmdir(os.path.join(root,subdir))
+        formats = list(str(args.formats).strip().split(' ')) if args.formats else []
+        with stage("plan"):
+            files, folders = cleanup_plan(input_path, formats, args.ref == 'y')
+
+        if args.dry_run == 'y':
+            print("Dry run - nothing will be deleted. Planned removals:")
+            generate_log(log_name_source, "Dry run - nothing will be deleted. Planned removals:")
+            for path, size, reason in files:
+                print(f"[{reason}] {path} ({size} bytes)")
+                generate_log(log_name_source, f"[{reason}] {path} ({size} bytes)")
+            for folder in folders:
+                print(f"[empty folder] {folder}")
+                generate_log(log_name_source, f"[empty folder] {folder}")
+            report_plan(files, folders, log_name_source)
+            return
+
+        report_plan(files, folders, log_name_source)
+        with stage("delete"):
+            execute_plan(files, folders, args.workers, log_name_source)
+        count("delete", bytes=sum(f[1] for f in files), files=len(files))
     else:
         print(' - Either "formats" or "refs" argument is mandatory! - exiting remove.py!')
         generate_log(log_name_source, ' - Either "formats" or "refs" argument is mandatory! - exiting remove.py!')
@@ -83,6 +186,4 @@ def main():
 
 # Below code marks the start of execution of the program.
 if __name__ == "__main__":
-    main()
-                
-        
+    run_main(main)
@@ -4,7 +4,11 @@ import argparse
 import time
 import sys
 import filecmp
-from logger import make_desktop_logs_dir, generate_log, remove_bad_files
+from concurrent.futures import ThreadPoolExecutor
+from logger import make_desktop_logs_dir, generate_log, remove_bad_files, add_logging_args, configure_logging
+from metrics import add_metrics_args, start_run, stage, count
+from profiling import add_profile_args, run_main, span
+import hash_reader
 
 # Below function parses input arguments from the command line provided by the user.
 def arg_parse():
@@ -25,18 +29,145 @@ def arg_parse():
                         nargs='+', 
                         help="Full path of input directory to summarize") 
 
+    parser.add_argument('-parallel',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="Walk the input directories concurrently and hash candidate files in a worker pool. Enter y/n")
+
+    parser.add_argument('-per_device',
+                        type=int,
+                        default=2,
+                        help="Maximum number of files hashed at the same time on each disk/share (used with -parallel y)")
+
+    parser.add_argument('-near',
+                        choices=['y', 'n'],
+                        type=str,
+                        default='n',
+                        help="Search for visually similar images (perceptual hashing) instead of byte-identical files. Enter y/n")
+
+    parser.add_argument('-hash',
+                        choices=['dhash', 'phash'],
+                        type=str,
+                        default='dhash',
+                        help="Perceptual hash used with -near y")
+
+    parser.add_argument('-distance',
+                        type=int,
+                        default=6,
+                        help="Maximum number of differing hash bits (out of 64) for two images to be reported as near duplicates")
+
+    add_logging_args(parser)
+    add_metrics_args(parser)
+    add_profile_args(parser)
+
     parsed_args = parser.parse_args()
     return parsed_args
 
+# Below function returns the md5 checksum of a file, read by the hash reader of
+# the calling thread.
+def file_digest(fpath):
+    with span("hash", "hash", file=fpath):
+        md5, read_size = hash_reader.file_digest(fpath)
+    count("hash", bytes=read_size, files=1)
+    return md5
+
+# Below function walks a single input directory and returns every file found
+# as (path, size, device) in the same order as the serial walk.
+def walk_sizes(input_path):
+    entries = []
+    with span("walk", "walk", root=input_path):
+        for subroot, subdirs, files in os.walk(input_path):
+            device = os.stat(subroot).st_dev
+            for file in files:
+                fpath = os.path.join(subroot, file)
+                entries.append((fpath, os.path.getsize(fpath), device))
+    return entries
+
+# Below function is the parallel counterpart of the serial comparison in main().
+# Input directories are walked concurrently, then every file sharing its size with
+# another file is hashed in a pool owned by its device, so each disk/share only
+# serves "per_device" reads at a time. Groups are yielded in the same order as the
+# serial mode reports them.
+def parallel_duplicates(input_paths, per_device):
+
+    with ThreadPoolExecutor(max_workers=len(input_paths)) as walkers:
+        walked = list(walkers.map(walk_sizes, input_paths))
+
+    files_by_size = {}
+    devices = {}
+    for entries in walked:
+        for fpath, size, device in entries:
+            files_by_size.setdefault(size, []).append(fpath)
+            devices[fpath] = device
+
+    pools = {}
+    digests = {}
+    try:
+        for files_this_size in files_by_size.values():
+            if len(files_this_size) < 2:
+                continue
+            for fpath in files_this_size:
+                device = devices[fpath]
+                if device not in pools:
+                    pools[device] = ThreadPoolExecutor(max_workers=per_device)
+                digests[fpath] = pools[device].submit(file_digest, fpath)
+
+        for files_this_size in files_by_size.values():
+            if len(files_this_size) < 2:
+                continue
+            groups = {}
+            for fpath in files_this_size:
+                groups.setdefault(digests[fpath].result(), []).append(fpath)
+            for group in groups.values():
+                if len(group) > 1:
+                    yield group[0], group[1:]
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True, cancel_futures=True)
+
+# Below function reports images that are visually similar across the input
+# directories (same picture saved as TIFF master, JPEG access copy, re-scan ...).
+# Only the formats listed in image_format_mapper.csv are considered.
+def near_duplicate_images(args, log_name_source):
+    from perceptual_hash import image_extensions, hash_images, near_duplicates
+
+    extensions = image_extensions()
+    images = []
+    for input_path in args.i:
+        for subroot, subdirs, files in os.walk(input_path):
+            for file in files:
+                if os.path.splitext(file)[1].lower() in extensions:
+                    images.append(os.path.join(subroot, file))
+
+    print(f"Computing {args.hash} for {len(images)} images")
+    generate_log(log_name_source, f"Computing {args.hash} for {len(images)} images")
+
+    if args.parallel == 'y':
+        with ThreadPoolExecutor() as pool:
+            hashes, unreadable = hash_images(images, args.hash, mapper=pool.map)
+    else:
+        hashes, unreadable = hash_images(images, args.hash)
+
+    for fpath, e in unreadable:
+        print(f"Could not decode {fpath} - skipped ({e})")
+        generate_log(log_name_source, f"Could not decode {fpath} - skipped ({e})")
+
+    for fpath1, similar in near_duplicates(hashes, args.distance):
+        print(f"Near duplicates for {fpath1} : {similar}\n")
+        generate_log(log_name_source, f"Near duplicates for {fpath1} : {similar}")
+
 # Below function lists out all duplicates pairs of files across folders.
 def main():
 
     args = arg_parse()
+    configure_logging(args)
     input_paths = args.i
     log_name_source_ = "search_duplicates_" + time.strftime("_%Y_%m_%dT%H_%M_%S") + ".log"
     desktop_logs_dir = make_desktop_logs_dir()
     join = os.path.join
     log_name_source = join(desktop_logs_dir, log_name_source_)
+    start_run("search_duplicates", log_name_source, args)
 
     
     files_by_size = {}
@@ -51,43 +182,63 @@ def main():
             generate_log(log_name_source, ' - Input must be a directory/folder - exiting search_duplicates.py!')
             sys.exit()
 
-        remove_bad_files(input_path, log_name_source)
+        with stage("sweep"):
+            remove_bad_files(input_path, log_name_source)
 
-        for subroot, subdirs, files in os.walk(input_path):
-            for file in files:
-                fpath = join(subroot, file)
-                size = os.path.getsize(fpath)
-                if size not in files_by_size:
-                    files_by_size[size] = [fpath]
-                else:
-                    files_by_size[size].append(fpath)
+        if args.parallel == 'y' or args.near == 'y':
+            continue
+
+        with stage("walk"):
+            for subroot, subdirs, files in os.walk(input_path):
+                for file in files:
+                    fpath = join(subroot, file)
+                    size = os.path.getsize(fpath)
+                    if size not in files_by_size:
+                        files_by_size[size] = [fpath]
+                    else:
+                        files_by_size[size].append(fpath)
     
+    if args.near == 'y':
+        with stage("near_duplicates"):
+            near_duplicate_images(args, log_name_source)
+        return
+
+    if args.parallel == 'y':
+        print(f"Parallel mode - hashing candidates with {args.per_device} worker(s) per device")
+        generate_log(log_name_source, f"Parallel mode - hashing candidates with {args.per_device} worker(s) per device")
+        with stage("compare"):
+            for fpath1, duplicates in parallel_duplicates(input_paths, args.per_device):
+                print(f"Duplicates for {fpath1} : {duplicates}\n")
+                generate_log(log_name_source, f"Duplicates for {fpath1} : {duplicates}")
+        return
+
     checked_files = set()
 
-    for fsize in files_by_size:
-        files_this_size = files_by_size[fsize]
-        L = len(files_this_size)
-        if L > 1:
+    with stage("compare"):
+        for fsize in files_by_size:
+            files_this_size = files_by_size[fsize]
+            L = len(files_this_size)
+            if L > 1:
             
-            for i in range(0, L):
-                fpath1 = files_this_size[i]
-                if fpath1 in checked_files:
-                    continue
+                for i in range(0, L):
+                    fpath1 = files_this_size[i]
+                    if fpath1 in checked_files:
+                        continue
                 
-                duplicates = []
+                    duplicates = []
                 
-                for j in range(i+1, L):
-                    fpath2 =  files_this_size[j]
-                    if fpath2 not in checked_files and filecmp.cmp(fpath1, fpath2, shallow=False):
-                        duplicates.append(fpath2)
-                        checked_files.add(fpath2)
+                    for j in range(i+1, L):
+                        fpath2 =  files_this_size[j]
+                        if fpath2 not in checked_files and filecmp.cmp(fpath1, fpath2, shallow=False):
+                            duplicates.append(fpath2)
+                            checked_files.add(fpath2)
             
-                if len(duplicates) > 0:
-                    checked_files.add(fpath1)
-                    print(f"Duplicates for {fpath1} : {duplicates}\n")
-                    generate_log(log_name_source, f"Duplicates for {fpath1} : {duplicates}")
-                    del duplicates
+                    if len(duplicates) > 0:
+                        checked_files.add(fpath1)
+                        print(f"Duplicates for {fpath1} : {duplicates}\n")
+                        generate_log(log_name_source, f"Duplicates for {fpath1} : {duplicates}")
+                        del duplicates
 
 # Below code marks the start of execution of the program.
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_main(main)